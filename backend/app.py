@@ -1,32 +1,78 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
+import re
 import json
+import math
+import atexit
+import fcntl
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from history_store import HistoryCache, JsonlHistoryStore, JsonPortfolioStore, SqliteStore, atomic_write_json
+from timeseries import bucket_ohlc, lttb_indices, parse_resolution
+from asset_series import AssetSeriesStore, SYMBOL_PATTERN, bucket_records
+from rebalance import category_indices, rebalance, stack_portfolios, sweep
+from singleflight import SingleFlight
+from prompt_templates import CompiledTemplate, PromptTemplates
+from logging_config import configure_logging
+from metrics import cache_lookups, file_io_bytes, http_request_seconds, registry as metrics_registry, span, upstream_requests, upstream_retries
 from openai import OpenAI
 import datetime
 import httpx
+import numpy as np
 from httpx import Proxy
-import traceback
+import logging
 from typing import Dict, List
 import threading
+import queue
+import time
+import random
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 
 # Load environment variables
 load_dotenv()
 
 # API configuration with defaults
-CMC_BASE_URL = 'https://pro-api.coinmarketcap.com/v1'  # Default URL
+CMC_BASE_URL = os.getenv('CMC_BASE_URL', 'https://pro-api.coinmarketcap.com/v1')  # Overridable for local stand-ins
 CMC_API_KEY = os.getenv('CMC_API_KEY', '')  # Your API key from .env
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')  # Your OpenAI key from .env
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # None uses the official endpoint
+
+# CoinMarketCap HTTP client configuration
+CMC_CONNECT_TIMEOUT = float(os.getenv('CMC_CONNECT_TIMEOUT', '3.05'))  # Seconds to establish a connection
+CMC_READ_TIMEOUT = float(os.getenv('CMC_READ_TIMEOUT', '10'))  # Seconds to wait for response data
+CMC_POOL_MAXSIZE = int(os.getenv('CMC_POOL_MAXSIZE', '10'))  # Keep-alive connections kept per host
+CMC_MAX_RETRIES = int(os.getenv('CMC_MAX_RETRIES', '3'))  # Retries after the first attempt
+CMC_BACKOFF_BASE_SECONDS = float(os.getenv('CMC_BACKOFF_BASE_SECONDS', '0.5'))
+CMC_BACKOFF_MAX_SECONDS = float(os.getenv('CMC_BACKOFF_MAX_SECONDS', '8'))
+CMC_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# OpenAI HTTP client configuration
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '60'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '10'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '5'))
+
+# Logging configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG enables the per-request debug messages
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' lines or plain 'text'
+DEBUG = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')  # Flask debug mode and reloader
+
+# Records are formatted and written by a background thread, never by request threads
+log_handler = configure_logging(LOG_LEVEL, LOG_FORMAT)
+atexit.register(log_handler.stop)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000", "https://portfolio-crypto-frontend.onrender.com"]}})
 
 # Configure Flask for UTF-8
 app.config['JSON_AS_ASCII'] = False
-app.config['DEBUG'] = True  # Enable debug mode
+app.config['DEBUG'] = DEBUG
 
 def add_header(response):
     """Add CORS headers to response"""
@@ -40,234 +86,671 @@ def json_response(data):
     response = jsonify(data)
     return add_header(response)
 
+def sse_event(event, data):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    """Helper function to stream Server-Sent Events without buffering"""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+    return response
+
 # Global lock for file operations
 portfolio_lock = threading.Lock()
 
 # Configuration constants
-MAX_HISTORY_ENTRIES = 1000  # Maximum number of history entries to keep
-MAX_HISTORY_AGE_DAYS = 90   # Maximum age of history entries in days
-HISTORY_FILE_PATH = os.path.join('data', 'portfolio_history.json')
+MAX_HISTORY_ENTRIES = int(os.getenv('MAX_HISTORY_ENTRIES', '1000'))  # Maximum number of history entries to keep
+MAX_HISTORY_AGE_DAYS = int(os.getenv('MAX_HISTORY_AGE_DAYS', '90'))    # Maximum age of history entries in days
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # 'json' files or 'sqlite'
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', os.path.join('data', 'portfolio.db'))
+MIN_HISTORY_POINTS = 3      # Smallest max_points accepted by the history endpoint
+MAX_HISTORY_POINTS = 10000  # Largest max_points accepted by the history endpoint
+HISTORY_FILE_PATH = os.path.join('data', 'portfolio_history.jsonl')  # Append-only history log
+LEGACY_HISTORY_FILE_PATH = os.path.join('data', 'portfolio_history.json')  # Migrated on first use
+HISTORY_COMPACT_EVERY = int(os.getenv('HISTORY_COMPACT_EVERY', '100'))  # Appends between compactions
+
+# Multiple portfolios keyed by ID; the default one is the original portfolio with history
+DEFAULT_PORTFOLIO_ID = 'default'
+PORTFOLIO_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+PORTFOLIOS_DIR = os.path.join('data', 'portfolios')  # Additional portfolios with the JSON backend
+MAX_BATCH_PORTFOLIOS = int(os.getenv('MAX_BATCH_PORTFOLIOS', '1000'))  # Largest number of portfolios valued per request
+
+# Rebalancing strategy: target share of each bucket and tolerance in percentage points
+STABLECOINS = ['USDT', 'MUSD', 'USDB']
+STABLE_BUCKET = 'stable'
+DEFAULT_REBALANCE_BUCKET = 'crypto'  # Bucket for symbols not listed in any other bucket
+REBALANCE_BUCKETS = {
+    'crypto': {'target': 0.7},
+    'stable': {'target': 0.3, 'symbols': STABLECOINS}
+}
+REBALANCE_THRESHOLD = 2.5
+MAX_SWEEP_SCENARIOS = int(os.getenv('MAX_SWEEP_SCENARIOS', '10000'))  # Largest target x tolerance grid per sweep
+
+# Quote cache configuration
+QUOTE_CONVERT_CURRENCY = 'BRL'
+QUOTE_CACHE_TTL_SECONDS = float(os.getenv('QUOTE_CACHE_TTL_SECONDS', '60'))
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv('QUOTE_CACHE_MAX_ENTRIES', '512'))
+QUOTE_SNAPSHOT_PATH = os.path.join('data', 'quote_snapshot.json')  # Quotes shared between workers
+QUOTE_STALE_MAX_AGE_SECONDS = float(os.getenv('QUOTE_STALE_MAX_AGE_SECONDS', '3600'))  # Served at once while refreshing
+
+# Background price poller configuration
+PRICE_POLLER_ENABLED = os.getenv('PRICE_POLLER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PRICE_POLL_INTERVAL_SECONDS = float(os.getenv('PRICE_POLL_INTERVAL_SECONDS', '300'))
+HISTORY_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv('HISTORY_SNAPSHOT_INTERVAL_SECONDS', '3600'))
+PRICE_POLLER_LOCK_PATH = os.path.join('data', 'price_poller.lock')
+
+# Symbols priced locally from a reference quote instead of being requested from CMC
+SYNTHETIC_QUOTE_SYMBOLS = {'USDB': 'USDT'}
+
+# AI analysis cache configuration
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', '900'))
+ANALYSIS_CACHE_PRECISION = int(os.getenv('ANALYSIS_CACHE_PRECISION', '1'))  # Decimals kept from allocation percentages
+ANALYSIS_CACHE_DIR = os.path.join('data', 'analysis_cache')
+ANALYSIS_CACHE_SWEEP_INTERVAL_SECONDS = float(os.getenv('ANALYSIS_CACHE_SWEEP_INTERVAL_SECONDS', '300'))  # Between scans for expired files
+ANALYSIS_JOBS_DIR = os.path.join('data', 'analysis_jobs')  # Job status by fingerprint, readable by every worker
+ANALYSIS_JOB_RETENTION_SECONDS = float(os.getenv('ANALYSIS_JOB_RETENTION_SECONDS', '600'))
+
+# Prompt templates, compiled at startup and reloaded when the files change
+PROMPTS_DIR = 'prompts'
+SYSTEM_PROMPT_FILE = 'system_prompt_pt.xml'
+USER_PROMPT_FILE = 'user_prompt_template_pt.xml'
+PROMPT_RELOAD_INTERVAL_SECONDS = float(os.getenv('PROMPT_RELOAD_INTERVAL_SECONDS', '5'))  # Between file change checks
+
+# Coalescing of identical concurrent upstream calls across threads and workers
+SINGLEFLIGHT_LOCK_DIR = os.path.join('data', 'singleflight')
+SINGLEFLIGHT_LEASE_SECONDS = float(os.getenv('SINGLEFLIGHT_LEASE_SECONDS', '90'))  # Longer than a model call
+SINGLEFLIGHT_FAILURE_TTL_SECONDS = float(os.getenv('SINGLEFLIGHT_FAILURE_TTL_SECONDS', '5'))  # Failed calls are not retried sooner
+
+# Per-asset price history configuration
+ASSET_SERIES_DIR = os.path.join('data', 'asset_series')  # One record file per symbol
+ASSET_SERIES_MIN_INTERVAL_SECONDS = float(os.getenv('ASSET_SERIES_MIN_INTERVAL_SECONDS', '60'))  # Closer quotes are not recorded
+ASSET_SERIES_MAX_POINTS = int(os.getenv('ASSET_SERIES_MAX_POINTS', '100000'))  # Records kept per symbol
+
+# Metrics configuration
+METRICS_DIR = os.path.join('data', 'metrics')  # Per-worker snapshots merged by /metrics
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv('METRICS_FLUSH_INTERVAL_SECONDS', '5'))
+METRICS_WORKER_MAX_AGE_SECONDS = float(os.getenv('METRICS_WORKER_MAX_AGE_SECONDS', '3600'))  # Snapshots of exited workers are dropped after this
+
+# In-memory cache for CoinMarketCap quotes
+class QuoteCache:
+    """Thread-safe TTL cache of CMC quotes keyed by (symbol, convert) with LRU eviction"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, symbols: List[str], convert: str):
+        """Return (fresh quotes by symbol, ages in seconds by symbol, symbols that are missing or expired)"""
+        found = {}
+        ages = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for symbol in symbols:
+                key = (symbol, convert)
+                entry = self._entries.get(key)
+                if entry is None or now - entry[0] > self.ttl_seconds:
+                    self._entries.pop(key, None)
+                    missing.append(symbol)
+                    continue
+                self._entries.move_to_end(key)
+                found[symbol] = entry[1]
+                ages[symbol] = now - entry[0]
+        return found, ages, missing
+
+    def put_many(self, quotes: Dict, convert: str, ages: Dict = None):
+        """Store quotes by symbol, evicting the least recently used entries; ages are seconds since fetch"""
+        now = time.monotonic()
+        ages = ages or {}
+        with self._lock:
+            for symbol, quote in quotes.items():
+                key = (symbol, convert)
+                self._entries[key] = (now - ages.get(symbol, 0.0), quote)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached quotes"""
+        with self._lock:
+            self._entries.clear()
+
+quote_cache = QuoteCache(QUOTE_CACHE_TTL_SECONDS, QUOTE_CACHE_MAX_ENTRIES)
+
+# Quotes shared between worker processes through a file on disk
+class QuoteSnapshot:
+    """Per-symbol quotes with their fetch time, stored in an atomically replaced JSON file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._stat = None
+        self._data = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes read-merge-write cycles across workers so no publish drops another's symbols
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._write_lock, open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-# Load prompt templates
-def load_prompt_template(filename):
-    """Load prompt template from file"""
-    try:
-        with open(f'prompts/{filename}', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError as e:
-        print(f"Prompt template file not found: {filename} - {e}")
-        return None
-    except Exception as e:
-        print(f"Error loading prompt template {filename}: {e}")
-        return None
+    def _load(self) -> Dict:
+        # Re-read only when the file changed since the last read
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stat_key != self._stat:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self._data = json.load(f)
+                    self._stat = stat_key
+                    file_io_bytes.inc(stat.st_size, file='quote_snapshot', op='read')
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.warning("Error reading quote snapshot: %s", e)
+                    return {}
+            return self._data
+
+    def get_many(self, symbols: List[str], convert: str, max_age: float = None):
+        """Return (quotes by symbol, ages in seconds by symbol, missing symbols)"""
+        entries = self._load().get(convert, {})
+        now = time.time()
+        found = {}
+        ages = {}
+        missing = []
+        for symbol in symbols:
+            entry = entries.get(symbol)
+            if entry is None or (max_age is not None and now - entry['fetched_at'] > max_age):
+                missing.append(symbol)
+                continue
+            found[symbol] = entry['quote']
+            ages[symbol] = max(now - entry['fetched_at'], 0.0)
+        return found, ages, missing
+
+    def put_many(self, quotes: Dict, convert: str):
+        """Merge freshly fetched quotes into the snapshot file"""
+        now = time.time()
+        try:
+            with self._file_lock():
+                data = dict(self._load())
+                entries = dict(data.get(convert, {}))
+                for symbol, quote in quotes.items():
+                    entries[symbol] = {'fetched_at': now, 'quote': quote}
+                data[convert] = entries
+                written = atomic_write_json(self.path, data, ensure_ascii=False)
+            file_io_bytes.inc(written, file='quote_snapshot', op='write')
+        except Exception as e:
+            logger.error("Error writing quote snapshot: %s", e)
+
+quote_snapshot = QuoteSnapshot(QUOTE_SNAPSHOT_PATH)
+
+# Persistent store for history (and holdings when using SQLite)
+if STORAGE_BACKEND == 'sqlite':
+    portfolio_store = SqliteStore(
+        SQLITE_DB_PATH,
+        max_entries=MAX_HISTORY_ENTRIES,
+        max_age_days=MAX_HISTORY_AGE_DAYS,
+        compact_every=HISTORY_COMPACT_EVERY
+    )
+else:
+    portfolio_store = JsonlHistoryStore(
+        HISTORY_FILE_PATH,
+        max_entries=MAX_HISTORY_ENTRIES,
+        max_age_days=MAX_HISTORY_AGE_DAYS,
+        compact_every=HISTORY_COMPACT_EVERY,
+        legacy_path=LEGACY_HISTORY_FILE_PATH
+    )
+
+# Parsed history reused across requests until the store changes
+history_cache = HistoryCache(portfolio_store)
+
+# Holdings of portfolios other than the default one
+portfolios_store = portfolio_store if STORAGE_BACKEND == 'sqlite' else JsonPortfolioStore(PORTFOLIOS_DIR)
+
+# Price and held amount of every asset at each quote fetch
+asset_series = AssetSeriesStore(ASSET_SERIES_DIR, ASSET_SERIES_MIN_INTERVAL_SECONDS, ASSET_SERIES_MAX_POINTS)
+
+# Shared by quote fetches and AI analyses so a burst of identical requests makes one upstream call
+upstream_flights = SingleFlight(SINGLEFLIGHT_LOCK_DIR, SINGLEFLIGHT_LEASE_SECONDS, SINGLEFLIGHT_FAILURE_TTL_SECONDS)
+
+# Create the pooled HTTP session shared by all CoinMarketCap calls
+def create_cmc_session():
+    """Create a keep-alive requests session with a bounded connection pool"""
+    session = requests.Session()
+    # Retries are handled in cmc_get so that backoff can be jittered
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CMC_POOL_MAXSIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accepts': 'application/json',
+        'X-CMC_PRO_API_KEY': CMC_API_KEY,
+    })
+    return session
+
+cmc_session = create_cmc_session()
+
+# Compute how long to wait before retrying a CoinMarketCap call
+def cmc_backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honoring a numeric Retry-After header"""
+    delay = random.uniform(0, min(CMC_BACKOFF_MAX_SECONDS, CMC_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(float(retry_after), CMC_BACKOFF_MAX_SECONDS))
+    return delay
+
+# Perform a GET request against the CoinMarketCap API
+def cmc_get(path, params):
+    """GET a CMC endpoint through the pooled session, retrying 429/5xx and connection errors"""
+    url = f'{CMC_BASE_URL}{path}'
+    for attempt in range(CMC_MAX_RETRIES + 1):
+        try:
+            response = cmc_session.get(url, params=params, timeout=(CMC_CONNECT_TIMEOUT, CMC_READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            upstream_requests.inc(upstream='cmc', status='error')
+            if attempt == CMC_MAX_RETRIES:
+                raise
+            upstream_retries.inc(upstream='cmc')
+            logger.warning("CMC request failed (%s), retrying (%d/%d)", e, attempt + 1, CMC_MAX_RETRIES)
+            time.sleep(cmc_backoff_delay(attempt))
+            continue
+
+        upstream_requests.inc(upstream='cmc', status=response.status_code)
+        if response.status_code not in CMC_RETRY_STATUS_CODES or attempt == CMC_MAX_RETRIES:
+            return response
+
+        upstream_retries.inc(upstream='cmc')
+        logger.warning("CMC returned %s, retrying (%d/%d)", response.status_code, attempt + 1, CMC_MAX_RETRIES)
+        time.sleep(cmc_backoff_delay(attempt, response))
+
+# Prompt templates served from memory; requests only re-check the files every reload interval
+prompt_templates = PromptTemplates(PROMPTS_DIR, PROMPT_RELOAD_INTERVAL_SECONDS)
+prompt_templates.preload([SYSTEM_PROMPT_FILE, USER_PROMPT_FILE])
 
 # Initialize OpenAI client
 def init_openai_client():
-    """Initialize OpenAI client with proxy"""
+    """Initialize OpenAI client with proxy, bounded connection pool and explicit timeouts"""
     proxy_str = os.getenv('PROXIES')
     transport = httpx.HTTPTransport(
-        proxy=Proxy(url=proxy_str) if proxy_str else None
+        proxy=Proxy(url=proxy_str) if proxy_str else None,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        )
     )
-    http_client = httpx.Client(transport=transport, verify=False)
+    timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    http_client = httpx.Client(transport=transport, verify=False, timeout=timeout)
     client = OpenAI(
         api_key=OPENAI_API_KEY,
-        http_client=http_client
+        base_url=OPENAI_BASE_URL,
+        http_client=http_client,
+        timeout=timeout
     )
     return client
 
+# Process-wide OpenAI client, rebuilt when the process is forked
+_openai_client = None
+_openai_client_pid = None
+_openai_client_lock = threading.Lock()
+
+# Get the shared OpenAI client for this process
+def get_openai_client():
+    """Return the process-wide OpenAI client, creating it on first use"""
+    global _openai_client, _openai_client_pid
+    pid = os.getpid()
+    if _openai_client is None or _openai_client_pid != pid:
+        with _openai_client_lock:
+            if _openai_client is None or _openai_client_pid != pid:
+                # A client inherited from the parent shares its sockets, so it is
+                # dropped without closing and a fresh one is built for this process
+                _openai_client = init_openai_client()
+                _openai_client_pid = pid
+    return _openai_client
+
+# Close the shared OpenAI client on shutdown
+def close_openai_client():
+    """Close the process-wide OpenAI client and its connection pool"""
+    global _openai_client, _openai_client_pid
+    with _openai_client_lock:
+        if _openai_client is not None and _openai_client_pid == os.getpid():
+            try:
+                _openai_client.close()
+            except Exception as e:
+                logger.warning("Error closing OpenAI client: %s", e)
+        _openai_client = None
+        _openai_client_pid = None
+
+atexit.register(close_openai_client)
+
 # Load portfolio data from JSON file
-def load_portfolio():
+def load_portfolio_file():
     """Load portfolio data from JSON file"""
     try:
         with open('portfolio.json', 'r') as f:
+            file_io_bytes.inc(os.fstat(f.fileno()).st_size, file='portfolio', op='read')
             return json.load(f)
     except FileNotFoundError as e:
-        print(f"Portfolio file not found: {e}")
+        logger.error("Portfolio file not found: %s", e)
         return {}
     except json.JSONDecodeError as e:
-        print(f"Error parsing portfolio.json: {e}")
+        logger.error("Error parsing portfolio.json: %s", e)
         return {}
     except Exception as e:
-        print(f"Unexpected error loading portfolio: {e}")
+        logger.exception("Unexpected error loading portfolio: %s", e)
         return {}
 
-# Get current prices for cryptocurrencies
-def get_crypto_prices(symbols):
-    """Get current prices for cryptocurrencies"""
+# Load portfolio holdings from the configured store
+def load_portfolio():
+    """Load portfolio holdings as {symbol: amount}"""
+    if STORAGE_BACKEND != 'sqlite':
+        return load_portfolio_file()
     try:
-        # Set up headers with API key
-        headers = {
-            'Accepts': 'application/json',
-            'X-CMC_PRO_API_KEY': CMC_API_KEY,
-        }
-        
-        # Handle USDB separately as it's a stablecoin pegged to USD
-        prices = {}
-        if 'USDB' in symbols:
-            usdt_params = {
-                'symbol': 'USDT',
-                'convert': 'BRL'
-            }
-            usdt_response = requests.get(f'{CMC_BASE_URL}/cryptocurrency/quotes/latest', headers=headers, params=usdt_params)
-            
-            # Create USDB data with fixed price of 1 USD converted to BRL
-            # Get USD/BRL exchange rate using a regular USD-pegged stablecoin like USDT
-            usdt_data = usdt_response.json()
-            
-            if usdt_response.status_code == 200 and 'data' in usdt_data:
-                usdt_price_brl = usdt_data['data']['USDT']['quote']['BRL']['price']
-                # Create synthetic USDB data using USDT's BRL price
-                data = {
-                    'USDB': {
-                        'symbol': 'USDB',
-                        'name': 'USD Balance',
-                        'quote': {
-                            'BRL': {
-                                'price': usdt_price_brl,
-                                'percent_change_24h': 0,  # Stablecoin, so no change
-                                'percent_change_7d': 0,
-                                'market_cap': 0,
-                                'volume_24h': 0
-                            }
-                        }
-                    }
-                }
-            else:
-                print(f"Error fetching USDT price for USDB conversion: {usdt_data.get('status', {}).get('error_message')}")
-                return None
-            
-            # Then get other crypto prices
-            if symbols:
-                params = {
-                    'symbol': ','.join(symbols),
-                    'convert': 'BRL'
-                }
-                crypto_response = requests.get(f'{CMC_BASE_URL}/cryptocurrency/quotes/latest', headers=headers, params=params)
-                crypto_data = crypto_response.json()
-                
-                if crypto_response.status_code == 200 and 'data' in crypto_data:
-                    data.update(crypto_data['data'])
-                else:
-                    print(f"Error fetching crypto prices: {crypto_data.get('status', {}).get('error_message')}")
-                    return None
-                    
-            return data
-        else:
-            # If no USDB, just get regular crypto prices
-            params = {
-                'symbol': ','.join(symbols),
-                'convert': 'BRL'
-            }
-            response = requests.get(f'{CMC_BASE_URL}/cryptocurrency/quotes/latest', headers=headers, params=params)
-            data = response.json()
-            
-            if response.status_code == 200 and 'data' in data:
-                return data['data']
-            else:
-                print(f"Error fetching prices: {data.get('status', {}).get('error_message')}")
-                return None
-            
+        return portfolio_store.load_holdings()
     except Exception as e:
-        print(f"Error in get_crypto_prices: {e}\n{traceback.format_exc()}")
-        return None
+        logger.exception("Unexpected error loading portfolio from SQLite: %s", e)
+        return {}
 
-# Get price changes for cryptocurrencies from CoinMarketCap
-def get_crypto_price_changes(symbols: List[str]) -> Dict:
+# Load holdings for many portfolios at once
+def load_portfolios(portfolio_ids: List[str]) -> Dict[str, Dict]:
+    """Load holdings by portfolio ID, omitting unknown or empty portfolios"""
+    portfolios = {}
+    if DEFAULT_PORTFOLIO_ID in portfolio_ids:
+        portfolios[DEFAULT_PORTFOLIO_ID] = load_portfolio()
+    other_ids = [portfolio_id for portfolio_id in portfolio_ids if portfolio_id != DEFAULT_PORTFOLIO_ID]
+    if other_ids:
+        try:
+            portfolios.update(portfolios_store.load_many(other_ids))
+        except Exception as e:
+            logger.exception("Unexpected error loading portfolios: %s", e)
+    return {portfolio_id: portfolios[portfolio_id] for portfolio_id in portfolio_ids if portfolios.get(portfolio_id)}
+
+# List the IDs of all portfolios
+def list_portfolio_ids() -> List[str]:
+    """Return the default portfolio ID followed by the IDs of the additional portfolios"""
+    return [DEFAULT_PORTFOLIO_ID] + [
+        portfolio_id for portfolio_id in portfolios_store.portfolio_ids() if portfolio_id != DEFAULT_PORTFOLIO_ID
+    ]
+
+# Seed an empty SQLite store from the JSON files
+def init_storage():
+    """Import portfolio.json and the JSON history into SQLite on first run"""
+    if STORAGE_BACKEND != 'sqlite':
+        return
+    try:
+        legacy_history = JsonlHistoryStore(
+            HISTORY_FILE_PATH,
+            max_entries=MAX_HISTORY_ENTRIES,
+            max_age_days=MAX_HISTORY_AGE_DAYS,
+            legacy_path=LEGACY_HISTORY_FILE_PATH
+        )
+        portfolio_store.seed(load_portfolio_file(), legacy_history.load())
+    except Exception as e:
+        logger.exception("Error seeding SQLite store: %s", e)
+
+init_storage()
+
+# Get cached prices from this worker's memory or the shared snapshot
+def get_cached_crypto_prices(symbols, max_age=QUOTE_CACHE_TTL_SECONDS):
+    """Return (cached quotes, their ages in seconds, symbols with no fresh cached quote) without network calls"""
+    cached, ages, missing = quote_cache.get_many(symbols, QUOTE_CONVERT_CURRENCY)
+    cache_lookups.inc(len(cached), cache='quote_memory', result='hit')
+    cache_lookups.inc(len(missing), cache='quote_memory', result='miss')
+    if missing:
+        # Another worker or the poller may have fetched them already
+        shared, shared_ages, missing = quote_snapshot.get_many(missing, QUOTE_CONVERT_CURRENCY, max_age)
+        cache_lookups.inc(len(shared), cache='quote_snapshot', result='hit')
+        cache_lookups.inc(len(missing), cache='quote_snapshot', result='miss')
+        if shared:
+            quote_cache.put_many(shared, QUOTE_CONVERT_CURRENCY, shared_ages)
+            cached.update(shared)
+            ages.update(shared_ages)
+    return cached, ages, missing
+
+# Store freshly fetched quotes in the memory cache and the shared snapshot
+def store_crypto_prices(quotes, holdings=None):
+    """Publish fetched quotes to this worker and to the other workers, and record them per asset"""
+    quote_cache.put_many(quotes, QUOTE_CONVERT_CURRENCY)
+    quote_snapshot.put_many(quotes, QUOTE_CONVERT_CURRENCY)
+    # Amounts are those of the default portfolio, the one whose value history is recorded
+    asset_series.append_quotes(
+        quotes, QUOTE_CONVERT_CURRENCY, time.time(), holdings if holdings is not None else load_portfolio()
+    )
+
+# Get current prices for cryptocurrencies, served from the quote cache when fresh
+def get_crypto_prices(symbols):
+    """Get current prices for cryptocurrencies"""
+    return get_crypto_prices_with_age(symbols)[0]
+
+# Get current prices together with the age of the oldest quote served
+def get_crypto_prices_with_age(symbols):
     """
-    Get price changes for cryptocurrencies from CoinMarketCap
-    Args:
-        symbols: List of cryptocurrency symbols
+    Get prices with stale-while-revalidate semantics
     Returns:
-        Dict containing price changes for each symbol
+        (quotes by symbol, age in seconds of the oldest quote), or (None, None) if no quote is known.
+        Quotes up to QUOTE_STALE_MAX_AGE_SECONDS old are served at once and refreshed in the
+        background; if upstream fails, last known good quotes of any age are served instead.
     """
-    try:
-        # Convert symbols to CMC format
-        symbols_str = ','.join(symbols)
-        
-        url = f"{CMC_BASE_URL}/cryptocurrency/quotes/latest"
-        parameters = {
-            'symbol': symbols_str,
-            'convert': 'BRL'
-        }
-        headers = {
-            'Accepts': 'application/json',
-            'X-CMC_PRO_API_KEY': CMC_API_KEY
-        }
+    with span('prices'):
+        cached, ages, missing = get_cached_crypto_prices(symbols)
+        if not missing:
+            return cached, max(ages.values(), default=0.0)
+
+        # Serve the last known good quotes now and refresh them off the request path
+        stale, stale_ages, unknown = quote_snapshot.get_many(missing, QUOTE_CONVERT_CURRENCY, QUOTE_STALE_MAX_AGE_SECONDS)
+        if not unknown:
+            cache_lookups.inc(len(stale), cache='quote_stale', result='hit')
+            schedule_price_refresh(missing)
+            return merge_price_ages(cached, ages, stale, stale_ages)
+
+        fetched = refresh_crypto_prices(missing)
+        if fetched is not None:
+            return merge_price_ages(cached, ages, fetched, {symbol: 0.0 for symbol in missing})
+
+        # Upstream is failing, so fall back to whatever was last fetched
+        stale, stale_ages, unknown = quote_snapshot.get_many(missing, QUOTE_CONVERT_CURRENCY)
+        if unknown:
+            return None, None
+        cache_lookups.inc(len(stale), cache='quote_last_known_good', result='hit')
+        logger.warning("Serving last known good quotes for %s", ', '.join(missing))
+        return merge_price_ages(cached, ages, stale, stale_ages)
+
+# Combine quotes from several sources and report the oldest age
+def merge_price_ages(cached, ages, quotes, quote_ages):
+    """Merge quotes into cached and return (quotes, oldest age in seconds)"""
+    cached.update(quotes)
+    ages.update(quote_ages)
+    return cached, max(ages.values(), default=0.0)
+
+# Fetch and publish quotes, coalesced with identical fetches in this and other workers
+def refresh_crypto_prices(symbols):
+    """Fetch quotes for symbols once for all concurrent callers, or None if upstream fails"""
+    def fetch():
+        fetched = fetch_crypto_prices(symbols)
+        if fetched is not None:
+            store_crypto_prices(fetched)
+        return fetched
+
+    return upstream_flights.do(
+        quote_flight_key(symbols), fetch, recheck=lambda: recheck_crypto_prices(symbols)
+    )
 
-        response = requests.get(url, headers=headers, params=parameters)
-        data = response.json()
+# Background refreshes in flight in this process, by single-flight key
+_price_refreshes = set()
+_price_refreshes_lock = threading.Lock()
 
-        if 'data' not in data:
-            print(f"Error getting price changes: {data.get('status', {}).get('error_message', 'Unknown error')}")
-            return {}
+# Refresh stale quotes in a background thread
+def schedule_price_refresh(symbols):
+    """Start a background refresh for symbols unless one is already running in this process"""
+    key = quote_flight_key(symbols)
+    with _price_refreshes_lock:
+        if key in _price_refreshes:
+            return
+        _price_refreshes.add(key)
 
-        changes = {}
-        for symbol in symbols:
-            if symbol in data['data']:
-                quote = data['data'][symbol]['quote']['BRL']
-                changes[symbol] = {
-                    'change_24h': quote['percent_change_24h'],
-                    'change_7d': quote['percent_change_7d']
-                }
-            else:
-                changes[symbol] = {
-                    'change_24h': 0,
-                    'change_7d': 0
+    def run():
+        try:
+            refresh_crypto_prices(symbols)
+        except Exception as e:
+            logger.exception("Error refreshing prices in background: %s", e)
+        finally:
+            with _price_refreshes_lock:
+                _price_refreshes.discard(key)
+
+    threading.Thread(target=run, name='price-refresh', daemon=True).start()
+
+# Describe how fresh the quotes behind a response are
+def price_freshness(age: float) -> Dict:
+    """Response fields flagging the age of the oldest quote used"""
+    return {
+        'prices_age_seconds': round(age, 1),
+        'prices_stale': age > QUOTE_CACHE_TTL_SECONDS
+    }
+
+# Key identifying identical quote fetches
+def quote_flight_key(symbols):
+    """Single-flight key for fetching a set of symbols, independent of their order"""
+    return ('quotes', QUOTE_CONVERT_CURRENCY, *sorted(symbols))
+
+# Look up quotes another worker may have fetched while this one waited
+def recheck_crypto_prices(symbols):
+    """Return cached quotes for all symbols, or None if any is still missing"""
+    cached, _, missing = get_cached_crypto_prices(symbols)
+    return None if missing else cached
+
+# Build the CoinMarketCap quotes request for a list of symbols
+def quote_request_params(symbols):
+    """Query parameters for quotes/latest, with synthetic symbols replaced by their reference"""
+    # Synthetic symbols are priced locally, so only their reference symbol goes upstream
+    request_symbols = [symbol for symbol in symbols if symbol not in SYNTHETIC_QUOTE_SYMBOLS]
+    for symbol in symbols:
+        reference = SYNTHETIC_QUOTE_SYMBOLS.get(symbol)
+        if reference and reference not in request_symbols:
+            request_symbols.append(reference)
+
+    return {
+        'symbol': ','.join(request_symbols),
+        'convert': 'BRL'
+    }
+
+# Turn a CoinMarketCap quotes response into quotes by symbol
+def parse_quote_response(symbols, status_code, response_data):
+    """Return quotes by symbol, including synthetic ones, or None if the response is an error"""
+    if status_code != 200 or 'data' not in response_data:
+        logger.error("Error fetching prices: %s", response_data.get('status', {}).get('error_message'))
+        return None
+
+    data = dict(response_data['data'])
+
+    # Handle USDB separately as it's a stablecoin pegged to USD
+    if 'USDB' in symbols:
+        usdt_data = data.get('USDT')
+        if not usdt_data:
+            logger.error("Error fetching USDT price for USDB conversion: USDT missing from response")
+            return None
+
+        # Create synthetic USDB data using USDT's BRL price from the same response
+        data['USDB'] = {
+            'symbol': 'USDB',
+            'name': 'USD Balance',
+            'quote': {
+                'BRL': {
+                    'price': usdt_data['quote']['BRL']['price'],
+                    'percent_change_24h': 0,  # Stablecoin, so no change
+                    'percent_change_7d': 0,
+                    'market_cap': 0,
+                    'volume_24h': 0
                 }
+            }
+        }
 
-        return changes
+    return data
+
+# Fetch current prices for cryptocurrencies from CoinMarketCap
+def fetch_crypto_prices(symbols):
+    """Fetch current prices for cryptocurrencies from CoinMarketCap in a single request"""
+    try:
+        if not symbols:
+            return {}
+
+        with span('cmc_fetch'):
+            response = cmc_get('/cryptocurrency/quotes/latest', quote_request_params(symbols))
+            return parse_quote_response(symbols, response.status_code, response.json())
 
     except Exception as e:
-        print(f"Error getting price changes: {str(e)}")
-        traceback.print_exc()
-        return {}
+        logger.exception("Error in fetch_crypto_prices: %s", e)
+        return None
+
+# Weight each asset's quoted 24h/7d change by its share of the portfolio value
+def quote_weighted_changes(portfolio_data: Dict) -> Dict:
+    """Approximate portfolio changes from the quotes already attached to portfolio_data['assets']"""
+    assets = portfolio_data.get('assets', {})
+    total_value = portfolio_data.get('total_brl', 0)
+    if not assets or not total_value:
+        return {'change_24h': 0, 'change_7d': 0}
+
+    weighted_24h = 0
+    weighted_7d = 0
+    for asset in assets.values():
+        weight = asset['value_brl'] / total_value
+        weighted_24h += weight * (asset.get('percent_change_24h') or 0)
+        weighted_7d += weight * (asset.get('percent_change_7d') or 0)
+
+    return {
+        'change_24h': weighted_24h,
+        'change_7d': weighted_7d
+    }
 
-# Calculate portfolio value changes based on individual asset changes
-def calculate_portfolio_changes(portfolio_data: Dict) -> Dict:
+# Calculate portfolio value changes from the recorded history
+def calculate_portfolio_changes(portfolio_data: Dict, portfolio_id: str = DEFAULT_PORTFOLIO_ID) -> Dict:
     """
-    Calculate portfolio value changes based on individual asset changes
+    Calculate rolling portfolio returns, volatility and drawdown
     Args:
         portfolio_data: Dictionary containing portfolio information
+        portfolio_id: Only the default portfolio records history
     Returns:
-        Dict containing portfolio changes
+        Dict with change_24h/7d/30d and volatility_24h/7d/30d (annualized) in percent, the
+        drawdown from the peak and the max_drawdown over the retained history, and as_of,
+        the time of the latest history point. They are read from running aggregates kept
+        by the history cache, so this makes no upstream call. Where history is too short or
+        absent, change_24h and change_7d fall back to the quote-weighted asset changes.
     """
     try:
-        assets = portfolio_data.get('assets', {})
-        if not assets:
-            return {'change_24h': 0, 'change_7d': 0}
-
-        # Get symbols
-        symbols = list(assets.keys())
-        
-        # Get price changes from CMC
-        price_changes = get_crypto_price_changes(symbols)
-        
-        # Calculate weighted changes
-        total_value = portfolio_data['total_brl']
-        weighted_24h = 0
-        weighted_7d = 0
-
-        for symbol, asset in assets.items():
-            # Calculate weight of this asset in portfolio
-            weight = asset['value_brl'] / total_value
-            
-            # Get asset changes
-            asset_changes = price_changes.get(symbol, {'change_24h': 0, 'change_7d': 0})
-            
-            # Add weighted changes
-            weighted_24h += weight * asset_changes['change_24h']
-            weighted_7d += weight * asset_changes['change_7d']
-
-        return {
-            'change_24h': weighted_24h,
-            'change_7d': weighted_7d
-        }
+        fallback = quote_weighted_changes(portfolio_data)
+        if portfolio_id != DEFAULT_PORTFOLIO_ID:
+            return fallback
+
+        changes = dict(history_cache.rolling_metrics())
+        for key, value in fallback.items():
+            if changes.get(key) is None:
+                changes[key] = value
+        return changes
 
     except Exception as e:
-        print(f"Error calculating portfolio changes: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error calculating portfolio changes: %s", e)
         return {'change_24h': 0, 'change_7d': 0}
 
+# Assign symbols to the configured rebalancing buckets
+def rebalance_categories(symbols: List[str]) -> np.ndarray:
+    """Return the REBALANCE_BUCKETS index of every symbol"""
+    buckets = list(REBALANCE_BUCKETS)
+    return category_indices(
+        symbols,
+        {i: REBALANCE_BUCKETS[bucket]['symbols'] for i, bucket in enumerate(buckets) if 'symbols' in REBALANCE_BUCKETS[bucket]},
+        buckets.index(DEFAULT_REBALANCE_BUCKET)
+    )
+
 # Generate detailed portfolio analysis following 70-30 strategy with 2.5% tolerance
 def generate_market_analysis(portfolio_data: Dict, template_data: Dict) -> Dict:
     """
@@ -283,375 +766,797 @@ def generate_market_analysis(portfolio_data: Dict, template_data: Dict) -> Dict:
         analysis_data = {
             'total_value_brl': portfolio_data['total_brl'],
             'timestamp': datetime.now(timezone(timedelta(hours=-3))).isoformat(),
-            'allocations': {'crypto': {}, 'stable': {}},
+            'allocations': {bucket: {} for bucket in REBALANCE_BUCKETS},
             'rebalance_needed': False,
             'rebalance_suggestions': [],
             'asset_adjustments': []  # List for detailed asset adjustments
         }
 
-        # Separate assets into crypto and stablecoins
-        stablecoins = ['USDT', 'MUSD', 'USDB']
-        crypto_value = 0
-        stable_value = 0
-
-        # Calculate current allocations and store prices
-        for symbol, data in portfolio_data['assets'].items():
-            is_stable = symbol in stablecoins
-            value_brl = data['value_brl']
-            current_price = data['price_brl']
-            
+        # Order assets by bucket so adjustments are listed bucket by bucket
+        buckets = list(REBALANCE_BUCKETS)
+        assets = portfolio_data['assets']
+        symbols = list(assets.keys())
+        categories = rebalance_categories(symbols)
+        order = np.argsort(categories, kind='stable')
+        symbols = [symbols[i] for i in order]
+        categories = categories[order]
+
+        result = rebalance(
+            [assets[symbol]['amount'] for symbol in symbols],
+            [assets[symbol]['price_brl'] for symbol in symbols],
+            categories,
+            [REBALANCE_BUCKETS[bucket]['target'] for bucket in buckets],
+            REBALANCE_THRESHOLD
+        )
+
+        # Store current allocations and prices
+        allocation_pct = result['allocation_pct'].tolist()
+        for i, symbol in enumerate(symbols):
+            data = assets[symbol]
+            bucket = buckets[categories[i]]
             asset_data = {
                 'amount': data['amount'],
-                'value_brl': value_brl,
-                'allocation_total': (value_brl / analysis_data['total_value_brl']) * 100,
-                'price_brl': current_price
+                'value_brl': data['value_brl'],
+                'allocation_total': allocation_pct[i],
+                'price_brl': data['price_brl']
             }
-
-            if is_stable:
-                stable_value += value_brl
-                analysis_data['allocations']['stable'][symbol] = asset_data
-            else:
-                crypto_value += value_brl
+            if bucket != STABLE_BUCKET:
                 asset_data.update({
                     'price_change_24h': data.get('percent_change_24h', 0),
                     'price_change_7d': data.get('percent_change_7d', 0)
                 })
-                analysis_data['allocations']['crypto'][symbol] = asset_data
+            analysis_data['allocations'][bucket][symbol] = asset_data
 
-        total_value = analysis_data['total_value_brl']
-        current_crypto_pct = (crypto_value / total_value) * 100
-        current_stable_pct = (stable_value / total_value) * 100
-
-        # Check if portfolio is within 70-30 tolerance (±2.5%)
-        THRESHOLD = 2.5
-        if abs(current_crypto_pct - 70) > THRESHOLD:  # Only rebalance if portfolio is out of range
+        # Check if every bucket is within its tolerance band (±2.5%)
+        if bool(result['rebalance_needed']):  # Only rebalance if portfolio is out of range
             analysis_data['rebalance_needed'] = True
-            
-            # Calculate target values
-            target_crypto_value = total_value * 0.7  # 70% target for crypto
-            target_stable_value = total_value * 0.3  # 30% target for stable
 
             # Add portfolio-level rebalancing suggestions
-            analysis_data['rebalance_suggestions'].append({
-                'type': 'crypto',
-                'current_percentage': current_crypto_pct,
-                'target_percentage': 70,
-                'adjustment_brl': target_crypto_value - crypto_value
-            })
-            analysis_data['rebalance_suggestions'].append({
-                'type': 'stable',
-                'current_percentage': current_stable_pct,
-                'target_percentage': 30,
-                'adjustment_brl': target_stable_value - stable_value
-            })
-
-            # Calculate adjustments for each asset to achieve target allocation
-            crypto_assets = list(analysis_data['allocations']['crypto'].items())
-            total_crypto_allocation = sum(data['allocation_total'] for _, data in crypto_assets)
-            
-            # Adjust cryptos proportionally
-            for symbol, data in crypto_assets:
-                current_amount = data['amount']
-                current_value = data['value_brl']
-                price = data['price_brl']
-                
-                # Maintain relative weights within crypto portion
-                relative_weight = data['allocation_total'] / total_crypto_allocation if total_crypto_allocation > 0 else 0
-                target_value = target_crypto_value * relative_weight
-                target_amount = target_value / price if price > 0 else 0
-                
-                adjustment_amount = target_amount - current_amount
-                adjustment_value = adjustment_amount * price
-                
-                current_pct = (current_value / total_value) * 100
-                target_pct = (target_value / total_value) * 100
-
-                analysis_data['asset_adjustments'].append({
-                    'symbol': symbol,
-                    'current_amount': current_amount,
-                    'target_amount': target_amount,
-                    'amount_adjustment': adjustment_amount,
-                    'current_value_brl': current_value,
-                    'target_value_brl': target_value,
-                    'adjustment_brl': adjustment_value,
-                    'current_percentage': current_pct,
-                    'target_percentage': target_pct,
-                    'action': 'comprar' if adjustment_amount > 0 else 'vender'
+            bucket_pct = result['bucket_pct'].tolist()
+            bucket_adjustments = result['bucket_adjustments'].tolist()
+            for k, bucket in enumerate(buckets):
+                analysis_data['rebalance_suggestions'].append({
+                    'type': bucket,
+                    'current_percentage': bucket_pct[k],
+                    'target_percentage': round(REBALANCE_BUCKETS[bucket]['target'] * 100, 6),
+                    'adjustment_brl': bucket_adjustments[k]
                 })
 
-            # Adjust stablecoins proportionally
-            stable_assets = list(analysis_data['allocations']['stable'].items())
-            total_stable_allocation = sum(data['allocation_total'] for _, data in stable_assets)
-            
-            for symbol, data in stable_assets:
-                current_amount = data['amount']
-                current_value = data['value_brl']
-                price = data['price_brl']
-                
-                relative_weight = data['allocation_total'] / total_stable_allocation if total_stable_allocation > 0 else 0
-                target_value = target_stable_value * relative_weight
-                target_amount = target_value / price if price > 0 else 0
-                
-                adjustment_amount = target_amount - current_amount
-                adjustment_value = adjustment_amount * price
-                
-                current_pct = (current_value / total_value) * 100
-                target_pct = (target_value / total_value) * 100
-
+            # Adjustments for each asset, keeping relative weights within its bucket
+            target_amounts = result['target_amounts'].tolist()
+            amount_adjustments = result['amount_adjustments'].tolist()
+            target_values = result['target_values'].tolist()
+            value_adjustments = result['value_adjustments'].tolist()
+            target_pct = result['target_pct'].tolist()
+            for i, symbol in enumerate(symbols):
                 analysis_data['asset_adjustments'].append({
                     'symbol': symbol,
-                    'current_amount': current_amount,
-                    'target_amount': target_amount,
-                    'amount_adjustment': adjustment_amount,
-                    'current_value_brl': current_value,
-                    'target_value_brl': target_value,
-                    'adjustment_brl': adjustment_value,
-                    'current_percentage': current_pct,
-                    'target_percentage': target_pct,
-                    'action': 'comprar' if adjustment_amount > 0 else 'vender'
+                    'current_amount': assets[symbol]['amount'],
+                    'target_amount': target_amounts[i],
+                    'amount_adjustment': amount_adjustments[i],
+                    'current_value_brl': assets[symbol]['value_brl'],
+                    'target_value_brl': target_values[i],
+                    'adjustment_brl': value_adjustments[i],
+                    'current_percentage': allocation_pct[i],
+                    'target_percentage': target_pct[i],
+                    'action': 'comprar' if amount_adjustments[i] > 0 else 'vender'
                 })
 
         return analysis_data
 
     except Exception as e:
-        print(f"Error in generate_market_analysis: {str(e)}")
+        logger.exception("Error in generate_market_analysis: %s", e)
         return {
             'error': str(e),
-            'allocations': {'crypto': {}, 'stable': {}},
+            'allocations': {bucket: {} for bucket in REBALANCE_BUCKETS},
             'rebalance_suggestions': [],
             'asset_adjustments': []
         }
 
+# Prompt sections, compiled once and filled per asset with a single join each
+CRYPTO_ALLOCATION_TEMPLATE = CompiledTemplate(
+    "- {symbol}:\n"
+    "  * Quantidade: {amount:.8f}\n"
+    "  * Valor: R$ {value_brl:.2f}\n"
+    "  * Alocação Total: {allocation_total:.2f}%\n"
+    "  * Alocação Relativa (70%): {allocation_relative:.2f}%\n"
+    "  * Variação 24h: {price_change_24h:.2f}%\n"
+    "  * Variação 7d: {price_change_7d:.2f}%\n"
+)
+STABLE_ALLOCATION_TEMPLATE = CompiledTemplate(
+    "- {symbol}:\n"
+    "  * Quantidade: {amount:.8f}\n"
+    "  * Valor: R$ {value_brl:.2f}\n"
+    "  * Alocação: {allocation_total:.2f}%\n"
+)
+REBALANCING_SUGGESTION_TEMPLATE = CompiledTemplate(
+    "- {type}:\n"
+    "  * Atual: {current_percentage:.2f}%\n"
+    "  * Alvo: {target_percentage:.2f}%\n"
+    "  * Ação: {action} exposição em R$ {adjustment_brl:.2f}\n"
+)
+ASSET_ADJUSTMENT_TEMPLATE = CompiledTemplate(
+    "\n{symbol} - {action}:\n"
+    "  * Alocação atual: {current_percentage:.2f}% do portfólio total\n"
+    "  * Nova alocação: {target_percentage:.2f}% do portfólio total\n"
+    "  * Quantidade exata: {amount_adjustment:.8f} {symbol}\n"
+    "  * Valor em R$: {adjustment_brl:.2f}\n"
+    "  * Quantidade atual: {current_amount:.8f} {symbol}\n"
+    "  * Quantidade após ajuste: {target_amount:.8f} {symbol}"
+)
+ASSET_ADJUSTMENT_NOTES = (
+    "\nObservações Importantes:\n"
+    "1. Estas recomendações visam reequilibrar o portfólio para a regra 70-30\n"
+    "2. Os ajustes são necessários pois o portfólio está fora da margem de tolerância de ±2.5%\n"
+    "3. As proporções entre ativos da mesma categoria (cripto/stable) são mantidas\n"
+    "4. Execute as ordens na sequência sugerida para manter o balanceamento correto\n"
+    "5. Os valores em R$ são aproximados e podem variar devido à volatilidade do mercado"
+)
+NO_ADJUSTMENTS_TEXT = "\nPortfólio está dentro da margem de tolerância de ±2.5% da regra 70-30. Não são necessários ajustes no momento."
+WITHIN_TOLERANCE_TEXT = 'Portfólio dentro dos limites de tolerância (±2.5%)'
+
+# Portfolio section of the user prompt, filled into the {portfolio_data} slot of the user template
+PORTFOLIO_DATA_TEMPLATE = CompiledTemplate("""
+Análise de Portfólio - {timestamp}
+
+Status atual do portfólio:
+- Valor Total: R$ {total_value_brl:.2f}
+
+Alocação por Categoria:
+Criptomoedas (Alvo: 70%):
+{crypto_allocations}
+
+Stablecoins (Alvo: 30%):
+{stable_allocations}
+
+Necessidade de Rebalanceamento:
+{rebalancing}
+
+{asset_adjustments}
+""")
+
 # Format cryptocurrency allocation data for the prompt
 def format_crypto_allocations(crypto_data: Dict) -> str:
     """Format cryptocurrency allocation data for the prompt"""
-    result = []
-    for symbol, data in crypto_data.items():
-        result.append(f"- {symbol}:")
-        result.append(f"  * Quantidade: {data['amount']:.8f}")
-        result.append(f"  * Valor: R$ {data['value_brl']:.2f}")
-        result.append(f"  * Alocação Total: {data['allocation_total']:.2f}%")
-        result.append(f"  * Alocação Relativa (70%): {data.get('allocation_relative', 0):.2f}%")
-        result.append(f"  * Variação 24h: {data['price_change_24h']:.2f}%")
-        result.append(f"  * Variação 7d: {data['price_change_7d']:.2f}%\n")
-    return "\n".join(result)
+    return "\n".join(
+        CRYPTO_ALLOCATION_TEMPLATE.render({
+            'symbol': symbol,
+            'allocation_relative': data.get('allocation_relative', 0),
+            **data
+        })
+        for symbol, data in crypto_data.items()
+    )
 
 # Format stablecoin allocation data for the prompt
 def format_stable_allocations(stable_data: Dict) -> str:
     """Format stablecoin allocation data for the prompt"""
-    result = []
-    for symbol, data in stable_data.items():
-        result.append(f"- {symbol}:")
-        result.append(f"  * Quantidade: {data['amount']:.8f}")
-        result.append(f"  * Valor: R$ {data['value_brl']:.2f}")
-        result.append(f"  * Alocação: {data['allocation_total']:.2f}%\n")
-    return "\n".join(result)
+    return "\n".join(
+        STABLE_ALLOCATION_TEMPLATE.render({'symbol': symbol, **data})
+        for symbol, data in stable_data.items()
+    )
 
 # Format rebalancing suggestions for the prompt
 def format_rebalancing_suggestions(suggestions: List) -> str:
     """Format rebalancing suggestions for the prompt"""
-    result = ["Ajustes Recomendados por Categoria:"]
-    for suggestion in suggestions:
-        action = "Aumentar" if suggestion['adjustment_brl'] > 0 else "Reduzir"
-        result.append(f"- {suggestion['type'].title()}:")
-        result.append(f"  * Atual: {suggestion['current_percentage']:.2f}%")
-        result.append(f"  * Alvo: {suggestion['target_percentage']:.2f}%")
-        result.append(f"  * Ação: {action} exposição em R$ {abs(suggestion['adjustment_brl']):.2f}\n")
-    return "\n".join(result)
+    return "\n".join(["Ajustes Recomendados por Categoria:"] + [
+        REBALANCING_SUGGESTION_TEMPLATE.render({
+            'type': suggestion['type'].title(),
+            'current_percentage': suggestion['current_percentage'],
+            'target_percentage': suggestion['target_percentage'],
+            'action': "Aumentar" if suggestion['adjustment_brl'] > 0 else "Reduzir",
+            'adjustment_brl': abs(suggestion['adjustment_brl'])
+        })
+        for suggestion in suggestions
+    ])
+
+# Format a group of asset adjustments with its heading
+def format_adjustment_group(heading: str, adjustments: List) -> List[str]:
+    """Render one heading followed by every adjustment of the group"""
+    return [heading] + [
+        ASSET_ADJUSTMENT_TEMPLATE.render({
+            **adj,
+            'action': "COMPRAR" if adj['amount_adjustment'] > 0 else "VENDER",
+            'amount_adjustment': abs(adj['amount_adjustment']),
+            'adjustment_brl': abs(adj['adjustment_brl'])
+        })
+        for adj in adjustments
+    ]
 
 # Format detailed asset-specific adjustments for the prompt
 def format_asset_adjustments(adjustments: List) -> str:
     """Format detailed asset-specific adjustments for the prompt"""
     if not adjustments:
-        return "\nPortfólio está dentro da margem de tolerância de ±2.5% da regra 70-30. Não são necessários ajustes no momento."
+        return NO_ADJUSTMENTS_TEXT
 
     result = ["\nRecomendações de Rebalanceamento (Portfólio fora da margem 70-30 ±2.5%):"]
-    
+
     # Separate cryptos and stables
-    cryptos = [adj for adj in adjustments if adj['symbol'] not in ['USDT', 'MUSD', 'USDB']]
-    stables = [adj for adj in adjustments if adj['symbol'] in ['USDT', 'MUSD', 'USDB']]
-    
+    cryptos = [adj for adj in adjustments if adj['symbol'] not in STABLECOINS]
+    stables = [adj for adj in adjustments if adj['symbol'] in STABLECOINS]
+
     if cryptos:
-        result.append("\n1. Ajustes em Criptomoedas:")
-        for adj in cryptos:
-            action = "COMPRAR" if adj['amount_adjustment'] > 0 else "VENDER"
-            result.append(f"\n{adj['symbol']} - {action}:")
-            result.append(f"  * Alocação atual: {adj['current_percentage']:.2f}% do portfólio total")
-            result.append(f"  * Nova alocação: {adj['target_percentage']:.2f}% do portfólio total")
-            result.append(f"  * Quantidade exata: {abs(adj['amount_adjustment']):.8f} {adj['symbol']}")
-            result.append(f"  * Valor em R$: {abs(adj['adjustment_brl']):.2f}")
-            result.append(f"  * Quantidade atual: {adj['current_amount']:.8f} {adj['symbol']}")
-            result.append(f"  * Quantidade após ajuste: {adj['target_amount']:.8f} {adj['symbol']}")
-    
+        result.extend(format_adjustment_group("\n1. Ajustes em Criptomoedas:", cryptos))
     if stables:
-        result.append("\n2. Ajustes em Stablecoins:")
-        for adj in stables:
-            action = "COMPRAR" if adj['amount_adjustment'] > 0 else "VENDER"
-            result.append(f"\n{adj['symbol']} - {action}:")
-            result.append(f"  * Alocação atual: {adj['current_percentage']:.2f}% do portfólio total")
-            result.append(f"  * Nova alocação: {adj['target_percentage']:.2f}% do portfólio total")
-            result.append(f"  * Quantidade exata: {abs(adj['amount_adjustment']):.8f} {adj['symbol']}")
-            result.append(f"  * Valor em R$: {abs(adj['adjustment_brl']):.2f}")
-            result.append(f"  * Quantidade atual: {adj['current_amount']:.8f} {adj['symbol']}")
-            result.append(f"  * Quantidade após ajuste: {adj['target_amount']:.8f} {adj['symbol']}")
-    
-    result.append("\nObservações Importantes:")
-    result.append("1. Estas recomendações visam reequilibrar o portfólio para a regra 70-30")
-    result.append("2. Os ajustes são necessários pois o portfólio está fora da margem de tolerância de ±2.5%")
-    result.append("3. As proporções entre ativos da mesma categoria (cripto/stable) são mantidas")
-    result.append("4. Execute as ordens na sequência sugerida para manter o balanceamento correto")
-    result.append("5. Os valores em R$ são aproximados e podem variar devido à volatilidade do mercado")
-    
+        result.extend(format_adjustment_group("\n2. Ajustes em Stablecoins:", stables))
+
+    result.append(ASSET_ADJUSTMENT_NOTES)
     return "\n".join(result)
 
-# Get AI analysis of the portfolio
-def get_ai_analysis(portfolio_data: Dict) -> Dict:
-    """Get AI analysis of the portfolio"""
-    try:
-        # Load prompt templates
-        system_prompt = load_prompt_template('system_prompt_pt.xml')
-        user_prompt_template = load_prompt_template('user_prompt_template_pt.xml')
+# Build a stable fingerprint of the inputs that drive the AI analysis
+def analysis_fingerprint(analysis_data: Dict, templates: List[CompiledTemplate] = (),
+                         precision: int = ANALYSIS_CACHE_PRECISION) -> str:
+    """Hash holdings, rounded allocations and the rebalance decision of a market analysis, and the prompt templates used"""
+    holdings = []
+    allocations = []
+    for category, assets in sorted(analysis_data['allocations'].items()):
+        for symbol, data in sorted(assets.items()):
+            holdings.append([symbol, round(float(data['amount']), 8)])
+            allocations.append([category, symbol, round(data['allocation_total'], precision)])
+
+    payload = json.dumps({
+        'holdings': holdings,
+        'allocations': allocations,
+        'rebalance_needed': bool(analysis_data.get('rebalance_needed')),
+        # An edited prompt must not be answered with analyses cached for the old one
+        'templates': [template.digest for template in templates]
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Cache of AI analyses keyed by portfolio fingerprint, backed by files on disk
+class AnalysisCache:
+    """TTL cache of AI analysis results kept in memory and persisted under a directory"""
+
+    def __init__(self, directory: str, ttl_seconds: float, sweep_interval: float):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._entries = {}
+        self._swept_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, f'{fingerprint}.json')
+
+    def get(self, fingerprint: str):
+        """Return the cached result for a fingerprint, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+        if entry is None:
+            # Another worker may have stored it already
+            try:
+                with open(self._path(fingerprint), 'r', encoding='utf-8') as f:
+                    file_io_bytes.inc(os.fstat(f.fileno()).st_size, file='analysis_cache', op='read')
+                    stored = json.load(f)
+                entry = (stored['created_at'], stored['result'])
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                cache_lookups.inc(cache='analysis', result='miss')
+                return None
+            except Exception as e:
+                logger.warning("Error reading analysis cache entry %s: %s", fingerprint, e)
+                cache_lookups.inc(cache='analysis', result='miss')
+                return None
 
-        if not system_prompt or not user_prompt_template:
-            return {"error": "Failed to load prompt templates"}
+        if now - entry[0] > self.ttl_seconds:
+            self.invalidate(fingerprint)
+            cache_lookups.inc(cache='analysis', result='miss')
+            return None
+
+        with self._lock:
+            self._entries[fingerprint] = entry
+        cache_lookups.inc(cache='analysis', result='hit')
+        return entry[1]
+
+    def put(self, fingerprint: str, result: Dict):
+        """Store a result in memory and atomically on disk"""
+        now = time.time()
+        with self._lock:
+            self._entries[fingerprint] = (now, result)
+            # Drop expired entries so memory stays bounded by the TTL window
+            expired = [key for key, (created_at, _) in self._entries.items() if now - created_at > self.ttl_seconds]
+            for key in expired:
+                del self._entries[key]
+            sweep = now - self._swept_at >= self.sweep_interval
+            if sweep:
+                self._swept_at = now
 
-        # Generate detailed market analysis
-        template_data = {
-            'system_prompt': system_prompt,
-            'user_template': user_prompt_template
-        }
-        
+        try:
+            written = atomic_write_json(self._path(fingerprint), {'created_at': now, 'result': result}, ensure_ascii=False)
+            file_io_bytes.inc(written, file='analysis_cache', op='write')
+        except Exception as e:
+            logger.error("Error writing analysis cache entry %s: %s", fingerprint, e)
+        if sweep:
+            self._sweep(now, keep=f'{fingerprint}.json')
+
+    def _sweep(self, now: float, keep: str):
+        # Entries only expire when read, so remove files of every worker past the TTL here,
+        # at most once per sweep_interval so the directory is not scanned on every put
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name == keep or not item.name.endswith(('.json', '.tmp')):
+                        continue
+                    # A temp file younger than a minute may be another worker's write in progress
+                    max_age = self.ttl_seconds if item.name.endswith('.json') else max(self.ttl_seconds, 60)
+                    try:
+                        if now - item.stat().st_mtime > max_age:
+                            os.remove(item.path)
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Error sweeping analysis cache directory: %s", e)
+
+    def invalidate(self, fingerprint: str):
+        """Remove a fingerprint from memory and disk"""
+        with self._lock:
+            self._entries.pop(fingerprint, None)
+        try:
+            os.remove(self._path(fingerprint))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Error removing analysis cache entry %s: %s", fingerprint, e)
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_TTL_SECONDS, ANALYSIS_CACHE_SWEEP_INTERVAL_SECONDS)
+
+# Chat completion parameters shared by the blocking and streaming analysis paths
+OPENAI_CHAT_PARAMS = {
+    'model': "gpt-4o",
+    'temperature': 0.13,
+    'max_tokens': 1500,
+    'presence_penalty': 0.3,
+    'frequency_penalty': 0.3
+}
+
+# Build the market analysis and prompts for the AI analysis
+def prepare_ai_analysis(portfolio_data: Dict) -> Dict:
+    """Generate market metrics, the analysis fingerprint and chat messages for a portfolio"""
+    # Compiled templates from memory; no disk reads on the request path
+    system_prompt = prompt_templates.get(SYSTEM_PROMPT_FILE)
+    user_prompt_template = prompt_templates.get(USER_PROMPT_FILE)
+
+    if not system_prompt or not user_prompt_template:
+        return {"error": "Failed to load prompt templates"}
+
+    # Generate detailed market analysis
+    template_data = {
+        'system_prompt': system_prompt.text,
+        'user_template': user_prompt_template.text
+    }
+
+    with span('market_analysis'):
         analysis_data = generate_market_analysis(portfolio_data, template_data)
-        if not analysis_data:
-            return {"error": "Failed to generate market analysis"}
+    if not analysis_data:
+        return {"error": "Failed to generate market analysis"}
+
+    # Fill the portfolio section, then the user template around it
+    with span('prompt_render'):
+        portfolio_section = PORTFOLIO_DATA_TEMPLATE.render({
+            'timestamp': analysis_data['timestamp'],
+            'total_value_brl': analysis_data['total_value_brl'],
+            'crypto_allocations': format_crypto_allocations(analysis_data['allocations']['crypto']),
+            'stable_allocations': format_stable_allocations(analysis_data['allocations']['stable']),
+            'rebalancing': (
+                format_rebalancing_suggestions(analysis_data['rebalance_suggestions'])
+                if analysis_data['rebalance_needed'] else WITHIN_TOLERANCE_TEXT
+            ),
+            'asset_adjustments': format_asset_adjustments(analysis_data['asset_adjustments'])
+        })
+        user_prompt = user_prompt_template.render({
+            'timestamp': analysis_data['timestamp'],
+            'portfolio_data': portfolio_section
+        })
 
-        # Format analysis prompt
-        user_prompt = f"""
-Análise de Portfólio - {analysis_data['timestamp']}
+    return {
+        "metrics": analysis_data,
+        "fingerprint": analysis_fingerprint(analysis_data, [system_prompt, user_prompt_template]),
+        "messages": [
+            {"role": "system", "content": system_prompt.text},
+            {"role": "user", "content": user_prompt}
+        ]
+    }
 
-Status atual do portfólio:
-- Valor Total: R$ {analysis_data['total_value_brl']:.2f}
+# Clean the model output and cache it for the prepared analysis
+def record_ai_analysis(prepared: Dict, content: str) -> str:
+    """Normalize the analysis text and store it under the analysis fingerprint"""
+    analysis = content.strip()
+    analysis = analysis.encode('utf-8').decode('utf-8')
+
+    analysis_cache.put(prepared['fingerprint'], {
+        "analysis": analysis,
+        "timestamp": prepared['metrics']['timestamp']
+    })
+    return analysis
+
+# Label an OpenAI call outcome for the upstream request counter
+def openai_status(error: Exception = None) -> str:
+    """HTTP status of a failed call when the SDK reports one, otherwise 'error'; '200' on success"""
+    if error is None:
+        return '200'
+    return str(getattr(error, 'status_code', None) or 'error')
+
+# Request the AI analysis for a prepared portfolio
+def complete_ai_analysis(prepared: Dict) -> str:
+    """Call the model for a prepared analysis and cache the resulting text"""
+    # Get AI analysis with specific parameters
+    client = get_openai_client()
+    with span('openai_completion'):
+        try:
+            response = client.chat.completions.create(
+                messages=prepared['messages'],
+                **OPENAI_CHAT_PARAMS
+            )
+        except Exception as e:
+            upstream_requests.inc(upstream='openai', status=openai_status(e))
+            raise
+    upstream_requests.inc(upstream='openai', status=openai_status())
+
+    # Extract and clean the analysis
+    return record_ai_analysis(prepared, response.choices[0].message.content)
+
+# Request the AI analysis once for all concurrent callers with the same fingerprint
+def coalesce_ai_analysis(prepared: Dict) -> Dict:
+    """Return {analysis, timestamp} from the cache or from a single shared model call"""
+    fingerprint = prepared['fingerprint']
+    cached = analysis_cache.get(fingerprint)
+    if cached:
+        return cached
+
+    def complete():
+        return {
+            "analysis": complete_ai_analysis(prepared),
+            "timestamp": prepared['metrics']['timestamp']
+        }
 
-Alocação por Categoria:
-Criptomoedas (Alvo: 70%):
-{format_crypto_allocations(analysis_data['allocations']['crypto'])}
+    return upstream_flights.do(('analysis', fingerprint), complete, recheck=lambda: analysis_cache.get(fingerprint))
 
-Stablecoins (Alvo: 30%):
-{format_stable_allocations(analysis_data['allocations']['stable'])}
+# Get AI analysis of the portfolio
+def get_ai_analysis(portfolio_data: Dict) -> Dict:
+    """Get AI analysis of the portfolio"""
+    try:
+        prepared = prepare_ai_analysis(portfolio_data)
+        if 'error' in prepared:
+            return prepared
 
-Necessidade de Rebalanceamento:
-{format_rebalancing_suggestions(analysis_data['rebalance_suggestions']) if analysis_data['rebalance_needed'] else 'Portfólio dentro dos limites de tolerância (±2.5%)'}
-
-{format_asset_adjustments(analysis_data['asset_adjustments'])}
-"""
-
-        # Get AI analysis with specific parameters
-        client = init_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.13,
-            max_tokens=1500,
-            presence_penalty=0.3,
-            frequency_penalty=0.3
-        )
+        analysis_data = prepared['metrics']
 
-        # Extract and clean the analysis
-        analysis = response.choices[0].message.content.strip()
-        analysis = analysis.encode('utf-8').decode('utf-8')
+        # Reuse a previous analysis when holdings and allocations have not moved,
+        # otherwise share one model call with concurrent requests for the same portfolio
+        result = coalesce_ai_analysis(prepared)
 
         return {
-            "analysis": analysis,
-            "timestamp": analysis_data['timestamp'],
+            "analysis": result['analysis'],
+            "timestamp": result['timestamp'],
             "metrics": analysis_data
         }
 
     except Exception as e:
-        error_msg = f"Error in AI analysis: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        logger.exception("Error in AI analysis: %s", e)
         return {"error": str(e)}
 
-# Clean old history entries from portfolio history
-def clean_old_history(history_data):
-    """Remove old entries from history based on configured limits"""
-    if not history_data or "history" not in history_data:
-        return {"history": []}
+# Stream AI analysis tokens for a prepared analysis
+def stream_ai_analysis(prepared: Dict):
+    """Yield analysis text deltas from the model and cache the full analysis when done"""
+    client = get_openai_client()
+    parts = []
+    # Timed from the request to the last chunk, like the blocking completion
+    with span('openai_completion'):
+        try:
+            stream = client.chat.completions.create(
+                messages=prepared['messages'],
+                stream=True,
+                **OPENAI_CHAT_PARAMS
+            )
+        except Exception as e:
+            upstream_requests.inc(upstream='openai', status=openai_status(e))
+            raise
+        upstream_requests.inc(upstream='openai', status=openai_status())
 
-    history = history_data["history"]
-    
-    # Sort by timestamp (newest first)
-    history.sort(key=lambda x: x["timestamp"], reverse=True)
-    
-    # Keep only MAX_HISTORY_ENTRIES
-    history = history[:MAX_HISTORY_ENTRIES]
-    
-    # Remove entries older than MAX_HISTORY_AGE_DAYS
-    cutoff_date = (datetime.now(timezone(timedelta(hours=-3))) - timedelta(days=MAX_HISTORY_AGE_DAYS)).isoformat()
-    history = [entry for entry in history if entry["timestamp"] >= cutoff_date]
-    
-    return {"history": history}
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stream.close()
+
+    analysis_cache.put(prepared['fingerprint'], {
+        "analysis": ''.join(parts).strip(),
+        "timestamp": prepared['metrics']['timestamp']
+    })
+
+# Background queue that runs AI analyses outside the request cycle
+class AnalysisJobQueue:
+    """
+    In-process job queue with a worker thread and de-duplication of in-flight analyses.
+    Every status change is also written under a directory, so a poll reaching another
+    worker can report pending, running and failed jobs too.
+    """
+
+    def __init__(self, directory: str, retention_seconds: float):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._queue = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each process starts its own worker
+        pid = os.getpid()
+        if self._worker_pid != pid:
+            self._jobs = {}
+            self._queue = queue.Queue()
+            worker = threading.Thread(target=self._run, args=(self._queue,), name='analysis-worker', daemon=True)
+            worker.start()
+            self._worker_pid = pid
+
+    def _persist(self, job: Dict):
+        try:
+            written = atomic_write_json(self._path(job['id']), job, ensure_ascii=False)
+            file_io_bytes.inc(written, file='analysis_jobs', op='write')
+        except Exception as e:
+            logger.error("Error writing analysis job %s: %s", job['id'], e)
+
+    def submit(self, prepared: Dict) -> Dict:
+        """Queue an analysis, returning the existing job when one with the same fingerprint is pending"""
+        job_id = prepared['fingerprint']
+        with self._lock:
+            self._ensure_worker()
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job and job['status'] in ('pending', 'running'):
+                return dict(job)
+
+            job = {
+                'id': job_id,
+                'status': 'pending',
+                'created_at': time.time(),
+                'timestamp': prepared['metrics']['timestamp']
+            }
+            self._jobs[job_id] = job
+            snapshot = dict(job)
+        # Written before the job is queued, so its status never moves backwards on disk
+        self._persist(snapshot)
+        self._queue.put((job_id, prepared))
+        return snapshot
+
+    def get(self, job_id: str):
+        """Return a snapshot of a job from this process or, failing that, as persisted by any worker"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                # A job left pending by a worker that died must not be reported forever
+                if time.time() - os.fstat(f.fileno()).st_mtime > self.retention_seconds:
+                    return None
+                file_io_bytes.inc(os.fstat(f.fileno()).st_size, file='analysis_jobs', op='read')
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            snapshot = dict(job)
+        self._persist(snapshot)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in ('done', 'failed') and job.get('finished_at', 0) < cutoff
+        ]
+        for job_id in finished:
+            del self._jobs[job_id]
+
+    def _sweep(self):
+        # Run by the job worker after each job, so request handlers never scan the directory
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if not item.name.endswith(('.json', '.tmp')):
+                        continue
+                    # A temp file younger than a minute may be another worker's write in progress
+                    max_age = self.retention_seconds if item.name.endswith('.json') else max(self.retention_seconds, 60)
+                    try:
+                        if now - item.stat().st_mtime > max_age:
+                            os.remove(item.path)
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _run(self, job_queue):
+        while True:
+            job_id, prepared = job_queue.get()
+            self._update(job_id, status='running')
+            try:
+                # Another worker may be running the same job, so share its result
+                analysis = coalesce_ai_analysis(prepared)['analysis']
+                self._update(job_id, status='done', analysis=analysis, finished_at=time.time())
+            except Exception as e:
+                logger.exception("Error in analysis job %s: %s", job_id, e)
+                self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+            finally:
+                self._sweep()
+                job_queue.task_done()
+
+analysis_jobs = AnalysisJobQueue(ANALYSIS_JOBS_DIR, ANALYSIS_JOB_RETENTION_SECONDS)
+
+# Value holdings with the given quotes
+def portfolio_value(holdings: Dict, prices: Dict) -> float:
+    """Total BRL value of holdings for the symbols present in prices"""
+    total_value = 0
+    for symbol, quantity in holdings.items():
+        if symbol in prices:
+            price_brl = prices[symbol]['quote']['BRL']['price']
+            total_value += float(quantity) * price_brl
+    return total_value
+
+# Value many portfolios at once over the union of their symbols
+def value_portfolios(portfolios: Dict[str, Dict], prices: Dict) -> Dict[str, Dict]:
+    """Build the per-asset and total BRL values of every portfolio with one matrix multiply"""
+    symbols = [
+        symbol for symbol in dict.fromkeys(symbol for holdings in portfolios.values() for symbol in holdings)
+        if symbol in prices and prices[symbol]['quote']['BRL']['price'] is not None
+    ]
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+    price_vector = np.array([prices[symbol]['quote']['BRL']['price'] for symbol in symbols], dtype=float)
+
+    # (portfolios, symbols) amounts matrix: per-asset values by broadcasting, totals by matmul
+    amounts = stack_portfolios(
+        [{symbol: amount for symbol, amount in holdings.items() if symbol in column} for holdings in portfolios.values()],
+        symbols
+    )
+    values = amounts * price_vector
+    totals = amounts @ price_vector
+
+    valued = {}
+    for row, (portfolio_id, holdings) in enumerate(portfolios.items()):
+        assets = {}
+        for symbol, amount in holdings.items():
+            if symbol in column:
+                assets[symbol] = {
+                    'amount': amount,
+                    'price_brl': float(price_vector[column[symbol]]),
+                    'value_brl': float(values[row, column[symbol]])
+                }
+        valued[portfolio_id] = {'assets': assets, 'total_brl': float(totals[row])}
+    return valued
 
 # Save portfolio data and append changes to history with concurrency control
 def save_portfolio_with_history(portfolio_data):
-    """Save portfolio data and append changes to history with concurrency control"""
+    """Save portfolio data and, when cached quotes cover it, append its value to history"""
+    # Only cached quotes are used, so no network call happens on the update path;
+    # when they are missing the price poller records the next history point
+    prices, _, missing = get_cached_crypto_prices(list(portfolio_data.keys()))
+    total_value = portfolio_value(portfolio_data, prices) if not missing else None
+
     with portfolio_lock:  # Use lock to prevent concurrent file access
         try:
-            # Load current history
-            if os.path.exists(HISTORY_FILE_PATH):
-                with open(HISTORY_FILE_PATH, 'r') as f:
-                    history_data = json.load(f)
-            else:
-                history_data = {"history": []}
-            
-            # Get current prices for portfolio valuation
-            symbols = list(portfolio_data.keys())
-            prices = get_crypto_prices(symbols)
-            
-            # Calculate total portfolio value
-            total_value = 0
-            for symbol, quantity in portfolio_data.items():
-                if symbol in prices:
-                    price_brl = prices[symbol]['quote']['BRL']['price']
-                    value_brl = float(quantity) * price_brl
-                    total_value += value_brl
-            
-            # Add new state to history
-            history_data["history"].append({
-                "timestamp": datetime.now(timezone(timedelta(hours=-3))).isoformat(),
-                "value": total_value
-            })
-            
-            # Clean old history entries
-            history_data = clean_old_history(history_data)
-
-            # Ensure data directory exists
-            os.makedirs(os.path.dirname(HISTORY_FILE_PATH), exist_ok=True)
-
-            # Save updated history
-            with open(HISTORY_FILE_PATH, 'w') as f:
-                json.dump(history_data, f, indent=4)
+            if STORAGE_BACKEND == 'sqlite':
+                # Holdings and history commit together; SQLite serializes writers across workers
+                if total_value is None:
+                    portfolio_store.save_holdings(portfolio_data)
+                else:
+                    portfolio_store.save_holdings_with_history(portfolio_data, total_value)
+                return True
 
             # Save the updated portfolio
-            with open('portfolio.json', 'w') as f:
-                json.dump(portfolio_data, f, indent=4)
+            written = atomic_write_json('portfolio.json', portfolio_data, indent=4)
+            file_io_bytes.inc(written, file='portfolio', op='write')
+
+            # Append new state to history; retention is applied by periodic compaction
+            if total_value is not None:
+                portfolio_store.append(total_value)
 
             return True
         except Exception as e:
-            print(f"Error saving portfolio with history: {e}")
+            logger.exception("Error saving portfolio with history: %s", e)
+            return False
+
+# Background poller that refreshes quotes and records history on a schedule
+class PricePoller:
+    """Single-leader poller: the worker holding a file lock fetches quotes and snapshots history"""
+
+    def __init__(self, interval_seconds: float, history_interval_seconds: float, lock_path: str):
+        self.interval_seconds = interval_seconds
+        self.history_interval_seconds = history_interval_seconds
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._last_history_at = None  # Read from the stored history on the first poll as leader
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the poller thread once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A lock file handle inherited across fork is not ours to keep
+            self._lock_file = None
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='price-poller', daemon=True).start()
+
+    def _try_lead(self) -> bool:
+        # The lock is released by the OS if the leader dies, so followers retry every interval
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
             return False
+        self._lock_file = lock_file
+        logger.info("Price poller leader elected (pid %d)", os.getpid())
+        return True
+
+    def poll_once(self):
+        """Fetch quotes for the portfolio, publish them and append a history point when due"""
+        holdings = load_portfolio()
+        if not holdings:
+            return
+        quotes = fetch_crypto_prices(list(holdings.keys()))
+        if quotes is None:
+            return
+        store_crypto_prices(quotes, holdings)
+
+        if self._last_history_at is None:
+            # A new leader continues the schedule of the previous one instead of snapshotting at once
+            epochs, _, _ = history_cache.series()
+            self._last_history_at = float(epochs[-1]) if len(epochs) else 0.0
+        now = time.time()
+        if now - self._last_history_at >= self.history_interval_seconds:
+            portfolio_store.append(portfolio_value(holdings, quotes))
+            self._last_history_at = now
+
+    def _run(self):
+        while True:
+            try:
+                if self._try_lead():
+                    self.poll_once()
+            except Exception as e:
+                logger.exception("Error in price poller: %s", e)
+            time.sleep(self.interval_seconds)
+
+price_poller = PricePoller(PRICE_POLL_INTERVAL_SECONDS, HISTORY_SNAPSHOT_INTERVAL_SECONDS, PRICE_POLLER_LOCK_PATH)
 
 # Save portfolio data to JSON file with history tracking
-def save_portfolio(portfolio_data):
-    """Save portfolio data to JSON file with history tracking"""
+def save_portfolio(portfolio_data, portfolio_id=DEFAULT_PORTFOLIO_ID):
+    """Save portfolio data; only the default portfolio tracks history"""
     try:
+        if portfolio_id != DEFAULT_PORTFOLIO_ID:
+            portfolios_store.save_portfolio(portfolio_id, portfolio_data)
+            return True
         return save_portfolio_with_history(portfolio_data)
     except Exception as e:
-        print(f"Error saving portfolio: {e}")
+        logger.exception("Error saving portfolio: %s", e)
         return False
 
+# Value portfolio holdings in BRL
+def build_portfolio(portfolio: Dict, prices: Dict) -> Dict:
+    """Build the portfolio payload with per-asset and total BRL values"""
+    return value_portfolios({DEFAULT_PORTFOLIO_ID: portfolio}, prices)[DEFAULT_PORTFOLIO_ID]
+
 # Get portfolio with current values in BRL
 @app.route('/api/portfolio', methods=['GET'])
 def get_portfolio():
@@ -661,44 +1566,34 @@ def get_portfolio():
     if not portfolio:
         return json_response({'error': 'Portfolio not found'}), 404
     
-    prices = get_crypto_prices(list(portfolio.keys()))
+    prices, prices_age = get_crypto_prices_with_age(list(portfolio.keys()))
     
     if not prices:
         return json_response({'error': 'Unable to fetch current prices'}), 500
     
-    portfolio_data = {
-        'assets': {},
-        'total_brl': 0
-    }
-    
-    for symbol, amount in portfolio.items():
-        if symbol in prices:
-            price_brl = prices[symbol]['quote']['BRL']['price']
-            value_brl = float(amount) * price_brl
-            
-            portfolio_data['assets'][symbol] = {
-                'amount': amount,
-                'price_brl': price_brl,
-                'value_brl': value_brl
-            }
-            
-            portfolio_data['total_brl'] += value_brl
-    
-    return json_response(portfolio_data)
+    return json_response({**build_portfolio(portfolio, prices), **price_freshness(prices_age)})
 
 # Update portfolio asset quantities
 @app.route('/api/portfolio/update', methods=['POST'])
 def update_portfolio():
     """Update portfolio asset quantities"""
+    return update_portfolio_holdings(DEFAULT_PORTFOLIO_ID)
+
+# Apply a holdings update request to a portfolio
+def update_portfolio_holdings(portfolio_id: str):
+    """Update asset quantities of a portfolio; portfolios other than the default are created on first update"""
     try:
         data = request.get_json()
         if not data or 'assets' not in data:
             return json_response({'error': 'Invalid request data'}), 400
 
         # Load current portfolio
-        current_portfolio = load_portfolio()
-        if not current_portfolio:
-            return json_response({'error': 'Failed to load current portfolio'}), 500
+        if portfolio_id == DEFAULT_PORTFOLIO_ID:
+            current_portfolio = load_portfolio()
+            if not current_portfolio:
+                return json_response({'error': 'Failed to load current portfolio'}), 500
+        else:
+            current_portfolio = load_portfolios([portfolio_id]).get(portfolio_id, {})
 
         # Update quantities
         for symbol, amount in data['assets'].items():
@@ -708,87 +1603,92 @@ def update_portfolio():
                 return json_response({'error': f'Invalid amount for {symbol}: {str(e)}'}), 400
 
         # Save updated portfolio
-        if save_portfolio(current_portfolio):
+        if save_portfolio(current_portfolio, portfolio_id):
             return json_response({'message': 'Portfolio updated successfully', 'portfolio': current_portfolio})
         else:
             return json_response({'error': 'Failed to save portfolio'}), 500
 
     except Exception as e:
         error_msg = f"Error updating portfolio: {str(e)}"
-        print(error_msg)
+        logger.error("Error updating portfolio: %s", e)
         return json_response({'error': error_msg}), 500
 
+# Value portfolio holdings with market data and aggregate changes for analysis
+def build_analysis_portfolio(portfolio: Dict, prices: Dict, portfolio_id: str = DEFAULT_PORTFOLIO_ID) -> Dict:
+    """Build the portfolio payload used by the analysis endpoints"""
+    portfolio_data = {
+        'assets': {},
+        'total_brl': 0,
+        'market_data': {}
+    }
+
+    for symbol, amount in portfolio.items():
+        if symbol in prices:
+            crypto_data = prices[symbol]
+            try:
+                price_brl = crypto_data['quote']['BRL']['price']
+                if price_brl is None:
+                    logger.warning("No price available for %s", symbol)
+                    continue
+
+                value_brl = float(amount) * price_brl
+
+                portfolio_data['assets'][symbol] = {
+                    'amount': amount,
+                    'price_brl': price_brl,
+                    'value_brl': value_brl,
+                    'percent_change_24h': crypto_data['quote']['BRL'].get('percent_change_24h', 0),
+                    'percent_change_7d': crypto_data['quote']['BRL'].get('percent_change_7d', 0)
+                }
+
+                portfolio_data['total_brl'] += value_brl
+
+                portfolio_data['market_data'][symbol] = {
+                    'price_change_24h': crypto_data['quote']['BRL'].get('percent_change_24h', 0),
+                    'price_change_7d': crypto_data['quote']['BRL'].get('percent_change_7d', 0),
+                    'market_cap': crypto_data['quote']['BRL'].get('market_cap', 0),
+                    'volume_24h': crypto_data['quote']['BRL'].get('volume_24h', 0)
+                }
+            except (KeyError, TypeError) as e:
+                logger.warning("Error processing data for %s: %s", symbol, e)
+                continue
+
+    # Rolling changes from the history aggregates
+    with span('portfolio_changes'):
+        changes = calculate_portfolio_changes(portfolio_data, portfolio_id)
+    portfolio_data["changes"] = changes
+
+    return portfolio_data
+
 # Get portfolio with AI analysis
 @app.route('/api/portfolio/analysis', methods=['GET'])
 def get_portfolio_analysis():
     """Get portfolio with AI analysis"""
+    return portfolio_analysis_response(load_portfolio())
+
+# Value a portfolio and attach the AI analysis
+def portfolio_analysis_response(portfolio: Dict, portfolio_id: str = DEFAULT_PORTFOLIO_ID):
+    """Build the analysis endpoint response for loaded holdings"""
     try:
-        portfolio = load_portfolio()
         if not portfolio:
-            print("No portfolio data found")
+            logger.info("No portfolio data found")
             return json_response({'error': 'Portfolio not found'}), 404
-        
-        print(f"Portfolio loaded: {portfolio}")
-        
-        prices = get_crypto_prices(list(portfolio.keys()))
+
+        prices, prices_age = get_crypto_prices_with_age(list(portfolio.keys()))
         if not prices:
-            print("Failed to fetch crypto prices")
+            logger.error("Failed to fetch crypto prices")
             return json_response({'error': 'Unable to fetch current prices'}), 500
-        
-        print(f"Prices fetched successfully")
-        
-        portfolio_data = {
-            'assets': {},
-            'total_brl': 0,
-            'market_data': {}
-        }
-        
-        for symbol, amount in portfolio.items():
-            if symbol in prices:
-                crypto_data = prices[symbol]
-                try:
-                    price_brl = crypto_data['quote']['BRL']['price']
-                    if price_brl is None:
-                        print(f"No price available for {symbol}")
-                        continue
-                        
-                    value_brl = float(amount) * price_brl
-                    
-                    portfolio_data['assets'][symbol] = {
-                        'amount': amount,
-                        'price_brl': price_brl,
-                        'value_brl': value_brl,
-                        'percent_change_24h': crypto_data['quote']['BRL'].get('percent_change_24h', 0),
-                        'percent_change_7d': crypto_data['quote']['BRL'].get('percent_change_7d', 0)
-                    }
-                    
-                    portfolio_data['total_brl'] += value_brl
-                    
-                    portfolio_data['market_data'][symbol] = {
-                        'price_change_24h': crypto_data['quote']['BRL'].get('percent_change_24h', 0),
-                        'price_change_7d': crypto_data['quote']['BRL'].get('percent_change_7d', 0),
-                        'market_cap': crypto_data['quote']['BRL'].get('market_cap', 0),
-                        'volume_24h': crypto_data['quote']['BRL'].get('volume_24h', 0)
-                    }
-                except (KeyError, TypeError) as e:
-                    print(f"Error processing data for {symbol}: {str(e)}")
-                    continue
-        
-        print(f"Portfolio data processed: {portfolio_data}")
 
-        # Calculate portfolio changes using CMC data
-        changes = calculate_portfolio_changes(portfolio_data)
-        portfolio_data["changes"] = changes
+        portfolio_data = build_analysis_portfolio(portfolio, prices, portfolio_id)
+        portfolio_data.update(price_freshness(prices_age))
 
         # Get AI analysis
         analysis_result = get_ai_analysis(portfolio_data)
         
         if 'error' in analysis_result:
-            print(f"Error in AI analysis: {analysis_result['error']}")
+            logger.error("Error in AI analysis: %s", analysis_result['error'])
             return json_response({'error': analysis_result['error']}), 500
-        
-        print("Analysis completed successfully")
-        
+
         return json_response({
             'portfolio': portfolio_data,
             'analysis': analysis_result['analysis'],
@@ -797,62 +1697,513 @@ def get_portfolio_analysis():
         })
         
     except Exception as e:
-        error_msg = f"Error in portfolio analysis: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        logger.exception("Error in portfolio analysis: %s", e)
+        return json_response({'error': str(e)}), 500
+
+# Start a background AI analysis and return portfolio metrics immediately
+@app.route('/api/portfolio/analysis/jobs', methods=['POST'])
+def create_portfolio_analysis_job():
+    """Queue an AI analysis job and return the portfolio and metrics right away"""
+    try:
+        portfolio = load_portfolio()
+        if not portfolio:
+            return json_response({'error': 'Portfolio not found'}), 404
+
+        prices, prices_age = get_crypto_prices_with_age(list(portfolio.keys()))
+        if not prices:
+            return json_response({'error': 'Unable to fetch current prices'}), 500
+
+        portfolio_data = build_analysis_portfolio(portfolio, prices)
+        portfolio_data.update(price_freshness(prices_age))
+        prepared = prepare_ai_analysis(portfolio_data)
+        if 'error' in prepared:
+            return json_response({'error': prepared['error']}), 500
+
+        result = {
+            'job_id': prepared['fingerprint'],
+            'portfolio': portfolio_data,
+            'timestamp': prepared['metrics']['timestamp'],
+            'metrics': prepared['metrics']
+        }
+
+        cached = analysis_cache.get(prepared['fingerprint'])
+        if cached:
+            result.update({'status': 'done', 'analysis': cached['analysis'], 'timestamp': cached['timestamp']})
+            return json_response(result)
+
+        job = analysis_jobs.submit(prepared)
+        result['status'] = job['status']
+        return json_response(result), 202
+
+    except Exception as e:
+        logger.exception("Error creating analysis job: %s", e)
         return json_response({'error': str(e)}), 500
 
-# Get portfolio history with optional time filter
+# Poll the status of a background AI analysis
+@app.route('/api/portfolio/analysis/jobs/<job_id>', methods=['GET'])
+def get_portfolio_analysis_job(job_id):
+    """Get the status and, once finished, the result of an analysis job"""
+    job = analysis_jobs.get(job_id)
+    if job:
+        return json_response({
+            'job_id': job_id,
+            'status': job['status'],
+            'analysis': job.get('analysis'),
+            'timestamp': job['timestamp'],
+            'error': job.get('error')
+        })
+
+    # Job ids are analysis fingerprints, so a job past its retention is still served from the shared cache
+    cached = analysis_cache.get(job_id)
+    if cached:
+        return json_response({
+            'job_id': job_id,
+            'status': 'done',
+            'analysis': cached['analysis'],
+            'timestamp': cached['timestamp'],
+            'error': None
+        })
+
+    return json_response({'error': 'Job not found'}), 404
+
+# Stream portfolio metrics followed by the AI analysis as Server-Sent Events
+@app.route('/api/portfolio/analysis/stream', methods=['GET'])
+def stream_portfolio_analysis():
+    """Stream portfolio with AI analysis as Server-Sent Events"""
+    try:
+        portfolio = load_portfolio()
+        if not portfolio:
+            return json_response({'error': 'Portfolio not found'}), 404
+
+        prices, prices_age = get_crypto_prices_with_age(list(portfolio.keys()))
+        if not prices:
+            return json_response({'error': 'Unable to fetch current prices'}), 500
+
+        portfolio_data = build_analysis_portfolio(portfolio, prices)
+        portfolio_data.update(price_freshness(prices_age))
+        prepared = prepare_ai_analysis(portfolio_data)
+        if 'error' in prepared:
+            return json_response({'error': prepared['error']}), 500
+
+    except Exception as e:
+        logger.exception("Error in portfolio analysis stream: %s", e)
+        return json_response({'error': str(e)}), 500
+
+    def generate():
+        # Metrics are ready before the model starts, so send them first
+        yield sse_event('portfolio', {
+            'portfolio': portfolio_data,
+            'timestamp': prepared['metrics']['timestamp'],
+            'metrics': prepared['metrics']
+        })
+
+        cached = analysis_cache.get(prepared['fingerprint'])
+        if cached:
+            yield sse_event('done', {
+                'analysis': cached['analysis'],
+                'timestamp': cached['timestamp'],
+                'cached': True
+            })
+            return
+
+        parts = []
+        try:
+            for delta in stream_ai_analysis(prepared):
+                parts.append(delta)
+                yield sse_event('token', {'delta': delta})
+        except Exception as e:
+            logger.exception("Error streaming AI analysis: %s", e)
+            yield sse_event('error', {'error': str(e)})
+            return
+
+        yield sse_event('done', {
+            'analysis': ''.join(parts).strip(),
+            'timestamp': prepared['metrics']['timestamp'],
+            'cached': False
+        })
+
+    return sse_response(generate())
+
+# Check that a portfolio ID is safe to use as a key and file name
+def valid_portfolio_id(portfolio_id: str) -> bool:
+    """Portfolio IDs are 1-64 letters, digits, underscores or hyphens"""
+    return PORTFOLIO_ID_PATTERN.fullmatch(portfolio_id) is not None
+
+# Value many portfolios with a single quotes request
+@app.route('/api/portfolios', methods=['GET'])
+def get_portfolios():
+    """Value the portfolios listed in ?ids=a,b,c (all portfolios by default) in one batch"""
+    try:
+        ids_param = request.args.get('ids')
+        if ids_param:
+            portfolio_ids = list(dict.fromkeys(
+                portfolio_id.strip() for portfolio_id in ids_param.split(',') if portfolio_id.strip()
+            ))
+        else:
+            portfolio_ids = list_portfolio_ids()
+
+        invalid = [portfolio_id for portfolio_id in portfolio_ids if not valid_portfolio_id(portfolio_id)]
+        if invalid:
+            return json_response({'error': f'Invalid portfolio IDs: {", ".join(invalid)}'}), 400
+        if len(portfolio_ids) > MAX_BATCH_PORTFOLIOS:
+            return json_response({'error': f'At most {MAX_BATCH_PORTFOLIOS} portfolios per request'}), 400
+
+        portfolios = load_portfolios(portfolio_ids)
+
+        # One quotes request for the union of all symbols held
+        symbols = list(dict.fromkeys(symbol for holdings in portfolios.values() for symbol in holdings))
+        prices, prices_age = get_crypto_prices_with_age(symbols) if symbols else ({}, 0.0)
+        if prices is None:
+            return json_response({'error': 'Unable to fetch current prices'}), 500
+
+        return json_response({
+            'portfolios': value_portfolios(portfolios, prices),
+            **price_freshness(prices_age),
+            'not_found': [portfolio_id for portfolio_id in portfolio_ids if portfolio_id not in portfolios]
+        })
+    except Exception as e:
+        error_msg = f"Error valuing portfolios: {str(e)}"
+        logger.exception("Error valuing portfolios: %s", e)
+        return json_response({'error': error_msg}), 500
+
+# Get one portfolio by ID with current values in BRL
+@app.route('/api/portfolios/<portfolio_id>', methods=['GET'])
+def get_portfolio_by_id(portfolio_id):
+    """Get a portfolio with current values in BRL"""
+    if not valid_portfolio_id(portfolio_id):
+        return json_response({'error': 'Invalid portfolio ID'}), 400
+
+    portfolio = load_portfolios([portfolio_id]).get(portfolio_id)
+    if not portfolio:
+        return json_response({'error': 'Portfolio not found'}), 404
+
+    prices, prices_age = get_crypto_prices_with_age(list(portfolio.keys()))
+    if not prices:
+        return json_response({'error': 'Unable to fetch current prices'}), 500
+
+    return json_response({**value_portfolios({portfolio_id: portfolio}, prices)[portfolio_id], **price_freshness(prices_age)})
+
+# Update asset quantities of a portfolio by ID
+@app.route('/api/portfolios/<portfolio_id>/update', methods=['POST'])
+def update_portfolio_by_id(portfolio_id):
+    """Update asset quantities of a portfolio, creating it if needed"""
+    if not valid_portfolio_id(portfolio_id):
+        return json_response({'error': 'Invalid portfolio ID'}), 400
+    return update_portfolio_holdings(portfolio_id)
+
+# Get a portfolio by ID with AI analysis
+@app.route('/api/portfolios/<portfolio_id>/analysis', methods=['GET'])
+def get_portfolio_analysis_by_id(portfolio_id):
+    """Get a portfolio with AI analysis"""
+    if not valid_portfolio_id(portfolio_id):
+        return json_response({'error': 'Invalid portfolio ID'}), 400
+    return portfolio_analysis_response(load_portfolios([portfolio_id]).get(portfolio_id, {}), portfolio_id)
+
+# Parse the target grid of a sweep request into a (t, k) list in REBALANCE_BUCKETS order
+def parse_sweep_targets(targets: List) -> List[List[float]]:
+    """Accept bucket->fraction dicts or lists ordered like REBALANCE_BUCKETS"""
+    buckets = list(REBALANCE_BUCKETS)
+    grid = []
+    for target in targets:
+        if isinstance(target, dict):
+            unknown = set(target) - set(buckets)
+            if unknown:
+                raise ValueError(f"Unknown buckets in target: {', '.join(sorted(unknown))}")
+            row = [float(target.get(bucket, 0)) for bucket in buckets]
+        else:
+            row = [float(value) for value in target]
+            if len(row) != len(buckets):
+                raise ValueError(f"Each target needs {len(buckets)} values ({', '.join(buckets)})")
+        if any(value < 0 for value in row) or abs(sum(row) - 1) > 1e-6:
+            raise ValueError(f"Target fractions must be non-negative and sum to 1, got {row}")
+        grid.append(row)
+    return grid
+
+# Evaluate a grid of target splits and tolerances against the current prices
+@app.route('/api/portfolio/rebalance/sweep', methods=['POST'])
+def rebalance_sweep():
+    """Run the band rebalancing rule for every target split x tolerance combination"""
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            target_grid = parse_sweep_targets(data.get('targets') or [
+                [REBALANCE_BUCKETS[bucket]['target'] for bucket in REBALANCE_BUCKETS]
+            ])
+            thresholds = [float(value) for value in data.get('thresholds') or [REBALANCE_THRESHOLD]]
+        except (TypeError, ValueError) as e:
+            return json_response({'error': f'Invalid sweep grid: {str(e)}'}), 400
+
+        if len(target_grid) * len(thresholds) > MAX_SWEEP_SCENARIOS:
+            return json_response({'error': f'Sweep grid exceeds {MAX_SWEEP_SCENARIOS} scenarios'}), 400
+
+        portfolio = load_portfolio()
+        if not portfolio:
+            return json_response({'error': 'Portfolio not found'}), 404
+
+        # A single price snapshot, usually served from the quote cache
+        prices = get_crypto_prices(list(portfolio.keys()))
+        if not prices:
+            return json_response({'error': 'Unable to fetch current prices'}), 500
+
+        # Symbols without a usable price would turn every total into NaN, which is not valid JSON
+        quoted = {symbol: prices[symbol]['quote']['BRL']['price'] for symbol in portfolio if symbol in prices}
+        symbols = [symbol for symbol, price in quoted.items() if price is not None and math.isfinite(price)]
+        unpriced = [symbol for symbol in portfolio if symbol not in symbols]
+        amounts = np.array([float(portfolio[symbol]) for symbol in symbols])
+        price_array = np.array([quoted[symbol] for symbol in symbols], dtype=float)
+
+        result = sweep(amounts, price_array, rebalance_categories(symbols), target_grid, thresholds)
+
+        buckets = list(REBALANCE_BUCKETS)
+        scenario_targets = result['targets'].tolist()
+        scenario_thresholds = result['thresholds'].tolist()
+        rebalance_needed = result['rebalance_needed'].tolist()
+        amount_adjustments = result['applied_amount_adjustments'].tolist()
+        value_adjustments = result['applied_value_adjustments'].tolist()
+        turnover = result['turnover'].tolist()
+        turnover_pct = result['turnover_pct'].tolist()
+
+        scenarios = []
+        for i in range(len(scenario_thresholds)):
+            scenarios.append({
+                'targets': dict(zip(buckets, scenario_targets[i])),
+                'threshold': scenario_thresholds[i],
+                'rebalance_needed': rebalance_needed[i],
+                'turnover_brl': turnover[i],
+                'turnover_percentage': turnover_pct[i],
+                'adjustments': {
+                    symbol: {
+                        'amount_adjustment': amount_adjustments[i][j],
+                        'adjustment_brl': value_adjustments[i][j]
+                    }
+                    for j, symbol in enumerate(symbols)
+                }
+            })
+
+        return json_response({
+            'timestamp': datetime.now(timezone(timedelta(hours=-3))).isoformat(),
+            'total_value_brl': float(result['total']),
+            'bucket_percentages': dict(zip(buckets, result['bucket_pct'].tolist())),
+            'unpriced_symbols': unpriced,
+            'scenarios': scenarios
+        })
+
+    except Exception as e:
+        logger.exception("Error in rebalance sweep: %s", e)
+        return json_response({'error': str(e)}), 500
+
+# Parse the history query parameters shared by the WSGI and ASGI endpoints
+def parse_history_params(args):
+    """Return (days, bucket_seconds, max_points); raises ValueError for invalid values"""
+    def optional_int(name):
+        # Non-numeric values are ignored, as Flask's request.args.get(type=int) does
+        try:
+            return int(args.get(name)) if args.get(name) is not None else None
+        except ValueError:
+            return None
+
+    # Get days parameter from query string, default to None (all history)
+    days = optional_int('days')
+
+    # Optional OHLC bucket size (e.g. 1h, 1d) and LTTB point budget
+    resolution = args.get('resolution')
+    bucket_seconds = parse_resolution(resolution) if resolution else None
+    max_points = optional_int('max_points')
+    if max_points is not None and not MIN_HISTORY_POINTS <= max_points <= MAX_HISTORY_POINTS:
+        raise ValueError(f'max_points must be between {MIN_HISTORY_POINTS} and {MAX_HISTORY_POINTS}')
+    return days, bucket_seconds, max_points
+
+# Get portfolio history with optional time filter and downsampling
 @app.route('/api/portfolio/history')
 def get_portfolio_history_endpoint():
-    """Get portfolio history with optional time filter"""
-    print("Received request for portfolio history")  # Debug log
+    """Get portfolio history with optional time filter and downsampling"""
+    logger.debug("Received request for portfolio history")
     try:
-        # Get days parameter from query string, default to None (all history)
-        days = request.args.get('days', type=int)
-        print(f"Filtering history for days: {days}")  # Debug log
+        try:
+            days, bucket_seconds, max_points = parse_history_params(request.args)
+        except ValueError as e:
+            return json_response({'error': str(e)}), 400
+        logger.debug("Filtering history for days: %s", days)
         
-        history_data = get_portfolio_history(days)
-        print(f"Returning history data: {history_data}")  # Debug log
+        history_data = get_portfolio_history(days, bucket_seconds, max_points)
         
         return json_response(history_data)
     except Exception as e:
         error_msg = f"Error retrieving portfolio history: {str(e)}"
-        print(f"Error in history endpoint: {error_msg}")  # Debug log
-        traceback.print_exc()  # Print full traceback
+        logger.exception("Error in history endpoint: %s", error_msg)
         return json_response({"error": error_msg}), 500
 
-# Retrieve portfolio history with optional time filter
-def get_portfolio_history(days=None):
-    """Retrieve portfolio history with optional time filter"""
+# Retrieve portfolio history with optional time filter and downsampling
+def get_portfolio_history(days=None, bucket_seconds=None, max_points=None):
+    """Retrieve portfolio history, optionally bucketed into OHLC and/or reduced with LTTB"""
     try:
-        if not os.path.exists(HISTORY_FILE_PATH):
-            print(f"History file not found at: {HISTORY_FILE_PATH}")
-            return {"history": []}
-        
-        with open(HISTORY_FILE_PATH, 'r') as f:
-            history_data = json.load(f)
-            print(f"Loaded history data: {history_data}")  # Debug log
-        
+        since = None
         if days is not None:
-            cutoff_date = (datetime.now(timezone(timedelta(hours=-3))) - timedelta(days=days)).isoformat()
-            history_data["history"] = [
-                entry for entry in history_data["history"]
-                if entry["timestamp"] >= cutoff_date
-            ]
-        
-        return history_data
+            since = datetime.now(timezone(timedelta(hours=-3))) - timedelta(days=days)
+
+        with span('history_load'):
+            epochs, values, timestamps = history_cache.series(since=since)
+        with span('history_downsample'):
+            if bucket_seconds:
+                columns = bucket_ohlc(epochs, values, bucket_seconds)
+                if max_points:
+                    keep = lttb_indices(columns['ts'], columns['close'], max_points)
+                    columns = {name: column[keep] for name, column in columns.items()}
+                brt = timezone(timedelta(hours=-3))
+                lists = {name: column.tolist() for name, column in columns.items()}
+                history = [
+                    {
+                        'timestamp': datetime.fromtimestamp(ts, brt).isoformat(),
+                        'open': lists['open'][i],
+                        'high': lists['high'][i],
+                        'low': lists['low'][i],
+                        'close': lists['close'][i],
+                        'value': lists['close'][i],  # Close value, so line charts keep working
+                        'count': lists['count'][i]
+                    }
+                    for i, ts in enumerate(lists['ts'])
+                ]
+            else:
+                keep = lttb_indices(epochs, values, max_points).tolist() if max_points else range(len(epochs))
+                value_list = values.tolist()
+                history = [{'timestamp': timestamps[i], 'value': value_list[i]} for i in keep]
+
+        # Newest first, as the history endpoint has always returned it
+        return {"history": history[::-1]}
     except Exception as e:
-        print(f"Error retrieving portfolio history: {e}")
-        traceback.print_exc()
+        logger.exception("Error retrieving portfolio history: %s", e)
         return {"history": []}
 
+# Parse a start or end query parameter
+def parse_time_param(value: str):
+    """Return epoch seconds for an ISO 8601 timestamp (BRT when no offset is given) or a number of epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}', expected ISO 8601 or epoch seconds")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone(timedelta(hours=-3)))
+    return moment.timestamp()
+
+# Get the recorded price history of one asset
+@app.route('/api/assets/<symbol>/history')
+def get_asset_history_endpoint(symbol):
+    """Get an asset's price history with optional time range and downsampling"""
+    if not SYMBOL_PATTERN.fullmatch(symbol):
+        return json_response({'error': 'Invalid symbol'}), 400
+    try:
+        days, bucket_seconds, max_points = parse_history_params(request.args)
+        start = parse_time_param(request.args['start']) if request.args.get('start') else None
+        end = parse_time_param(request.args['end']) if request.args.get('end') else None
+    except ValueError as e:
+        return json_response({'error': str(e)}), 400
+    if days is not None:
+        since = time.time() - days * 86400
+        start = since if start is None else max(start, since)
+
+    try:
+        history = get_asset_history(symbol.upper(), start, end, bucket_seconds, max_points)
+    except Exception as e:
+        logger.exception("Error retrieving asset history for %s: %s", symbol, e)
+        return json_response({'error': f"Error retrieving asset history: {str(e)}"}), 500
+    if history is None:
+        return json_response({'error': f'No price history for {symbol.upper()}'}), 404
+    return json_response(history)
+
+# Read a time range of an asset's series, bucketed and/or downsampled
+def get_asset_history(symbol: str, start: float = None, end: float = None, bucket_seconds: int = None, max_points: int = None):
+    """
+    Return {symbol, history} with points newest first, or None if the symbol has no series
+    Each point has timestamp, price, amount and value (price x amount, None when not held).
+    With bucket_seconds, points also carry open/high/low/close and price is the close.
+    At most max_points are returned (MAX_HISTORY_POINTS by default), selected with LTTB on price.
+    """
+    if len(asset_series.series(symbol)) == 0:
+        return None
+
+    with span('asset_history_load'):
+        records = asset_series.range(symbol, start, end)
+    with span('asset_history_downsample'):
+        if bucket_seconds:
+            columns = bucket_records(records, bucket_seconds)
+            columns['price'] = columns['close']
+        else:
+            columns = {'ts': records['ts'], 'price': records['price'], 'amount': records['amount']}
+
+        limit = max_points or MAX_HISTORY_POINTS
+        if len(columns['ts']) > limit:
+            keep = lttb_indices(columns['ts'], columns['price'], limit)
+            columns = {name: values[keep] for name, values in columns.items()}
+
+        brt = timezone(timedelta(hours=-3))
+        lists = {name: values.tolist() for name, values in columns.items()}
+        points = []
+        for i, ts in enumerate(lists['ts']):
+            amount = lists['amount'][i]
+            amount = None if amount != amount else amount  # NaN marks a symbol that was not held
+            point = {
+                'timestamp': datetime.fromtimestamp(ts, brt).isoformat(),
+                'price': lists['price'][i],
+                'amount': amount,
+                'value': lists['price'][i] * amount if amount is not None else None
+            }
+            if bucket_seconds:
+                for name in ('open', 'high', 'low', 'close'):
+                    point[name] = lists[name][i]
+            points.append(point)
+
+    # Newest first, like the portfolio history endpoint
+    return {'symbol': symbol, 'history': points[::-1]}
+
+# Start the price poller in a serving process; only the lock holder polls
+def start_price_poller():
+    """Start the poller when enabled; called by gunicorn's post_worker_init hook, the ASGI lifespan and __main__"""
+    if PRICE_POLLER_ENABLED:
+        price_poller.start()
+
+# Start timing the request and make sure this worker publishes its metrics
+@app.before_request
+def start_request_timer():
+    """Record the request start time and start the metrics flusher in forked workers"""
+    g.request_started = time.perf_counter()
+    metrics_registry.start_flusher(METRICS_DIR, METRICS_FLUSH_INTERVAL_SECONDS)
+
+# Record how long the request took, by route
+@app.after_request
+def observe_request(response):
+    """Observe the request duration; streamed responses are timed up to their first byte"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+# Expose request, stage, upstream, cache and file I/O metrics of all workers
+@app.route('/metrics')
+def get_metrics():
+    """Serve metrics in the Prometheus text exposition format"""
+    snapshots = metrics_registry.collect(METRICS_DIR, METRICS_WORKER_MAX_AGE_SECONDS)
+    return Response(metrics_registry.render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Register routes at the end of the file
 @app.route('/')
 def home():
     return "Portfolio Crypto API"
 
 if __name__ == '__main__':
-    print("Starting Flask server...")
-    print(f"Available routes: {[str(rule) for rule in app.url_map.iter_rules()]}")  # Debug log
+    logger.info("Starting Flask server...")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Available routes: %s", [str(rule) for rule in app.url_map.iter_rules()])
     port = int(os.environ.get("PORT", 10000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # With the reloader, only the child process serves requests
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_price_poller()
+    app.run(host='0.0.0.0', port=port, debug=DEBUG)
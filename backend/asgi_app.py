@@ -0,0 +1,272 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from httpx import Proxy
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app,
+    CMC_API_KEY, CMC_BASE_URL, CMC_CONNECT_TIMEOUT, CMC_MAX_RETRIES, CMC_POOL_MAXSIZE,
+    CMC_READ_TIMEOUT, CMC_RETRY_STATUS_CODES, OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_CHAT_PARAMS,
+    METRICS_DIR, METRICS_FLUSH_INTERVAL_SECONDS, OPENAI_CONNECT_TIMEOUT, OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_READ_TIMEOUT, QUOTE_CONVERT_CURRENCY, QUOTE_STALE_MAX_AGE_SECONDS, analysis_cache,
+    build_analysis_portfolio, build_portfolio, cmc_backoff_delay, get_cached_crypto_prices,
+    get_portfolio_history, load_portfolio, merge_price_ages, openai_status, parse_history_params,
+    parse_quote_response, prepare_ai_analysis, price_freshness, quote_flight_key,
+    quote_request_params, quote_snapshot, recheck_crypto_prices, record_ai_analysis,
+    schedule_price_refresh, start_price_poller, store_crypto_prices, upstream_flights
+)
+from metrics import cache_lookups, http_request_seconds, registry as metrics_registry, span, upstream_requests, upstream_retries
+
+logger = logging.getLogger(__name__)
+
+# Async HTTP clients, created per worker when the event loop starts
+clients = {}
+
+def json_response(data, status_code=200):
+    """Helper function to create JSON responses with the same headers as the Flask app"""
+    return JSONResponse(data, status_code=status_code, headers={
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type'
+    })
+
+# Perform a GET request against the CoinMarketCap API without blocking the event loop
+async def cmc_get_async(path, params):
+    """Async counterpart of cmc_get, retrying 429/5xx and connection errors with jittered backoff"""
+    client = clients['cmc']
+    for attempt in range(CMC_MAX_RETRIES + 1):
+        try:
+            response = await client.get(path, params=params)
+        except (httpx.ConnectError, httpx.TimeoutException) as e:
+            upstream_requests.inc(upstream='cmc', status='error')
+            if attempt == CMC_MAX_RETRIES:
+                raise
+            upstream_retries.inc(upstream='cmc')
+            logger.warning("CMC request failed (%s), retrying (%d/%d)", e, attempt + 1, CMC_MAX_RETRIES)
+            await asyncio.sleep(cmc_backoff_delay(attempt))
+            continue
+
+        upstream_requests.inc(upstream='cmc', status=response.status_code)
+        if response.status_code not in CMC_RETRY_STATUS_CODES or attempt == CMC_MAX_RETRIES:
+            return response
+
+        upstream_retries.inc(upstream='cmc')
+        logger.warning("CMC returned %s, retrying (%d/%d)", response.status_code, attempt + 1, CMC_MAX_RETRIES)
+        await asyncio.sleep(cmc_backoff_delay(attempt, response))
+
+# Get current prices and the age of the oldest quote, served from the quote cache when fresh
+async def get_crypto_prices_async(symbols):
+    """Async counterpart of get_crypto_prices_with_age"""
+    with span('prices'):
+        cached, ages, missing = await asyncio.to_thread(get_cached_crypto_prices, symbols)
+        if not missing:
+            return cached, max(ages.values(), default=0.0)
+
+        # Serve the last known good quotes now; the refresh runs in a background thread
+        stale, stale_ages, unknown = await asyncio.to_thread(
+            quote_snapshot.get_many, missing, QUOTE_CONVERT_CURRENCY, QUOTE_STALE_MAX_AGE_SECONDS
+        )
+        if not unknown:
+            cache_lookups.inc(len(stale), cache='quote_stale', result='hit')
+            schedule_price_refresh(missing)
+            return merge_price_ages(cached, ages, stale, stale_ages)
+
+        async def fetch():
+            try:
+                with span('cmc_fetch'):
+                    response = await cmc_get_async('/cryptocurrency/quotes/latest', quote_request_params(missing))
+                    fetched = parse_quote_response(missing, response.status_code, response.json())
+            except Exception as e:
+                logger.exception("Error in get_crypto_prices_async: %s", e)
+                return None
+            if fetched is not None:
+                await asyncio.to_thread(store_crypto_prices, fetched)
+            return fetched
+
+        fetched = await upstream_flights.do_async(
+            quote_flight_key(missing), fetch, recheck=lambda: recheck_crypto_prices(missing)
+        )
+        if fetched is not None:
+            return merge_price_ages(cached, ages, fetched, {symbol: 0.0 for symbol in missing})
+
+        # Upstream is failing, so fall back to whatever was last fetched
+        stale, stale_ages, unknown = await asyncio.to_thread(quote_snapshot.get_many, missing, QUOTE_CONVERT_CURRENCY)
+        if unknown:
+            return None, None
+        cache_lookups.inc(len(stale), cache='quote_last_known_good', result='hit')
+        return merge_price_ages(cached, ages, stale, stale_ages)
+
+# Get AI analysis of the portfolio without blocking the event loop
+async def get_ai_analysis_async(portfolio_data: Dict) -> Dict:
+    """Async counterpart of get_ai_analysis"""
+    try:
+        prepared = await asyncio.to_thread(prepare_ai_analysis, portfolio_data)
+        if 'error' in prepared:
+            return prepared
+
+        analysis_data = prepared['metrics']
+        fingerprint = prepared['fingerprint']
+        cached = await asyncio.to_thread(analysis_cache.get, fingerprint)
+        if cached:
+            return {
+                "analysis": cached['analysis'],
+                "timestamp": cached['timestamp'],
+                "metrics": analysis_data
+            }
+
+        async def complete():
+            with span('openai_completion'):
+                try:
+                    response = await clients['openai'].chat.completions.create(
+                        messages=prepared['messages'],
+                        **OPENAI_CHAT_PARAMS
+                    )
+                except Exception as e:
+                    upstream_requests.inc(upstream='openai', status=openai_status(e))
+                    raise
+            upstream_requests.inc(upstream='openai', status=openai_status())
+            analysis = await asyncio.to_thread(record_ai_analysis, prepared, response.choices[0].message.content)
+            return {"analysis": analysis, "timestamp": analysis_data['timestamp']}
+
+        # Same key as the sync path, so concurrent requests in any worker share one model call
+        result = await upstream_flights.do_async(
+            ('analysis', fingerprint), complete, recheck=lambda: analysis_cache.get(fingerprint)
+        )
+
+        return {
+            "analysis": result['analysis'],
+            "timestamp": result['timestamp'],
+            "metrics": analysis_data
+        }
+
+    except Exception as e:
+        logger.exception("Error in AI analysis: %s", e)
+        return {"error": str(e)}
+
+# Get portfolio with current values in BRL
+async def get_portfolio(request):
+    """Get portfolio with current values in BRL"""
+    portfolio = await asyncio.to_thread(load_portfolio)
+    if not portfolio:
+        return json_response({'error': 'Portfolio not found'}, 404)
+
+    prices, prices_age = await get_crypto_prices_async(list(portfolio.keys()))
+    if not prices:
+        return json_response({'error': 'Unable to fetch current prices'}, 500)
+
+    return json_response({**build_portfolio(portfolio, prices), **price_freshness(prices_age)})
+
+# Get portfolio with AI analysis
+async def get_portfolio_analysis(request):
+    """Get portfolio with AI analysis"""
+    try:
+        portfolio = await asyncio.to_thread(load_portfolio)
+        if not portfolio:
+            return json_response({'error': 'Portfolio not found'}, 404)
+
+        prices, prices_age = await get_crypto_prices_async(list(portfolio.keys()))
+        if not prices:
+            return json_response({'error': 'Unable to fetch current prices'}, 500)
+
+        # Prices are cached by now, so this only does local work
+        portfolio_data = await asyncio.to_thread(build_analysis_portfolio, portfolio, prices)
+        portfolio_data.update(price_freshness(prices_age))
+
+        analysis_result = await get_ai_analysis_async(portfolio_data)
+        if 'error' in analysis_result:
+            return json_response({'error': analysis_result['error']}, 500)
+
+        return json_response({
+            'portfolio': portfolio_data,
+            'analysis': analysis_result['analysis'],
+            'timestamp': analysis_result['timestamp'],
+            'metrics': analysis_result['metrics']
+        })
+
+    except Exception as e:
+        logger.exception("Error in portfolio analysis: %s", e)
+        return json_response({'error': str(e)}, 500)
+
+# Get portfolio history with optional time filter and downsampling
+async def get_portfolio_history_endpoint(request):
+    """Get portfolio history with optional time filter and downsampling"""
+    try:
+        try:
+            days, bucket_seconds, max_points = parse_history_params(request.query_params)
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+
+        history_data = await asyncio.to_thread(get_portfolio_history, days, bucket_seconds, max_points)
+        return json_response(history_data)
+    except Exception as e:
+        error_msg = f"Error retrieving portfolio history: {str(e)}"
+        logger.exception("Error in history endpoint: %s", error_msg)
+        return json_response({"error": error_msg}, 500)
+
+# Time a native route like the Flask app times its routes
+def timed_route(path, endpoint, methods):
+    """Route whose handler duration is recorded in portfolio_http_request_seconds"""
+    async def handler(request):
+        started = time.perf_counter()
+        response = await endpoint(request)
+        http_request_seconds.observe(
+            time.perf_counter() - started, endpoint=path, method=request.method, status=response.status_code
+        )
+        return response
+
+    return Route(path, handler, methods=methods)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Create pooled async clients and start the background threads for this worker; close the clients on shutdown"""
+    metrics_registry.start_flusher(METRICS_DIR, METRICS_FLUSH_INTERVAL_SECONDS)
+    start_price_poller()
+    clients['cmc'] = httpx.AsyncClient(
+        base_url=CMC_BASE_URL,
+        headers={'Accepts': 'application/json', 'X-CMC_PRO_API_KEY': CMC_API_KEY},
+        limits=httpx.Limits(max_connections=CMC_POOL_MAXSIZE, max_keepalive_connections=CMC_POOL_MAXSIZE),
+        timeout=httpx.Timeout(CMC_READ_TIMEOUT, connect=CMC_CONNECT_TIMEOUT)
+    )
+    proxy_str = os.getenv('PROXIES')
+    openai_http_client = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            proxy=Proxy(url=proxy_str) if proxy_str else None,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+            )
+        ),
+        verify=False,
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+    clients['openai'] = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        http_client=openai_http_client,
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+    try:
+        yield
+    finally:
+        await clients.pop('openai').close()
+        await clients.pop('cmc').aclose()
+
+# I/O-bound endpoints run natively async; everything else falls through to the Flask app
+app = Starlette(
+    routes=[
+        timed_route('/api/portfolio', get_portfolio, methods=['GET']),
+        timed_route('/api/portfolio/analysis', get_portfolio_analysis, methods=['GET']),
+        timed_route('/api/portfolio/history', get_portfolio_history_endpoint, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ],
+    lifespan=lifespan
+)
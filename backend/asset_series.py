@@ -0,0 +1,143 @@
+import os
+import re
+import fcntl
+import logging
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from metrics import file_io_bytes
+from timeseries import bucket_ohlc
+
+logger = logging.getLogger(__name__)
+
+# One fixed-size record per quote; a symbol's file is a flat array of these
+RECORD_DTYPE = np.dtype([('ts', '<f8'), ('price', '<f8'), ('amount', '<f8')])
+SYMBOL_PATTERN = re.compile(r'[A-Za-z0-9]{1,20}')
+
+# Per-asset price and holding series stored as memory-mapped record arrays
+class AssetSeriesStore:
+    """
+    Append-only (epoch, price, amount) records per symbol, one binary file each.
+    Appends are single O_APPEND writes under a per-file lock; reads memory-map the file
+    and slice time ranges with a binary search, so only the pages touched are read.
+    """
+
+    def __init__(self, directory: str, min_interval: float, max_points: int):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.max_points = max_points
+        self._maps = {}  # symbol -> (stat key, memmap)
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.directory, f'{symbol.upper()}.f64')
+
+    def append(self, symbol: str, ts: float, price: float, amount: Optional[float] = None) -> bool:
+        """Record a quote unless it is older than, or within min_interval of, the latest one"""
+        if not SYMBOL_PATTERN.fullmatch(symbol) or price is None:
+            return False
+        record = np.array([(ts, price, np.nan if amount is None else amount)], dtype=RECORD_DTYPE).tobytes()
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(symbol)
+        fd = self._open_locked(path)
+        try:
+            size = os.fstat(fd).st_size
+            count = size // RECORD_DTYPE.itemsize
+            if count:
+                last = np.frombuffer(
+                    os.pread(fd, RECORD_DTYPE.itemsize, (count - 1) * RECORD_DTYPE.itemsize), dtype=RECORD_DTYPE
+                )[0]
+                if ts < last['ts'] + self.min_interval:
+                    return False
+            if size % RECORD_DTYPE.itemsize:
+                # Drop the tail of a write interrupted by a crash so records stay aligned
+                os.ftruncate(fd, count * RECORD_DTYPE.itemsize)
+            os.write(fd, record)
+            file_io_bytes.inc(len(record), file='asset_series', op='write')
+            if count + 1 > self.max_points * 1.1:
+                self._compact(path, fd, count + 1)
+            return True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _open_locked(self, path: str) -> int:
+        # Workers fetching overlapping symbol sets append to the same file; if another worker
+        # compacted it while we waited for the lock, our descriptor points at the replaced file
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _compact(self, path: str, fd: int, count: int):
+        # Keep the newest max_points records; readers holding the old mapping are unaffected
+        keep = self.max_points * RECORD_DTYPE.itemsize
+        data = os.pread(fd, keep, (count - self.max_points) * RECORD_DTYPE.itemsize)
+        tmp_path = f'{path}.compact'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        file_io_bytes.inc(len(data), file='asset_series', op='write')
+
+    def append_quotes(self, quotes: Dict, convert: str, ts: float, holdings: Dict = None):
+        """Record the price of every quote at ts, with the held amount when the symbol is in holdings"""
+        holdings = holdings or {}
+        for symbol, data in quotes.items():
+            try:
+                price = data['quote'][convert]['price']
+                amount = holdings.get(symbol)
+                self.append(symbol, ts, price, float(amount) if amount is not None else None)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning("Skipping %s in asset series: %s", symbol, e)
+            except OSError as e:
+                logger.error("Error appending to asset series for %s: %s", symbol, e)
+
+    def series(self, symbol: str) -> np.ndarray:
+        """Return the symbol's records as a read-only memory-mapped array, empty if none are stored"""
+        if not SYMBOL_PATTERN.fullmatch(symbol):
+            return np.empty(0, dtype=RECORD_DTYPE)
+        symbol = symbol.upper()
+        path = self._path(symbol)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        count = stat.st_size // RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+        # The mapping is reused until the file grows or is replaced by compaction
+        stat_key = (stat.st_ino, count)
+        with self._lock:
+            cached = self._maps.get(symbol)
+            if cached and cached[0] == stat_key:
+                return cached[1]
+            mapped = np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+            self._maps[symbol] = (stat_key, mapped)
+            return mapped
+
+    def range(self, symbol: str, start: float = None, end: float = None) -> np.ndarray:
+        """Return records with start <= ts <= end, found by binary search on the time column"""
+        records = self.series(symbol)
+        ts = records['ts']
+        lo = np.searchsorted(ts, start, side='left') if start is not None else 0
+        hi = np.searchsorted(ts, end, side='right') if end is not None else len(records)
+        return records[lo:hi]
+
+# Aggregate records into fixed-width OHLC buckets of the price column
+def bucket_records(records: np.ndarray, bucket_seconds: int) -> Dict[str, np.ndarray]:
+    """Return bucket start times with open/high/low/close prices, point counts and the closing amount"""
+    columns = bucket_ohlc(records['ts'], records['price'], bucket_seconds)
+    columns['amount'] = records['amount'][np.cumsum(columns['count']) - 1]
+    return columns
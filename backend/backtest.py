@@ -0,0 +1,209 @@
+import argparse
+import csv
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from rebalance import category_indices, rebalance
+
+BACKTEST_WINDOW = 1024  # Time steps scanned per vectorized band check
+
+# Load a wide price table (timestamp column plus one column per symbol)
+def load_prices(path: str):
+    """
+    Load locally stored prices from CSV or Parquet
+    Args:
+        path: File with a 'timestamp' column and one price column per symbol
+    Returns:
+        (timestamps as epoch seconds, symbols, prices array of shape (t, n))
+    """
+    if path.endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError("Reading Parquet price files requires pandas and pyarrow") from e
+        frame = pd.read_parquet(path)
+        timestamps = pd.to_datetime(frame.pop('timestamp'), utc=True).astype('int64').to_numpy() / 1e9
+        return timestamps, list(frame.columns), frame.to_numpy(dtype=float)
+
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if header[0] != 'timestamp':
+            raise ValueError(f"First column of {path} must be 'timestamp'")
+        timestamps = []
+        rows = []
+        for row in reader:
+            timestamps.append(parse_timestamp(row[0]))
+            rows.append([float(value) for value in row[1:]])
+    return np.array(timestamps), header[1:], np.array(rows, dtype=float)
+
+# Parse an epoch or ISO-8601 timestamp into epoch seconds
+def parse_timestamp(value: str) -> float:
+    """Convert an epoch number or ISO timestamp (naive values are UTC) into epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+
+# Generate a reproducible random-walk price table for offline benchmarks
+def synthetic_prices(steps: int, symbols: Sequence[str], stable_symbols: Sequence[str],
+                     step_seconds: int = 3600, volatility: float = 0.01, seed: int = 42):
+    """Geometric random walk for volatile symbols and a flat price for stablecoins"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, volatility, size=(steps, len(symbols)))
+    stable_mask = np.array([symbol in stable_symbols for symbol in symbols])
+    returns[:, stable_mask] = 0.0
+    prices = 100.0 * np.exp(np.cumsum(returns, axis=0))
+    prices[:, stable_mask] = 5.0
+    timestamps = time.time() - step_seconds * np.arange(steps)[::-1]
+    return timestamps, list(symbols), prices
+
+# Find the first time step whose bucket drift leaves the tolerance band
+def first_breach(prices: np.ndarray, amounts: np.ndarray, membership: np.ndarray,
+                 targets: np.ndarray, threshold: float) -> int:
+    """Return the index of the first breach in prices (t, n) for fixed holdings, or -1"""
+    values = prices * amounts
+    total = values.sum(axis=1, keepdims=True)
+    bucket_pct = (values @ membership) / np.where(total > 0, total, 1.0) * 100
+    breached = np.abs(bucket_pct - targets * 100).max(axis=1) > threshold
+    return int(np.argmax(breached)) if breached.any() else -1
+
+# Replay the band rebalancing rule over a price history
+def backtest(prices, initial_amounts, categories, targets, threshold: float,
+             fee_rate: float = 0.0, window: int = BACKTEST_WINDOW) -> Dict:
+    """
+    Simulate the band rule: hold until any bucket drifts past threshold, then trade back to targets
+    Args:
+        prices: Price history, shape (t, n)
+        initial_amounts: Holdings at the first step, shape (n,)
+        categories: Bucket index of every asset, shape (n,)
+        targets: Target fraction of every bucket, shape (k,)
+        threshold: Allowed drift of any bucket in percentage points
+        fee_rate: Fraction of every traded value paid as fees
+        window: Time steps scanned per vectorized band check
+    Returns:
+        Dict with the value series, rebalance steps, turnover, fees and a buy-and-hold baseline
+    """
+    prices = np.asarray(prices, dtype=float)
+    amounts = np.asarray(initial_amounts, dtype=float).copy()
+    categories = np.asarray(categories, dtype=np.intp)
+    targets = np.asarray(targets, dtype=float)
+    steps = prices.shape[0]
+
+    membership = np.zeros((categories.shape[0], targets.shape[0]))
+    membership[np.arange(categories.shape[0]), categories] = 1.0
+    if np.any((targets > 0) & (membership.sum(axis=0) == 0)):
+        raise ValueError("Every bucket with a positive target needs at least one asset")
+
+    values = np.empty(steps)
+    rebalance_steps = []
+    turnover = 0.0
+    fees = 0.0
+
+    # Holdings only change at rebalances, so scan ahead in windows for the next breach
+    t = 0
+    while t < steps:
+        end = min(t + window, steps)
+        breach = first_breach(prices[t:end], amounts, membership, targets, threshold)
+        if breach < 0:
+            values[t:end] = prices[t:end] @ amounts
+            t = end
+            continue
+
+        step = t + breach
+        values[t:step] = prices[t:step] @ amounts
+        if np.any((targets > 0) & ((prices[step] > 0) @ membership == 0)):
+            raise ValueError(f"A bucket with a positive target has no priced asset at step {step}")
+
+        result = rebalance(amounts, prices[step], categories, targets, threshold)
+        traded = np.abs(result['value_adjustments']).sum()
+        cost = traded * fee_rate
+        total = float(result['total'])
+        # Fees are paid by scaling every target holding down proportionally
+        scale = (total - cost) / total if total > 0 else 0.0
+        amounts = result['target_amounts'] * scale
+
+        turnover += traded / 2
+        fees += cost
+        rebalance_steps.append(step)
+        values[step] = prices[step] @ amounts
+        t = step + 1
+
+    buy_and_hold = prices @ np.asarray(initial_amounts, dtype=float)
+    initial_value = float(values[0]) if steps else 0.0
+    final_value = float(values[-1]) if steps else 0.0
+    mean_value = float(values.mean()) if steps else 0.0
+
+    return {
+        'values': values,
+        'buy_and_hold_values': buy_and_hold,
+        'final_amounts': amounts,
+        'initial_value': initial_value,
+        'final_value': final_value,
+        'total_return_pct': (final_value / initial_value - 1) * 100 if initial_value > 0 else 0.0,
+        'buy_and_hold_return_pct': (float(buy_and_hold[-1]) / initial_value - 1) * 100 if initial_value > 0 else 0.0,
+        'rebalance_count': len(rebalance_steps),
+        'rebalance_steps': rebalance_steps,
+        'turnover': turnover,
+        'turnover_pct': turnover / mean_value * 100 if mean_value > 0 else 0.0,
+        'fees': fees
+    }
+
+# Parse SYMBOL=AMOUNT pairs from the command line
+def parse_amounts(value: str) -> Dict[str, float]:
+    """Parse 'BTC=0.1,USDT=500' into a dict"""
+    amounts = {}
+    for pair in value.split(','):
+        symbol, amount = pair.split('=')
+        amounts[symbol.strip()] = float(amount)
+    return amounts
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Backtest the band rebalancing rule over local price history')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--prices', help='CSV or Parquet file with a timestamp column and one column per symbol')
+    source.add_argument('--synthetic', type=int, metavar='STEPS', help='Use a synthetic random walk with STEPS hourly points')
+    parser.add_argument('--symbols', default='BTC,ETH,LINK,UNI,LTC,USDT', help='Symbols for --synthetic')
+    parser.add_argument('--amounts', help='Initial holdings as SYMBOL=AMOUNT pairs (default: equal value in every symbol)')
+    parser.add_argument('--stable', default='USDT,MUSD,USDB', help='Symbols in the stable bucket')
+    parser.add_argument('--targets', default='0.7,0.3', help='Crypto and stable target fractions')
+    parser.add_argument('--threshold', type=float, default=2.5, help='Tolerance band in percentage points')
+    parser.add_argument('--fee', type=float, default=0.0, help='Fee as a fraction of traded value')
+    args = parser.parse_args(argv)
+
+    stable = [symbol.strip() for symbol in args.stable.split(',')]
+    if args.prices:
+        timestamps, symbols, prices = load_prices(args.prices)
+    else:
+        timestamps, symbols, prices = synthetic_prices(args.synthetic, args.symbols.split(','), stable)
+
+    if args.amounts:
+        holdings = parse_amounts(args.amounts)
+        amounts = np.array([holdings.get(symbol, 0.0) for symbol in symbols])
+    else:
+        amounts = 100.0 / prices[0]
+
+    categories = category_indices(symbols, {1: stable}, 0)
+    targets = [float(value) for value in args.targets.split(',')]
+
+    started = time.perf_counter()
+    result = backtest(prices, amounts, categories, targets, args.threshold, fee_rate=args.fee)
+    elapsed = time.perf_counter() - started
+
+    start_date = datetime.fromtimestamp(timestamps[0], timezone.utc).isoformat()
+    end_date = datetime.fromtimestamp(timestamps[-1], timezone.utc).isoformat()
+    print(f"Period: {start_date} -> {end_date}")
+    print(f"Steps: {prices.shape[0]}  Assets: {prices.shape[1]}  Elapsed: {elapsed:.3f}s")
+    print(f"Value: {result['initial_value']:.2f} -> {result['final_value']:.2f} ({result['total_return_pct']:.2f}%)")
+    print(f"Buy and hold return: {result['buy_and_hold_return_pct']:.2f}%")
+    print(f"Rebalances: {result['rebalance_count']}  Turnover: {result['turnover']:.2f} ({result['turnover_pct']:.2f}% of mean value)")
+    print(f"Fees: {result['fees']:.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from stub_upstream import StubUpstream
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_START_TIMEOUT_SECONDS = 60
+
+# Benchmarked endpoints: name -> (method, path)
+ENDPOINTS = {
+    'portfolio': ('GET', '/api/portfolio'),
+    'analysis': ('GET', '/api/portfolio/analysis'),
+    'update': ('POST', '/api/portfolio/update'),
+    'history': ('GET', '/api/portfolio/history?max_points=500'),
+}
+
+# Server settings per cache mode: warm runs measure cache hits after a warmup, cold runs
+# disable the quote and analysis caches so every request takes the fetch and analysis paths
+CACHE_MODES = {
+    'warm': {},
+    'cold': {
+        'QUOTE_CACHE_TTL_SECONDS': '0',
+        'QUOTE_STALE_MAX_AGE_SECONDS': '0',
+        'ANALYSIS_CACHE_TTL_SECONDS': '0',
+        'PRICE_POLLER_ENABLED': '0',
+    },
+}
+
+# Pick a free local port for the server under test
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Create an isolated working directory so runs never touch the real portfolio or history
+def prepare_workdir(seed_dir: str = None) -> str:
+    """Copy portfolio.json, prompts and optionally existing data into a temporary directory"""
+    workdir = tempfile.mkdtemp(prefix='portfolio-bench-')
+    shutil.copy(os.path.join(BACKEND_DIR, 'portfolio.json'), workdir)
+    shutil.copytree(os.path.join(BACKEND_DIR, 'prompts'), os.path.join(workdir, 'prompts'))
+    if seed_dir:
+        shutil.copytree(seed_dir, os.path.join(workdir, 'data'))
+    else:
+        os.makedirs(os.path.join(workdir, 'data'))
+    return workdir
+
+# Launch the app under test against the stub upstream
+def start_server(mode: str, port: int, workers: int, workdir: str, stub_url: str, extra_env: Dict[str, str]):
+    """Start gunicorn with sync workers (wsgi) or uvicorn workers (asgi)"""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'PYTHONPATH': os.pathsep.join(filter(None, [BACKEND_DIR, env.get('PYTHONPATH')])),
+        'CMC_BASE_URL': f'{stub_url}/v1',
+        'OPENAI_BASE_URL': f'{stub_url}/v1',
+        'CMC_API_KEY': 'bench',
+        'OPENAI_API_KEY': 'bench',
+    })
+    env.update(extra_env)
+
+    env['SERVING_MODE'] = mode
+    command = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(BACKEND_DIR, 'gunicorn_config.py')]
+    if workers:
+        command += ['--workers', str(workers)]
+
+    log_file = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    return process, log_file
+
+# Wait until the server answers its home route
+def wait_for_server(base_url: str, process: subprocess.Popen):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f'{base_url}/', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not start within {SERVER_START_TIMEOUT_SECONDS}s")
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+# Drive one endpoint at a fixed concurrency
+def run_endpoint(base_url: str, method: str, path: str, body, total: int, concurrency: int) -> Dict:
+    """Send total requests with concurrency workers and return latency and throughput figures"""
+    local = threading.local()
+
+    def send(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, f'{base_url}{path}', json=body, timeout=120)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput_rps': total / elapsed if elapsed > 0 else 0.0,
+    }
+
+# Print results, with percentage changes against a baseline when given
+def print_report(results: Dict[str, Dict], baseline: Dict[str, Dict] = None):
+    header = f"{'endpoint':<10} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'cmc':>5} {'openai':>6}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print(
+            f"{name:<10} {result['requests']:>8} {result['errors']:>6} {result['p50_ms']:>9.1f} "
+            f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['throughput_rps']:>9.1f} "
+            f"{result['upstream'].get('cmc_quotes', 0):>5} {result['upstream'].get('openai_chat', 0):>6}"
+        )
+
+    if not baseline:
+        return
+    print()
+    print('Change against baseline (negative latency and positive req/s are improvements):')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if before[key]:
+                changes.append(f"{key} {(result[key] / before[key] - 1) * 100:+.1f}%")
+        print(f"  {name:<10} " + '  '.join(changes))
+
+# Read a results file, keyed by cache mode
+def load_baseline(path: str) -> Dict[str, Dict]:
+    """Return {cache mode: {endpoint: result}}; files from before cache modes hold warm results"""
+    with open(path, 'r') as f:
+        results = json.load(f)['results']
+    if any('requests' in result for result in results.values()):
+        return {'warm': results}
+    return results
+
+# Parse KEY=VALUE pairs for the server environment
+def parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        env[key] = value
+    return env
+
+# Benchmark every endpoint against one server started with the given environment
+def run_mode(args, endpoints: List[str], stub: StubUpstream, stub_url: str,
+             extra_env: Dict[str, str], warmup: int) -> Dict[str, Dict]:
+    """Start a fresh server in its own working directory, measure each endpoint and stop it"""
+    workdir = prepare_workdir(args.seed_data)
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    process, log_file = start_server(args.server, port, args.workers, workdir, stub_url, extra_env)
+
+    with open(os.path.join(workdir, 'portfolio.json'), 'r') as f:
+        update_body = {'assets': json.load(f)}
+
+    results = {}
+    try:
+        wait_for_server(base_url, process)
+        for name in endpoints:
+            method, path = ENDPOINTS[name]
+            body = update_body if method == 'POST' else None
+            for _ in range(warmup):
+                requests.request(method, f'{base_url}{path}', json=body, timeout=120)
+
+            stub.reset()
+            result = run_endpoint(base_url, method, path, body, args.requests, args.concurrency)
+            result['upstream'] = stub.stats()
+            results[name] = result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log_file.close()
+        if args.keep_workdir:
+            print(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the API against a local CoinMarketCap/OpenAI stand-in')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi',
+                        help='gunicorn with sync workers or with uvicorn workers')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default: gunicorn_config.py)')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=10, help='Concurrent clients per endpoint')
+    parser.add_argument('--cache', choices=['warm', 'cold', 'both'], default='both',
+                        help='Measure cache hits after a warmup, requests with the caches disabled, or both')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed requests per endpoint before measuring warm caches')
+    parser.add_argument('--cmc-latency-ms', type=float, default=150)
+    parser.add_argument('--openai-latency-ms', type=float, default=2000)
+    parser.add_argument('--seed-data', help='Directory copied in as data/, e.g. to benchmark history with real entries')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra server environment, e.g. QUOTE_CACHE_TTL_SECONDS=0 (repeatable)')
+    parser.add_argument('--json', dest='json_path', help='Write results to this file, e.g. to use as a baseline')
+    parser.add_argument('--baseline', help='Results file from an earlier run to compare against')
+    parser.add_argument('--keep-workdir', action='store_true', help='Keep the temporary working directory and server log')
+    args = parser.parse_args(argv)
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}")
+
+    stub = StubUpstream(args.cmc_latency_ms / 1000, args.openai_latency_ms / 1000)
+    stub_url = f'http://127.0.0.1:{stub.start()}'
+    modes = list(CACHE_MODES) if args.cache == 'both' else [args.cache]
+
+    results = {}
+    try:
+        print(f"Server: {args.server}  Concurrency: {args.concurrency}  Requests per endpoint: {args.requests}")
+        print(f"Upstream latency: CMC {args.cmc_latency_ms:.0f} ms, OpenAI {args.openai_latency_ms:.0f} ms")
+        for mode in modes:
+            # Explicit --env settings win over the mode's defaults
+            extra_env = dict(CACHE_MODES[mode], **parse_env(args.env))
+            warmup = args.warmup if mode == 'warm' else 0
+            results[mode] = run_mode(args, endpoints, stub, stub_url, extra_env, warmup)
+    finally:
+        stub.stop()
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    for mode in modes:
+        print()
+        if mode == 'warm':
+            print(f"Warm caches ({args.warmup} untimed request(s) per endpoint first):")
+        else:
+            print("Cold caches (quote, stale-quote and analysis caches disabled, no warmup):")
+        print_report(results[mode], baseline.get(mode))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'server': args.server,
+                'concurrency': args.concurrency,
+                'cmc_latency_ms': args.cmc_latency_ms,
+                'openai_latency_ms': args.openai_latency_ms,
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+QUOTES_FIXTURE = os.path.join(FIXTURES_DIR, 'quotes_latest.json')
+CHAT_FIXTURE = os.path.join(FIXTURES_DIR, 'chat_completion.json')
+STREAM_CHUNK_CHARS = 24  # Characters per streamed completion chunk
+
+# Local stand-in for CoinMarketCap and OpenAI that replays recorded responses
+class StubUpstream:
+    """Serves recorded quotes/latest and chat completion responses with configurable latency"""
+
+    def __init__(self, cmc_latency: float = 0.0, openai_latency: float = 0.0):
+        self.cmc_latency = cmc_latency
+        self.openai_latency = openai_latency
+        with open(QUOTES_FIXTURE, 'r', encoding='utf-8') as f:
+            self.quotes = json.load(f)
+        with open(CHAT_FIXTURE, 'r', encoding='utf-8') as f:
+            self.completion = json.load(f)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return upstream calls served so far by endpoint"""
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        """Zero the call counters"""
+        with self._lock:
+            self.calls.clear()
+
+    def quotes_response(self, symbols):
+        """Recorded quotes restricted to the requested symbols, like the real endpoint"""
+        data = {symbol: self.quotes['data'][symbol] for symbol in symbols if symbol in self.quotes['data']}
+        return {'status': self.quotes['status'], 'data': data}
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        """Start serving in a background thread and return the bound port"""
+        stub = self
+
+        class Handler(StubHandler):
+            upstream = stub
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='stub-upstream', daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class StubHandler(BaseHTTPRequestHandler):
+    upstream: StubUpstream = None
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            self._send_json(200, self.upstream.stats())
+        elif url.path.endswith('/cryptocurrency/quotes/latest'):
+            self.upstream.count('cmc_quotes')
+            time.sleep(self.upstream.cmc_latency)
+            symbols = parse_qs(url.query).get('symbol', [''])[0].split(',')
+            self._send_json(200, self.upstream.quotes_response(symbols))
+        else:
+            self._send_json(404, {'error': f'No stub for {url.path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if url.path == '/_reset':
+            self.upstream.reset()
+            self._send_json(200, {})
+        elif url.path.endswith('/chat/completions'):
+            self.upstream.count('openai_chat')
+            time.sleep(self.upstream.openai_latency)
+            if body.get('stream'):
+                self._stream_completion()
+            else:
+                self._send_json(200, self.upstream.completion)
+        else:
+            self._send_json(404, {'error': f'No stub for {url.path}'})
+
+    def _stream_completion(self):
+        # Replays the recorded completion as chat.completion.chunk server-sent events
+        completion = self.upstream.completion
+        content = completion['choices'][0]['message']['content']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+        deltas = [{'role': 'assistant', 'content': ''}] + [
+            {'content': content[i:i + STREAM_CHUNK_CHARS]} for i in range(0, len(content), STREAM_CHUNK_CHARS)
+        ]
+        for index, delta in enumerate(deltas):
+            last = index == len(deltas) - 1
+            write_event(json.dumps({
+                'id': completion['id'],
+                'object': 'chat.completion.chunk',
+                'created': completion['created'],
+                'model': completion['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': 'stop' if last else None}]
+            }, ensure_ascii=False))
+        write_event('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded CoinMarketCap and OpenAI responses locally')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--cmc-latency-ms', type=float, default=150, help='Delay added to every quotes request')
+    parser.add_argument('--openai-latency-ms', type=float, default=2000, help='Delay added to every chat completion')
+    args = parser.parse_args()
+
+    stub = StubUpstream(args.cmc_latency_ms / 1000, args.openai_latency_ms / 1000)
+    port = stub.start(args.host, args.port)
+    print(f"Stub upstream on http://{args.host}:{port}")
+    print(f"  CMC_BASE_URL=http://{args.host}:{port}/v1")
+    print(f"  OPENAI_BASE_URL=http://{args.host}:{port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,18 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+# SERVING_MODE=asgi runs asgi_app:app on uvicorn workers: one event loop per process
+# keeps many upstream-bound requests in flight, so far fewer processes are needed.
+# The app module is chosen here too, so start commands must not pass one positionally
+SERVING_MODE = os.environ.get('SERVING_MODE', 'wsgi')
+if SERVING_MODE == 'asgi':
+    wsgi_app = 'asgi_app:app'
+    workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'run:app'
+    workers = multiprocessing.cpu_count() * 2 + 1
+    worker_class = 'sync'
 worker_connections = 1000
 timeout = 120
 keepalive = 2
@@ -18,6 +28,20 @@ loglevel = 'info'
 accesslog = '-'
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 
+# Refuse to start when a positional app module overrides the one SERVING_MODE needs;
+# uvicorn workers would otherwise answer every request with a 500 from the WSGI app
+def on_starting(server):
+    app_uri = server.app.app_uri
+    if SERVING_MODE == 'asgi' and app_uri != wsgi_app:
+        raise RuntimeError(f"SERVING_MODE=asgi requires {wsgi_app}, got {app_uri}; drop the app argument")
+
+# Start the price poller in each sync worker once the app is loaded, never in the master,
+# so a preloaded master cannot hold leadership; the ASGI app starts it from its lifespan
+def post_worker_init(worker):
+    if SERVING_MODE != 'asgi':
+        from app import start_price_poller
+        start_price_poller()
+
 # Process naming
 proc_name = 'portfolio-crypto-backend'
 
@@ -0,0 +1,531 @@
+import os
+import json
+import fcntl
+import logging
+import sqlite3
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+
+from metrics import cache_lookups, file_io_bytes
+from timeseries import RollingMetrics
+
+logger = logging.getLogger(__name__)
+
+# Separate subqueries, as SQLite only answers a lone MIN or MAX from the b-tree without a scan
+ROWID_BOUNDS_QUERY = 'SELECT (SELECT MIN(rowid) FROM history), (SELECT MAX(rowid) FROM history)'
+
+# Write text to a file atomically using a temp file and rename
+def atomic_write(path: str, text: str) -> int:
+    """Write text so readers see either the old or the new file, never a partial one; returns bytes written"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    data = text.encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return len(data)
+
+# Write JSON to a file atomically
+def atomic_write_json(path: str, data, **dump_kwargs) -> int:
+    """Serialize data as JSON and write it atomically; returns bytes written"""
+    return atomic_write(path, json.dumps(data, **dump_kwargs))
+
+# Current time in Brasília time, the zone history timestamps are recorded in
+def history_timestamp() -> str:
+    """Return the current time as an ISO 8601 string with a -03:00 offset"""
+    return datetime.now(timezone(timedelta(hours=-3))).isoformat()
+
+# Append-only portfolio history kept as JSON Lines
+class JsonlHistoryStore:
+    """Append-only history log with periodic compaction for the retention limits"""
+
+    def __init__(self, path: str, max_entries: int, max_age_days: int,
+                 compact_every: int = 100, legacy_path: str = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.compact_every = compact_every
+        self.legacy_path = legacy_path
+        self.generation = 0  # Bumped on every write made by this process
+        self._appends_since_compact = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes appends and compaction across gunicorn workers
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._lock, open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _migrate_legacy(self):
+        """Convert the old whole-file JSON history into the log on first use"""
+        if os.path.exists(self.path) or not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r') as f:
+                history = json.load(f).get('history', [])
+        except Exception as e:
+            logger.error("Error reading legacy history file %s: %s", self.legacy_path, e)
+            return
+        history.sort(key=lambda entry: entry['timestamp'])
+        self._rewrite(history)
+
+    def _read_entries(self) -> List[Dict]:
+        entries = []
+        try:
+            with open(self.path, 'r') as f:
+                file_io_bytes.inc(os.fstat(f.fileno()).st_size, file='history', op='read')
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A crash mid-append can leave a truncated last line
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _retain(self, entries: List[Dict]) -> List[Dict]:
+        cutoff = (datetime.now(timezone(timedelta(hours=-3))) - timedelta(days=self.max_age_days)).isoformat()
+        entries = [entry for entry in entries if entry['timestamp'] >= cutoff]
+        entries.sort(key=lambda entry: entry['timestamp'])
+        return entries[-self.max_entries:]
+
+    def _rewrite(self, entries: List[Dict]):
+        written = atomic_write(self.path, ''.join(json.dumps(entry) + '\n' for entry in entries))
+        file_io_bytes.inc(written, file='history', op='write')
+
+    def append(self, value: float, timestamp: str = None):
+        """Append one history point, compacting the log every compact_every appends"""
+        with self._file_lock():
+            # Stamped under the lock so concurrent writers append in timestamp order
+            timestamp = timestamp or history_timestamp()
+            line = (json.dumps({'timestamp': timestamp, 'value': value}) + '\n').encode('utf-8')
+            self._migrate_legacy()
+            # Single write on an O_APPEND descriptor so the line lands whole
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            file_io_bytes.inc(len(line), file='history', op='write')
+
+            self._appends_since_compact += 1
+            if self._appends_since_compact >= self.compact_every:
+                self._rewrite(self._retain(self._read_entries()))
+                self._appends_since_compact = 0
+            self.generation += 1
+
+    def version(self):
+        """Cheap token that changes whenever the log changes, in this or another process"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return (None, self.generation)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size, self.generation)
+
+    def load(self, since: datetime = None) -> List[Dict]:
+        """Return retained history entries, oldest first, optionally only those at or after since"""
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            with self._file_lock():
+                self._migrate_legacy()
+        entries = self._retain(self._read_entries())
+        if since is not None:
+            cutoff = since.isoformat()
+            entries = [entry for entry in entries if entry['timestamp'] >= cutoff]
+        return entries
+
+    def read_from(self, cursor=None):
+        """
+        Return (rows, cursor, kept) for incremental readers
+        Returns:
+            rows: (epoch, timestamp, value) tuples read since cursor
+            kept: None when rows extend what was read before, otherwise how many of the previously
+                read entries are still retained (the newest ones); 0 means rows are the whole history,
+                which is what this store reports after any compaction
+        """
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            with self._file_lock():
+                self._migrate_legacy()
+        try:
+            with open(self.path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                kept = 0
+                if cursor is not None and cursor[0] == inode:
+                    # Inode numbers are reused, so also check the last line read is still in place;
+                    # compaction sorts the rewritten log, so after one everything is read again
+                    _, offset, last_line = cursor
+                    f.seek(offset - len(last_line))
+                    if f.read(len(last_line)) == last_line:
+                        kept = None
+                if kept is None:
+                    f.seek(offset)
+                else:
+                    offset = 0
+                data = f.read()
+        except FileNotFoundError:
+            return [], None, 0
+
+        # A line still being appended has no newline yet; it is read next time
+        end = data.rfind(b'\n') + 1
+        file_io_bytes.inc(end, file='history', op='read')
+        entries = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        if kept == 0:
+            entries = self._retain(entries)
+        rows = [
+            (datetime.fromisoformat(entry['timestamp']).timestamp(), entry['timestamp'], entry['value'])
+            for entry in entries
+        ]
+        if end:
+            cursor = (inode, offset + end, data[data.rfind(b'\n', 0, end - 1) + 1:end])
+        elif kept == 0:
+            cursor = (inode, 0, b'')
+        return rows, cursor, kept
+
+# Holdings of additional portfolios kept as one JSON file each
+class JsonPortfolioStore:
+    """Portfolio holdings keyed by ID, stored as atomically written files under a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, portfolio_id: str) -> str:
+        return os.path.join(self.directory, f'{portfolio_id}.json')
+
+    def load_many(self, portfolio_ids: List[str]) -> Dict[str, Dict]:
+        """Return holdings by ID, omitting unknown IDs"""
+        portfolios = {}
+        for portfolio_id in portfolio_ids:
+            try:
+                with open(self._path(portfolio_id), 'r') as f:
+                    file_io_bytes.inc(os.fstat(f.fileno()).st_size, file='portfolio', op='read')
+                    portfolios[portfolio_id] = json.load(f)
+            except FileNotFoundError:
+                continue
+            except json.JSONDecodeError as e:
+                logger.error("Error parsing portfolio %s: %s", portfolio_id, e)
+        return portfolios
+
+    def save_portfolio(self, portfolio_id: str, holdings: Dict):
+        """Replace the holdings of a portfolio"""
+        written = atomic_write_json(self._path(portfolio_id), holdings, indent=4)
+        file_io_bytes.inc(written, file='portfolio', op='write')
+
+    def portfolio_ids(self) -> List[str]:
+        """Return the IDs of all stored portfolios"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len('.json')] for name in names if name.endswith('.json'))
+
+# SQLite-backed history and holdings, safe to share between worker processes
+class SqliteStore:
+    """History and holdings store in a WAL-mode SQLite database with a time index"""
+
+    def __init__(self, path: str, max_entries: int, max_age_days: int, compact_every: int = 100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.compact_every = compact_every
+        self.generation = 0  # Bumped on every write made by this process
+        self._appends_since_compact = 0
+        self._local = threading.local()
+        self._initialized_pid = None
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross threads or forks, so keep one per thread per process
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == pid:
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        self._local.conn = conn
+        self._local.pid = pid
+
+        with self._init_lock:
+            if self._initialized_pid != pid:
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS history (
+                        ts REAL NOT NULL,
+                        timestamp TEXT NOT NULL,
+                        value REAL NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_history_ts ON history (ts);
+                    CREATE TABLE IF NOT EXISTS holdings (
+                        position INTEGER NOT NULL,
+                        symbol TEXT PRIMARY KEY,
+                        amount REAL NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS portfolio_holdings (
+                        portfolio_id TEXT NOT NULL,
+                        position INTEGER NOT NULL,
+                        symbol TEXT NOT NULL,
+                        amount REAL NOT NULL,
+                        PRIMARY KEY (portfolio_id, symbol)
+                    );
+                """)
+                self._initialized_pid = pid
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, serializing writers across processes
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.generation += 1
+
+    def _insert_history(self, conn, timestamp: str, value: float):
+        ts = datetime.fromisoformat(timestamp).timestamp()
+        conn.execute('INSERT INTO history (ts, timestamp, value) VALUES (?, ?, ?)', (ts, timestamp, value))
+
+    def _replace_holdings(self, conn, holdings: Dict):
+        conn.execute('DELETE FROM holdings')
+        conn.executemany(
+            'INSERT INTO holdings (position, symbol, amount) VALUES (?, ?, ?)',
+            [(position, symbol, float(amount)) for position, (symbol, amount) in enumerate(holdings.items())]
+        )
+
+    def _compact(self, conn):
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.max_age_days)).timestamp()
+        conn.execute('DELETE FROM history WHERE ts < ?', (cutoff,))
+        conn.execute(
+            'DELETE FROM history WHERE ts < (SELECT ts FROM history ORDER BY ts DESC LIMIT 1 OFFSET ?)',
+            (self.max_entries - 1,)
+        )
+
+    def _after_append(self, conn):
+        self._appends_since_compact += 1
+        if self._appends_since_compact >= self.compact_every:
+            self._compact(conn)
+            self._appends_since_compact = 0
+
+    def append(self, value: float, timestamp: str = None):
+        """Insert one history point, stamped inside the write transaction unless timestamp is given"""
+        with self._transaction() as conn:
+            self._insert_history(conn, timestamp or history_timestamp(), value)
+            self._after_append(conn)
+
+    def save_holdings(self, holdings: Dict):
+        """Replace holdings"""
+        with self._transaction() as conn:
+            self._replace_holdings(conn, holdings)
+
+    def save_holdings_with_history(self, holdings: Dict, value: float, timestamp: str = None):
+        """Replace holdings and insert a history point in one transaction"""
+        with self._transaction() as conn:
+            self._replace_holdings(conn, holdings)
+            self._insert_history(conn, timestamp or history_timestamp(), value)
+            self._after_append(conn)
+
+    def version(self):
+        """Cheap token that changes whenever history rows are inserted or compacted away"""
+        bounds = self._connect().execute(ROWID_BOUNDS_QUERY).fetchone()
+        return (bounds[0], bounds[1], self.generation)
+
+    def read_from(self, cursor=None):
+        """
+        Return (rows, cursor, kept) for incremental readers, see JsonlHistoryStore.read_from
+        Compaction deletes the oldest rows, so the rows read before it that survive are counted
+        rather than read again.
+        """
+        conn = self._connect()
+        first, last = conn.execute(ROWID_BOUNDS_QUERY).fetchone()
+        if first is None:
+            return [], None, 0
+
+        kept = 0
+        if cursor is not None and cursor[0] == first:
+            kept = None
+        elif cursor is not None:
+            # While the last row read still exists, rows inserted after it get larger rowids
+            last_read = conn.execute('SELECT ts FROM history WHERE rowid = ?', (cursor[1],)).fetchone()
+            if last_read is not None and last_read[0] == cursor[2]:
+                kept = conn.execute('SELECT COUNT(*) FROM history WHERE rowid <= ?', (cursor[1],)).fetchone()[0]
+
+        if kept == 0:
+            rows = conn.execute(
+                'SELECT rowid, ts, timestamp, value FROM history WHERE rowid <= ? ORDER BY ts', (last,)
+            ).fetchall()
+            if not rows:
+                return [], None, 0
+            last, last_ts = max((rowid, ts) for rowid, ts, _, _ in rows)
+        else:
+            rows = conn.execute(
+                'SELECT rowid, ts, timestamp, value FROM history WHERE rowid > ? ORDER BY rowid', (cursor[1],)
+            ).fetchall()
+            last, last_ts = (rows[-1][0], rows[-1][1]) if rows else cursor[1:]
+        return [(ts, timestamp, value) for _, ts, timestamp, value in rows], (first, last, last_ts), kept
+
+    def load_holdings(self) -> Dict:
+        """Return holdings as {symbol: amount} in their saved order"""
+        rows = self._connect().execute('SELECT symbol, amount FROM holdings ORDER BY position').fetchall()
+        return {symbol: amount for symbol, amount in rows}
+
+    def load_many(self, portfolio_ids: List[str]) -> Dict[str, Dict]:
+        """Return holdings of the additional portfolios by ID, omitting unknown IDs"""
+        conn = self._connect()
+        portfolios = {}
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(portfolio_ids), 500):
+            chunk = portfolio_ids[start:start + 500]
+            rows = conn.execute(
+                f'SELECT portfolio_id, symbol, amount FROM portfolio_holdings '
+                f'WHERE portfolio_id IN ({",".join("?" * len(chunk))}) ORDER BY portfolio_id, position',
+                chunk
+            ).fetchall()
+            for portfolio_id, symbol, amount in rows:
+                portfolios.setdefault(portfolio_id, {})[symbol] = amount
+        return {portfolio_id: portfolios[portfolio_id] for portfolio_id in portfolio_ids if portfolio_id in portfolios}
+
+    def save_portfolio(self, portfolio_id: str, holdings: Dict):
+        """Replace the holdings of an additional portfolio"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM portfolio_holdings WHERE portfolio_id = ?', (portfolio_id,))
+            conn.executemany(
+                'INSERT INTO portfolio_holdings (portfolio_id, position, symbol, amount) VALUES (?, ?, ?, ?)',
+                [(portfolio_id, position, symbol, float(amount)) for position, (symbol, amount) in enumerate(holdings.items())]
+            )
+
+    def portfolio_ids(self) -> List[str]:
+        """Return the IDs of all additional portfolios"""
+        rows = self._connect().execute('SELECT DISTINCT portfolio_id FROM portfolio_holdings ORDER BY portfolio_id').fetchall()
+        return [row[0] for row in rows]
+
+    def seed(self, holdings: Dict, history: List[Dict]):
+        """Import existing data when the database is empty"""
+        with self._transaction() as conn:
+            if conn.execute('SELECT 1 FROM holdings LIMIT 1').fetchone() is None and holdings:
+                self._replace_holdings(conn, holdings)
+            if conn.execute('SELECT 1 FROM history LIMIT 1').fetchone() is None:
+                for entry in history:
+                    self._insert_history(conn, entry['timestamp'], entry['value'])
+
+# Parsed history kept in memory and revalidated against the store's version
+class HistoryCache:
+    """
+    Per-process history cache stored as parallel arrays of epoch timestamps and values.
+    Points appended to the store are read and added incrementally, together with the
+    rolling return, volatility and drawdown figures; after a compaction the entries it
+    removed are dropped from the front instead of reloading the history.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._version = object()  # Never equal to a real version, forcing the first load
+        self._cursor = None
+        self._snapshot = (array('d'), array('d'), [])  # Epochs, values, ISO timestamps
+        self._rolling = RollingMetrics()
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        version = self.store.version()
+        if version == self._version:
+            cache_lookups.inc(cache='history', result='hit')
+            return
+        with self._lock:
+            if version == self._version:
+                cache_lookups.inc(cache='history', result='hit')
+                return
+            cache_lookups.inc(cache='history', result='miss')
+
+            rows, self._cursor, kept = self.store.read_from(self._cursor)
+            epochs, values, timestamps = self._snapshot
+            if kept is not None and kept > len(epochs):
+                rows, self._cursor, kept = self.store.read_from(None)
+            if kept is not None:
+                start = len(epochs) - kept
+                epochs, values, timestamps = epochs[start:], values[start:], timestamps[start:]
+            previous = epochs[-1] if epochs else float('-inf')
+            new_epochs = [row[0] for row in rows]
+            if any(b < a for a, b in zip([previous] + new_epochs, new_epochs)):
+                # Out-of-order append; rebuild so the arrays stay sorted for bisect
+                rows, self._cursor, kept = self.store.read_from(None)
+                epochs, values, timestamps = array('d'), array('d'), []
+
+            if kept is None:
+                for epoch, timestamp, value in rows:
+                    # Epochs last, so a concurrent reader never indexes past the other arrays
+                    values.append(value)
+                    timestamps.append(timestamp)
+                    epochs.append(epoch)
+                    self._rolling.append(epoch, value, timestamp)
+            else:
+                # Fresh arrays swapped in as one tuple, so concurrent readers never mix old and new
+                epochs.extend(row[0] for row in rows)
+                values.extend(row[2] for row in rows)
+                timestamps.extend(row[1] for row in rows)
+                self._snapshot = (epochs, values, timestamps)
+                if kept:
+                    self._rolling = self._rolling.retained(epochs[:kept], values[:kept], timestamps[:kept])
+                    for epoch, timestamp, value in rows:
+                        self._rolling.append(epoch, value, timestamp)
+                else:
+                    self._rolling = RollingMetrics.from_series(epochs, values, timestamps)
+            self._version = version
+
+    def rolling_metrics(self) -> Dict:
+        """Rolling figures as of the latest history point, see RollingMetrics.summary"""
+        self._refresh()
+        return self._rolling.summary()
+
+    def series(self, since: datetime = None):
+        """
+        Return (epochs, values, timestamps) oldest first, locating since with a binary search
+        Epochs and values are NumPy arrays copied from the cache; timestamps is a list of ISO strings
+        """
+        self._refresh()
+        epochs, values, timestamps = self._snapshot
+
+        # Age retention is time-dependent, so apply it on read as well
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.store.max_age_days)).timestamp()
+        if since is not None:
+            cutoff = max(cutoff, since.timestamp())
+        end = len(epochs)
+        # Appends between compactions may briefly exceed max_entries
+        start = max(bisect_left(epochs, cutoff, 0, end), end - self.store.max_entries)
+        # Slicing copies, so appends to the cached arrays are never blocked by an exported buffer
+        return np.frombuffer(epochs[start:end]), np.frombuffer(values[start:end]), timestamps[start:end]
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes that are not extra fields passed by the caller
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# HTTP client libraries that log every request at INFO; kept at WARNING unless debugging
+QUIET_LOGGERS = ('httpx', 'httpcore', 'openai', 'urllib3')
+
+# One JSON object per line, with any extra= fields as top-level keys
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON for log collectors"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Hands records to a background thread so request threads never block on stdout
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves message formatting to the listener thread.
+    The listener is started lazily in each process, since threads do not survive a fork.
+    """
+
+    def __init__(self, target: logging.Handler):
+        super().__init__(queue.SimpleQueue())
+        self.target = target
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Records queued before a fork belong to the parent's listener
+            self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the traceback is rendered here, as it refers to frames that are about to unwind;
+        # msg % args is left to the listener
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Flush queued records and stop the listener of this process"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+# Route all application logging through the background handler
+def configure_logging(level: str = 'INFO', fmt: str = 'json') -> BackgroundQueueHandler:
+    """Install the queue handler on the root logger and return it so it can be stopped at exit"""
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'))
+
+    handler = BackgroundQueueHandler(stream_handler)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, BackgroundQueueHandler):
+            existing.stop()
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.NOTSET if root.level <= logging.DEBUG else logging.WARNING)
+    return handler
@@ -0,0 +1,212 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; covers cache hits (sub-millisecond) up to slow model calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Monotonic counter with labels
+class Counter:
+    """Thread-safe counter keyed by label values"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> List:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+# Histogram with fixed buckets and labels
+class Histogram:
+    """Thread-safe histogram keyed by label values; bucket counts are stored per bucket, not cumulative"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> List:
+        with self._lock:
+            return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]
+
+# Metrics of one worker, shared with the other workers through snapshot files
+class Registry:
+    """Collects this process's metrics and merges them with other workers' snapshots for exposition"""
+
+    def __init__(self):
+        self._metrics = []
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict:
+        """JSON-serializable values of every metric in this process"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _flush(self, directory: str):
+        # Metrics need no durability, so a rename without fsync is enough to avoid torn reads
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(directory, f'{os.getpid()}.json'))
+
+    def start_flusher(self, directory: str, interval: float):
+        """Write this worker's snapshot every interval seconds from a background thread, once per process"""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self._flush(directory)
+                    except Exception as e:
+                        logger.warning("Error writing metrics snapshot: %s", e)
+
+            threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+
+    def collect(self, directory: str, max_age: float) -> List[Dict]:
+        """Return this worker's live snapshot plus the snapshots other workers flushed within max_age"""
+        snapshots = [self.snapshot()]
+        own_file = f'{os.getpid()}.json'
+        now = time.time()
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return snapshots
+        for name in names:
+            if not name.endswith('.json') or name == own_file:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    # The worker is gone; its series drop out like a process restart
+                    os.remove(path)
+                    continue
+                with open(path, 'r') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return snapshots
+
+    def render(self, snapshots: List[Dict]) -> str:
+        """Sum the snapshots and format them in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, []):
+                    key = tuple(key)
+                    if metric.type == 'counter':
+                        merged[key] = merged.get(key, 0.0) + value
+                        continue
+                    state = merged.get(key)
+                    if state is None or len(state[0]) != len(value[0]):
+                        merged[key] = [list(value[0]), value[1], value[2]]
+                        continue
+                    state[0] = [a + b for a, b in zip(state[0], value[0])]
+                    state[1] += value[1]
+                    state[2] += value[2]
+
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for key in sorted(merged):
+                labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(metric.labelnames, key))
+                if metric.type == 'counter':
+                    lines.append(f'{metric.name}{{{labels}}} {format_value(merged[key])}')
+                    continue
+                counts, total, count = merged[key]
+                prefix = f'{labels},' if labels else ''
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    lines.append(f'{metric.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                lines.append(f'{metric.name}_sum{{{labels}}} {format_value(total)}')
+                lines.append(f'{metric.name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+# Metrics of the service
+registry = Registry()
+stage_seconds = registry.histogram(
+    'portfolio_stage_seconds', 'Time spent in each stage of request handling', ['stage'])
+http_request_seconds = registry.histogram(
+    'portfolio_http_request_seconds', 'Time to produce a response, by route', ['endpoint', 'method', 'status'])
+upstream_requests = registry.counter(
+    'portfolio_upstream_requests_total', 'Requests sent to CoinMarketCap and OpenAI', ['upstream', 'status'])
+upstream_retries = registry.counter(
+    'portfolio_upstream_retries_total', 'Upstream requests retried after an error or retryable status', ['upstream'])
+cache_lookups = registry.counter(
+    'portfolio_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+file_io_bytes = registry.counter(
+    'portfolio_file_io_bytes_total', 'Bytes read from and written to data files', ['file', 'op'])
+
+# Time a request stage
+def span(stage: str):
+    """Context manager recording the duration of a stage in portfolio_stage_seconds"""
+    return stage_seconds.time(stage=stage)
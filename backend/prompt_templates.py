@@ -0,0 +1,96 @@
+import os
+import hashlib
+import logging
+import threading
+import time
+from string import Formatter
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# A str.format template parsed once into literal chunks and field slots
+class CompiledTemplate:
+    """Template whose placeholders are located at compile time, so rendering is a single join"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.digest = hashlib.sha256(text.encode('utf-8')).hexdigest()  # Identifies this version of the template
+        self.fields = []
+        parts = []
+        slots = []
+        # Raises ValueError on unbalanced braces
+        for literal, field_name, format_spec, conversion in Formatter().parse(text):
+            if literal:
+                parts.append(literal)
+            if field_name is None:
+                continue
+            if not field_name or conversion:
+                raise ValueError(f"Unsupported placeholder {{{field_name}}} in prompt template")
+            slots.append((len(parts), field_name, format_spec))
+            parts.append('')
+            if field_name not in self.fields:
+                self.fields.append(field_name)
+        self._parts = parts
+        self._slots = slots
+
+    def render(self, values: Dict) -> str:
+        """Fill every placeholder from values"""
+        parts = self._parts.copy()
+        for index, field_name, format_spec in self._slots:
+            value = values[field_name]
+            parts[index] = format(value, format_spec) if format_spec else str(value)
+        return ''.join(parts)
+
+# Prompt templates kept compiled in memory and reloaded when their files change
+class PromptTemplates:
+    """Compiled prompt files under a directory; file changes are picked up every reload_interval seconds"""
+
+    def __init__(self, directory: str, reload_interval: float):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._templates = {}  # filename -> (stat key, CompiledTemplate)
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _load(self, filename: str):
+        try:
+            stat = os.stat(self._path(filename))
+        except FileNotFoundError as e:
+            logger.error("Prompt template file not found: %s - %s", filename, e)
+            return
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        current = self._templates.get(filename)
+        if current and current[0] == stat_key:
+            return
+
+        try:
+            with open(self._path(filename), 'r', encoding='utf-8') as f:
+                template = CompiledTemplate(f.read())
+        except Exception as e:
+            # Keep serving the last good version when an edit is broken
+            logger.error("Error loading prompt template %s: %s", filename, e)
+            return
+        self._templates[filename] = (stat_key, template)
+        if current:
+            logger.info("Reloaded prompt template %s", filename)
+
+    def preload(self, filenames: List[str]):
+        """Load and compile templates up front"""
+        with self._lock:
+            for filename in filenames:
+                self._load(filename)
+                self._checked_at[filename] = time.monotonic()
+
+    def get(self, filename: str):
+        """Return the compiled template, or None if it could not be loaded"""
+        now = time.monotonic()
+        if now - self._checked_at.get(filename, float('-inf')) >= self.reload_interval:
+            with self._lock:
+                if now - self._checked_at.get(filename, float('-inf')) >= self.reload_interval:
+                    self._load(filename)
+                    self._checked_at[filename] = now
+        entry = self._templates.get(filename)
+        return entry[1] if entry else None
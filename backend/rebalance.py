@@ -0,0 +1,126 @@
+import numpy as np
+from typing import Dict, List, Sequence
+
+# Map each symbol to the index of its rebalancing bucket
+def category_indices(symbols: Sequence[str], bucket_symbols: Dict[int, Sequence[str]], default_bucket: int) -> np.ndarray:
+    """Return an int array assigning every symbol to a bucket, falling back to default_bucket"""
+    lookup = {symbol: bucket for bucket, members in bucket_symbols.items() for symbol in members}
+    return np.array([lookup.get(symbol, default_bucket) for symbol in symbols], dtype=np.intp)
+
+# Compute allocations, drift and per-asset adjustments in one vectorized pass
+def rebalance(amounts, prices, categories, targets, threshold: float) -> Dict[str, np.ndarray]:
+    """
+    Vectorized band rebalancing across any number of buckets
+    Args:
+        amounts: Holdings, shape (n,) or (batch, n)
+        prices: Prices matching amounts, shape (n,) or (batch, n)
+        categories: Bucket index of every asset, shape (n,)
+        targets: Target fraction of every bucket, shape (k,) or (batch, k), summing to 1
+        threshold: Allowed drift of any bucket in percentage points
+    Returns:
+        Dict of arrays; per-asset arrays have the shape of amounts, per-bucket arrays end in k
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    categories = np.asarray(categories, dtype=np.intp)
+    num_buckets = targets.shape[-1]
+
+    # One-hot membership matrix turns bucket sums into a single matmul
+    membership = np.zeros((categories.shape[0], num_buckets))
+    membership[np.arange(categories.shape[0]), categories] = 1.0
+
+    values = amounts * prices
+    total = values.sum(axis=-1, keepdims=True)
+    safe_total = np.where(total > 0, total, 1.0)
+
+    bucket_values = values @ membership
+    bucket_pct = bucket_values / safe_total * 100
+    drift = bucket_pct - targets * 100
+    rebalance_needed = np.abs(drift).max(axis=-1) > threshold
+
+    # Keep relative weights within each bucket; a bucket worth nothing is bought in equal
+    # parts across its priced members, so its target share is not dropped
+    asset_bucket_values = np.take(bucket_values, categories, axis=-1)
+    priced = (prices > 0).astype(float)
+    priced_members = np.take(priced @ membership, categories, axis=-1)
+    equal_weight = np.divide(priced, priced_members, out=np.zeros_like(priced), where=priced_members > 0)
+    relative_weight = np.where(
+        asset_bucket_values > 0,
+        np.divide(values, asset_bucket_values, out=np.zeros_like(values), where=asset_bucket_values > 0),
+        equal_weight
+    )
+    target_bucket_values = total * targets
+    target_values = np.take(target_bucket_values, categories, axis=-1) * relative_weight
+    target_amounts = np.divide(
+        target_values, prices,
+        out=np.zeros(np.broadcast_shapes(target_values.shape, prices.shape)),
+        where=prices > 0
+    )
+    amount_adjustments = target_amounts - amounts
+
+    return {
+        'values': values,
+        'total': total[..., 0],
+        'allocation_pct': values / safe_total * 100,
+        'bucket_values': bucket_values,
+        'bucket_pct': bucket_pct,
+        'drift': drift,
+        'rebalance_needed': rebalance_needed,
+        'target_bucket_values': target_bucket_values,
+        'bucket_adjustments': target_bucket_values - bucket_values,
+        'target_values': target_values,
+        'target_pct': target_values / safe_total * 100,
+        'target_amounts': target_amounts,
+        'amount_adjustments': amount_adjustments,
+        'value_adjustments': amount_adjustments * prices
+    }
+
+# Evaluate every combination of target split and tolerance in one vectorized call
+def sweep(amounts, prices, categories, target_grid, thresholds) -> Dict[str, np.ndarray]:
+    """
+    Band rebalancing for the cartesian product of target splits and tolerances
+    Args:
+        amounts: Holdings, shape (n,)
+        prices: Prices matching amounts, shape (n,)
+        categories: Bucket index of every asset, shape (n,)
+        target_grid: Candidate bucket targets, shape (t, k)
+        thresholds: Candidate tolerances in percentage points, shape (h,)
+    Returns:
+        rebalance() output for t * h scenarios (target-major order), plus the scenario
+        targets/thresholds, trades applied only where the band is breached, and turnover
+    """
+    target_grid = np.asarray(target_grid, dtype=float)
+    thresholds = np.asarray(thresholds, dtype=float)
+    scenario_targets = np.repeat(target_grid, thresholds.shape[0], axis=0)
+    scenario_thresholds = np.tile(thresholds, target_grid.shape[0])
+
+    result = rebalance(amounts, prices, categories, scenario_targets, scenario_thresholds)
+
+    # Inside the band the rule does not trade
+    trade = result['rebalance_needed'][:, None]
+    applied_amounts = np.where(trade, result['amount_adjustments'], 0.0)
+    applied_values = np.where(trade, result['value_adjustments'], 0.0)
+
+    # One-way turnover: half of the gross value traded
+    turnover = np.abs(applied_values).sum(axis=-1) / 2
+    total = result['total']
+    result.update({
+        'targets': scenario_targets,
+        'thresholds': scenario_thresholds,
+        'applied_amount_adjustments': applied_amounts,
+        'applied_value_adjustments': applied_values,
+        'turnover': turnover,
+        'turnover_pct': np.divide(turnover * 100, total, out=np.zeros_like(turnover), where=total > 0)
+    })
+    return result
+
+# Stack many portfolios over a shared symbol universe for batch evaluation
+def stack_portfolios(portfolios: List[Dict[str, float]], symbols: Sequence[str]) -> np.ndarray:
+    """Return a (batch, n) amounts matrix with zeros for symbols a portfolio does not hold"""
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    amounts = np.zeros((len(portfolios), len(symbols)))
+    for row, portfolio in enumerate(portfolios):
+        for symbol, amount in portfolio.items():
+            amounts[row, index[symbol]] = float(amount)
+    return amounts
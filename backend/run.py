@@ -1,6 +1,7 @@
 import os
-from app import app
+from app import app, start_price_poller
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    start_price_poller()
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,253 @@
+import os
+import uuid
+import logging
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Raised to callers that waited on a computation which failed in another worker process
+class FlightFailed(Exception):
+    pass
+
+# One in-flight computation shared by every concurrent caller with the same key
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# Coalesce concurrent identical calls within a process and across worker processes
+class SingleFlight:
+    """
+    Run at most one computation per key at a time; concurrent callers share its result.
+    Threads (or coroutines) in a process wait on the in-flight call. Across worker processes
+    the first caller takes a lease file named after the key, and the others poll the shared
+    cache through recheck until the result is published, the leader records a failure
+    (reported to new callers for failure_ttl seconds) or its lease expires.
+    """
+
+    def __init__(self, lock_dir: str, lease_timeout: float, failure_ttl: float = 5.0, poll_interval: float = 0.05):
+        self.lock_dir = lock_dir
+        self.lease_timeout = lease_timeout
+        self.failure_ttl = failure_ttl
+        self.poll_interval = poll_interval
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _path(self, key: Hashable, suffix: str) -> str:
+        # One file per key, so unrelated keys never wait for each other
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.lock_dir, f'{digest}.{suffix}')
+
+    def _take_lease(self, key: Hashable) -> Optional[str]:
+        """Create the lease file for key, returning its token, or None while another worker holds it"""
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._path(key, 'lease')
+        token = uuid.uuid4().hex
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < self.lease_timeout:
+                    return None
+                # The holder died or is stuck; at worst two workers then call upstream at once
+                logger.warning("Taking over expired single-flight lease %r", key)
+                self._remove(path)
+                continue
+            try:
+                os.write(fd, token.encode('ascii'))
+            finally:
+                os.close(fd)
+            return token
+        return None
+
+    def _failure(self, key: Hashable, since: float) -> Optional[str]:
+        """Return the failure recorded for key after since or within failure_ttl, else None"""
+        path = self._path(key, 'failed')
+        try:
+            with open(path, 'r') as f:
+                failed_at = os.fstat(f.fileno()).st_mtime
+                message = f.read()
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if failed_at >= min(since, now - self.failure_ttl):
+            return message
+        if now - failed_at > self.lease_timeout + self.failure_ttl:
+            # No caller can still be waiting on it
+            self._remove(path)
+        return None
+
+    def _finish(self, key: Hashable, token: str, failure: Optional[str]):
+        """Record the outcome for waiting workers and release the lease; failure is None on success"""
+        path = self._path(key, 'failed')
+        if failure is None:
+            self._remove(path)
+        else:
+            tmp_path = f'{path}.{token}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(failure)
+            os.replace(tmp_path, path)
+        lease_path = self._path(key, 'lease')
+        try:
+            with open(lease_path, 'r') as f:
+                held = f.read() == token
+        except FileNotFoundError:
+            return
+        # An expired lease may have been taken over; that one is not ours to remove
+        if held:
+            self._remove(lease_path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _poll(self, key: Hashable, recheck: Callable, since: float):
+        """
+        One round of waiting for key in another worker
+        Returns:
+            ('result', value) once recheck finds the shared result, ('failed', message) when the
+            computation failed, ('lead', token) when this caller took the lease, else ('wait', None)
+        """
+        result = recheck() if recheck is not None else None
+        if result is not None:
+            return 'result', result
+        failure = self._failure(key, since)
+        if failure is not None:
+            return 'failed', failure
+        token = self._take_lease(key)
+        if token is None:
+            return 'wait', None
+        # The previous leader may have published and left since the first recheck
+        result = recheck() if recheck is not None else None
+        if result is not None:
+            self._finish(key, token, None)
+            return 'result', result
+        return 'lead', token
+
+    @staticmethod
+    def _failed(message: str):
+        # An empty message records a computation that returned None
+        if message:
+            raise FlightFailed(message)
+        return None
+
+    @staticmethod
+    def _describe(error: Exception) -> str:
+        return f'{type(error).__name__}: {error}'
+
+    def do(self, key: Hashable, fn: Callable, recheck: Callable = None):
+        """
+        Return fn() for key, sharing one execution between concurrent callers
+        Args:
+            key: Identifies identical calls; also names the cross-process lease file
+            fn: Computes the result and publishes it to the shared cache; None means it failed
+            recheck: Returns the shared cached result, or None; polled while another worker
+                     holds the lease, so a waiting worker reuses the result it stores
+        Raises:
+            FlightFailed: fn raised in another worker while this caller waited, or shortly before
+        """
+        with self._lock:
+            # In-flight calls inherited across a fork have no thread to finish them
+            if self._pid != os.getpid():
+                self._calls = {}
+                self._pid = os.getpid()
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            since = time.time()
+            while True:
+                state, value = self._poll(key, recheck, since)
+                if state != 'wait':
+                    break
+                time.sleep(self.poll_interval)
+            if state == 'result':
+                call.result = value
+            elif state == 'failed':
+                call.result = self._failed(value)
+            else:
+                failure = 'Interrupted'
+                try:
+                    call.result = fn()
+                    failure = None if call.result is not None else ''
+                except Exception as e:
+                    failure = self._describe(e)
+                    raise
+                finally:
+                    self._finish(key, value, failure)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key: Hashable, coro_fn: Callable, recheck: Callable = None):
+        """Async counterpart of do; coro_fn returns an awaitable and recheck stays synchronous"""
+        loop = asyncio.get_running_loop()
+        call_key = (loop, key)
+        future = self._async_calls.get(call_key)
+        if future is not None:
+            # Shielded so a cancelled waiter does not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._async_calls[call_key] = future
+        try:
+            # Waiting sleeps on the event loop; threads only run the short file checks
+            since = time.time()
+            while True:
+                state, value = await asyncio.to_thread(self._poll, key, recheck, since)
+                if state != 'wait':
+                    break
+                await asyncio.sleep(self.poll_interval)
+            if state == 'result':
+                result = value
+            elif state == 'failed':
+                result = self._failed(value)
+            else:
+                failure = 'Interrupted'
+                try:
+                    result = await coro_fn()
+                    failure = None if result is not None else ''
+                except Exception as e:
+                    failure = self._describe(e)
+                    raise
+                finally:
+                    await asyncio.to_thread(self._finish, key, value, failure)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so a call without waiters does not log a warning
+            raise
+        finally:
+            del self._async_calls[call_key]
+            if not future.done():
+                future.cancel()
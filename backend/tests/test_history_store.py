@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from history_store import HistoryCache, JsonlHistoryStore, SqliteStore
+
+
+def make_store(backend, tmp_path, compact_every=4):
+    if backend == 'sqlite':
+        return SqliteStore(str(tmp_path / 'portfolio.db'), max_entries=1000, max_age_days=365, compact_every=compact_every)
+    return JsonlHistoryStore(str(tmp_path / 'history.jsonl'), max_entries=1000, max_age_days=365, compact_every=compact_every)
+
+
+def stamp(minutes):
+    start = datetime.now(timezone(timedelta(hours=-3))) - timedelta(days=1)
+    return (start + timedelta(minutes=minutes)).isoformat()
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_cache_matches_store_after_out_of_order_appends_and_compaction(backend, tmp_path):
+    store = make_store(backend, tmp_path)
+    cache = HistoryCache(store)
+    for minutes, value in [(1, 1.0), (3, 3.0), (2, 2.0), (4, 4.0)]:
+        store.append(value, stamp(minutes))
+        cache.series()
+
+    _, values, timestamps = cache.series()
+    assert list(values) == [1.0, 2.0, 3.0, 4.0]
+    assert timestamps == sorted(timestamps)
+
+
+def test_jsonl_read_from_returns_only_new_lines_and_waits_for_a_complete_line(tmp_path):
+    store = make_store('jsonl', tmp_path, compact_every=100)
+    store.append(1.0, stamp(1))
+    rows, cursor, kept = store.read_from(None)
+    assert kept == 0 and [row[2] for row in rows] == [1.0]
+
+    store.append(2.0, stamp(2))
+    with open(store.path, 'a') as f:
+        f.write('{"timestamp": "%s", "val' % stamp(3))
+    rows, cursor, kept = store.read_from(cursor)
+    assert kept is None and [row[2] for row in rows] == [2.0]
+
+    with open(store.path, 'a') as f:
+        f.write('ue": 3.0}\n')
+    rows, cursor, kept = store.read_from(cursor)
+    assert kept is None and [row[2] for row in rows] == [3.0]
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_read_from_across_a_compaction_matches_a_full_read(backend, tmp_path):
+    store = make_store(backend, tmp_path, compact_every=5)
+    store.max_entries = 4
+    for minutes in range(3):
+        store.append(float(minutes), stamp(minutes))
+    previous, cursor, _ = store.read_from(None)
+
+    # The fifth append compacts the history down to the newest four points
+    for minutes in range(3, 7):
+        store.append(float(minutes), stamp(minutes))
+    rows, _, kept = store.read_from(cursor)
+    merged = previous + rows if kept is None else previous[len(previous) - kept:] + rows
+
+    full, _, _ = store.read_from(None)
+    assert full[0][2] > 0.0
+    assert merged == full
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'sqlite'])
+def test_cache_follows_appends_and_compactions(backend, tmp_path):
+    store = make_store(backend, tmp_path, compact_every=7)
+    store.max_entries = 20
+    cache = HistoryCache(store)
+    for i in range(60):
+        store.append(100.0 + i % 9, stamp(i * 30))
+        if i % 4 == 0:
+            cache.rolling_metrics()
+
+    epochs, values, timestamps = cache.series()
+    fresh = HistoryCache(make_store(backend, tmp_path))
+    fresh.store.max_entries = 20
+    fresh_epochs, fresh_values, fresh_timestamps = fresh.series()
+    assert list(epochs) == list(fresh_epochs)
+    assert list(values) == list(fresh_values)
+    assert timestamps == fresh_timestamps
+    assert cache.rolling_metrics() == pytest.approx(fresh.rolling_metrics())
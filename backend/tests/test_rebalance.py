@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from rebalance import category_indices, rebalance, stack_portfolios, sweep
+
+SYMBOLS = ['BTC', 'ETH', 'USDT', 'USDC']
+PRICES = [100.0, 10.0, 1.0, 1.0]
+CATEGORIES = category_indices(SYMBOLS, {1: ['USDT', 'USDC']}, default_bucket=0)
+
+
+def test_category_indices_falls_back_to_the_default_bucket():
+    assert list(category_indices(['BTC', 'USDT', 'XYZ'], {1: ['USDT']}, default_bucket=0)) == [0, 1, 0]
+
+
+def test_rebalance_reaches_the_targets_and_keeps_weights_within_a_bucket():
+    amounts = [6.0, 20.0, 100.0, 100.0]  # 800 crypto (600 BTC, 200 ETH), 200 stable
+    result = rebalance(amounts, PRICES, CATEGORIES, [0.5, 0.5], threshold=5)
+
+    assert result['total'] == pytest.approx(1000.0)
+    assert list(result['bucket_pct']) == pytest.approx([80.0, 20.0])
+    assert list(result['drift']) == pytest.approx([30.0, -30.0])
+    assert bool(result['rebalance_needed'])
+    assert list(result['target_values']) == pytest.approx([375.0, 125.0, 250.0, 250.0])
+    assert list(result['amount_adjustments']) == pytest.approx([-2.25, -7.5, 150.0, 150.0])
+    assert result['value_adjustments'].sum() == pytest.approx(0.0)
+
+
+def test_rebalance_within_the_band_is_not_needed():
+    result = rebalance([5.0, 0.0, 500.0, 0.0], PRICES, CATEGORIES, [0.52, 0.48], threshold=5)
+
+    assert not bool(result['rebalance_needed'])
+
+
+def test_an_empty_bucket_is_bought_in_equal_parts_across_its_priced_members():
+    result = rebalance([10.0, 0.0, 0.0, 0.0], [100.0, 10.0, 1.0, 0.0], CATEGORIES, [0.5, 0.5], threshold=5)
+
+    # USDC has no price, so USDT takes the whole stable target
+    assert list(result['target_values']) == pytest.approx([500.0, 0.0, 500.0, 0.0])
+    assert list(result['target_amounts']) == pytest.approx([5.0, 0.0, 500.0, 0.0])
+
+
+def test_batched_portfolios_match_one_call_per_portfolio():
+    portfolios = [{'BTC': 6, 'USDT': 100}, {'ETH': 50, 'USDC': 10}, {}]
+    amounts = stack_portfolios(portfolios, SYMBOLS)
+    targets = np.array([[0.5, 0.5], [0.7, 0.3], [0.6, 0.4]])
+
+    batch = rebalance(amounts, PRICES, CATEGORIES, targets, threshold=5)
+
+    for row in range(len(portfolios)):
+        single = rebalance(amounts[row], PRICES, CATEGORIES, targets[row], threshold=5)
+        for name, values in single.items():
+            assert np.allclose(batch[name][row], values), name
+
+
+def test_sweep_trades_only_outside_the_band():
+    amounts = [6.0, 20.0, 100.0, 100.0]
+    result = sweep(amounts, PRICES, CATEGORIES, [[0.8, 0.2], [0.5, 0.5]], [5, 40])
+
+    # Target-major order: (0.8, 5), (0.8, 40), (0.5, 5), (0.5, 40)
+    assert [list(targets) for targets in result['targets']] == [[0.8, 0.2], [0.8, 0.2], [0.5, 0.5], [0.5, 0.5]]
+    assert list(result['thresholds']) == [5, 40, 5, 40]
+    assert list(result['rebalance_needed']) == [False, False, True, False]
+    assert list(result['turnover']) == pytest.approx([0.0, 0.0, 300.0, 0.0])
+    assert list(result['turnover_pct']) == pytest.approx([0.0, 0.0, 30.0, 0.0])
+    assert not result['applied_amount_adjustments'][3].any()
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import FlightFailed, SingleFlight
+
+
+# Instances sharing a lock directory coordinate like separate worker processes
+def make_workers(tmp_path, count=2, **kwargs):
+    return [SingleFlight(str(tmp_path), lease_timeout=5, poll_interval=0.01, **kwargs) for _ in range(count)]
+
+
+def test_waiting_worker_reuses_the_published_result(tmp_path):
+    first, second = make_workers(tmp_path)
+    cache = {}
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        cache['key'] = 'value'
+        return 'value'
+
+    leader = threading.Thread(target=first.do, args=('key', fetch), kwargs={'recheck': lambda: cache.get('key')})
+    leader.start()
+    started.wait(5)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(second.do('key', fetch, recheck=lambda: cache.get('key'))))
+    waiter.start()
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert results == ['value']
+    assert calls == [1]
+
+
+def test_unrelated_keys_do_not_wait_for_each_other(tmp_path):
+    first, second = make_workers(tmp_path)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    leader = threading.Thread(target=first.do, args=(('analysis', 'a'), slow))
+    leader.start()
+    started.wait(5)
+    try:
+        assert second.do(('quotes', 'BTC'), lambda: 'fast') == 'fast'
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_failure_is_reported_to_other_workers_without_repeating_the_call(tmp_path):
+    first, second = make_workers(tmp_path, failure_ttl=60)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        first.do('key', failing)
+    with pytest.raises(FlightFailed, match='upstream down'):
+        second.do('key', failing)
+    assert calls == [1]
+
+
+def test_failed_result_expires_after_the_failure_ttl(tmp_path):
+    first, second = make_workers(tmp_path, failure_ttl=0)
+
+    assert first.do('key', lambda: None) is None
+    assert second.do('key', lambda: 'fresh') == 'fresh'
+
+
+def test_async_waiter_shares_the_call_and_leaves_no_lease(tmp_path):
+    (flights,) = make_workers(tmp_path, count=1)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def main():
+        return await asyncio.gather(*[flights.do_async('key', fetch) for _ in range(5)])
+
+    assert asyncio.run(main()) == ['value'] * 5
+    assert calls == [1]
+    assert not list(tmp_path.glob('*.lease'))
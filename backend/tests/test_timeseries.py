@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from timeseries import RollingMetrics, bucket_ohlc
+
+
+def make_series(points=24 * 40, step=3600, seed=7):
+    rng = np.random.default_rng(seed)
+    epochs = [1_700_000_000.0 + i * step for i in range(points)]
+    values = list(100 * np.exp(np.cumsum(rng.normal(0, 0.01, points))))
+    timestamps = [datetime.fromtimestamp(epoch, timezone.utc).isoformat() for epoch in epochs]
+    return epochs, values, timestamps
+
+
+def test_appending_point_by_point_matches_from_series():
+    epochs, values, timestamps = make_series()
+    metrics = RollingMetrics()
+    for epoch, value, timestamp in zip(epochs, values, timestamps):
+        metrics.append(epoch, value, timestamp)
+
+    assert metrics.summary() == pytest.approx(RollingMetrics.from_series(epochs, values, timestamps).summary())
+
+
+@pytest.mark.parametrize('removed', [1, 24, 24 * 9, 24 * 39])
+def test_retained_matches_from_series_of_the_remaining_points(removed):
+    epochs, values, timestamps = make_series()
+    metrics = RollingMetrics.from_series(epochs, values, timestamps)
+
+    retained = metrics.retained(epochs[removed:], values[removed:], timestamps[removed:])
+
+    expected = RollingMetrics.from_series(epochs[removed:], values[removed:], timestamps[removed:])
+    assert retained.summary() == pytest.approx(expected.summary())
+
+
+def test_retained_recomputes_the_drawdown_of_the_remaining_points():
+    epochs = [float(i * 60) for i in range(6)]
+    values = [200.0, 100.0, 50.0, 80.0, 90.0, 85.0]
+    timestamps = [str(epoch) for epoch in epochs]
+    metrics = RollingMetrics.from_series(epochs, values, timestamps)
+    assert metrics.summary()['max_drawdown'] == pytest.approx(-75.0)
+
+    # Without the 200 peak the worst drop is from 100 to 50
+    retained = metrics.retained(epochs[1:], values[1:], timestamps[1:])
+    assert retained.summary()['max_drawdown'] == pytest.approx(-50.0)
+    assert retained.summary()['drawdown'] == pytest.approx(-15.0)
+
+
+def test_windows_without_enough_history_report_none():
+    epochs, values, timestamps = make_series(points=48)
+    summary = RollingMetrics.from_series(epochs, values, timestamps).summary()
+
+    assert summary['change_24h'] == pytest.approx((values[-1] / values[-25] - 1) * 100)
+    assert summary['change_7d'] is None
+    assert summary['volatility_30d'] is None
+
+
+def test_bucket_ohlc_groups_contiguous_runs():
+    buckets = bucket_ohlc([0, 10, 59, 60, 125], [1.0, 3.0, 2.0, 5.0, 4.0], 60)
+
+    assert list(buckets['ts']) == [0, 60, 120]
+    assert list(buckets['open']) == [1.0, 5.0, 4.0]
+    assert list(buckets['high']) == [3.0, 5.0, 4.0]
+    assert list(buckets['low']) == [1.0, 5.0, 4.0]
+    assert list(buckets['close']) == [2.0, 5.0, 4.0]
+    assert list(buckets['count']) == [3, 1, 1]
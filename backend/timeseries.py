@@ -0,0 +1,200 @@
+import re
+import math
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Sequence
+
+import numpy as np
+
+RESOLUTION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+SECONDS_PER_YEAR = 365 * 86400
+ROLLING_WINDOWS = {'24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400}
+
+# Parse a resolution such as '15m', '1h' or '1d' into seconds
+def parse_resolution(resolution: str) -> int:
+    """Convert a resolution string into a bucket size in seconds"""
+    match = re.fullmatch(r'(\d+)([mhdw])', resolution.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid resolution '{resolution}', expected e.g. 15m, 1h, 1d or 1w")
+    return int(match.group(1)) * RESOLUTION_UNITS[match.group(2)]
+
+# Select the indices of points kept by Largest-Triangle-Three-Buckets
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> np.ndarray:
+    """Return indices of at most threshold points that preserve the visual shape of the series"""
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    n = len(xs)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.intp)
+
+    # Bucket i spans bounds[i]:bounds[i + 1]; the first and last points are kept on their own
+    bucket_size = (n - 2) / (threshold - 2)
+    bounds = np.append((np.arange(threshold - 1) * bucket_size).astype(np.intp) + 1, n)
+    # Average of the next bucket is the third triangle vertex, computed for every bucket at once
+    counts = np.diff(bounds[1:])
+    avg_x = (np.add.reduceat(xs, bounds[1:-1]) / counts).tolist()
+    avg_y = (np.add.reduceat(ys, bounds[1:-1]) / counts).tolist()
+    bounds = bounds.tolist()
+
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = a = 0
+    for i in range(threshold - 2):
+        # Each bucket's pick depends on the previous one, so only the scan within a bucket is vectorized
+        start, end = bounds[i], bounds[i + 1]
+        ax, ay = xs[a], ys[a]
+        area = np.abs((ax - avg_x[i]) * (ys[start:end] - ay) - (ax - xs[start:end]) * (avg_y[i] - ay))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+# Aggregate a time-ordered series into OHLC buckets
+def bucket_ohlc(epochs: Sequence[float], values: Sequence[float], bucket_seconds: int) -> Dict[str, np.ndarray]:
+    """Return bucket start epochs ('ts') with open/high/low/close values and point counts, vectorized"""
+    epochs = np.asarray(epochs, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(epochs) == 0:
+        empty = np.empty(0)
+        return {'ts': empty, 'open': empty, 'high': empty, 'low': empty, 'close': empty,
+                'count': np.empty(0, dtype=np.intp)}
+    buckets = epochs - np.mod(epochs, bucket_seconds)
+    # Points are time-ordered, so each bucket is a contiguous run
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(epochs)]
+    return {
+        'ts': buckets[starts],
+        'open': values[starts],
+        'high': np.maximum.reduceat(values, starts),
+        'low': np.minimum.reduceat(values, starts),
+        'close': values[ends - 1],
+        'count': ends - starts
+    }
+
+# Return and realized volatility over a trailing time window, updated one point at a time
+class RollingWindow:
+    """
+    Keeps the points newer than seconds before the latest point, the last point before
+    them as the return base (figures are None until one exists), and running sums of squared log returns; appends are amortized O(1)
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._points = deque()  # (epoch, value, squared log return, seconds since previous point)
+        self._anchor = None  # Latest (epoch, value) that fell out of the window
+        self._sum_r2 = 0.0
+        self._sum_dt = 0.0
+
+    def append(self, epoch: float, value: float, r2: float, dt: float):
+        self._points.append((epoch, value, r2, dt))
+        self._sum_r2 += r2
+        self._sum_dt += dt
+        cutoff = epoch - self.seconds
+        while self._points[0][0] <= cutoff:
+            old_epoch, old_value, old_r2, old_dt = self._points.popleft()
+            self._sum_r2 -= old_r2
+            self._sum_dt -= old_dt
+            self._anchor = (old_epoch, old_value)
+
+    def change_pct(self):
+        """Percent change from the value at the window start, or None if history does not reach back that far"""
+        if self._anchor is None or not self._points or self._anchor[1] <= 0:
+            return None
+        return (self._points[-1][1] / self._anchor[1] - 1) * 100
+
+    def volatility_pct(self):
+        """Annualized realized volatility of the window in percent, or None if history does not cover it"""
+        if self._anchor is None or self._sum_dt <= 0:
+            return None
+        return math.sqrt(max(self._sum_r2, 0.0) / self._sum_dt * SECONDS_PER_YEAR) * 100
+
+# Rolling return, volatility and drawdown figures for a value series
+class RollingMetrics:
+    """Running aggregates over a time-ordered series; append is amortized O(1) and summary is O(1)"""
+
+    def __init__(self, windows: Dict[str, float] = ROLLING_WINDOWS):
+        self.windows = {name: RollingWindow(seconds) for name, seconds in windows.items()}
+        self._last = None  # (epoch, value, timestamp)
+        self._peak = None
+        self._max_drawdown = 0.0
+        self._summary = self._build_summary()
+
+    @classmethod
+    def from_series(cls, epochs: Sequence[float], values: Sequence[float], timestamps: Sequence[str],
+                    windows: Dict[str, float] = ROLLING_WINDOWS) -> 'RollingMetrics':
+        """
+        Build the aggregates of a whole time-ordered series; only the points the windows can
+        still see are replayed, and the peak and max drawdown are computed in one vectorized pass
+        """
+        metrics = cls(windows)
+        if len(epochs) == 0:
+            return metrics
+        # The last point at or before the longest window's start becomes every window's anchor
+        first = max(bisect_right(epochs, epochs[-1] - max(windows.values())) - 1, 0)
+        for i in range(first, len(epochs)):
+            metrics._push(epochs[i], values[i], timestamps[i])
+
+        metrics._set_drawdown(values)
+        metrics._summary = metrics._build_summary()
+        return metrics
+
+    def retained(self, epochs: Sequence[float], values: Sequence[float], timestamps: Sequence[str]) -> 'RollingMetrics':
+        """
+        Return the aggregates of the series after its oldest points were removed, where epochs,
+        values and timestamps are what remains. The windows are kept when they do not reach
+        back to the removed points, and then only the drawdown figures are recomputed in place
+        """
+        if len(epochs) == 0 or any(
+            window._anchor is None or window._anchor[0] < epochs[0] for window in self.windows.values()
+        ):
+            return RollingMetrics.from_series(epochs, values, timestamps, {
+                name: window.seconds for name, window in self.windows.items()
+            })
+        self._set_drawdown(values)
+        self._summary = self._build_summary()
+        return self
+
+    def _set_drawdown(self, values: Sequence[float]):
+        value_array = np.array(values, dtype=float)
+        peaks = np.maximum.accumulate(value_array)
+        positive = peaks > 0
+        self._peak = float(peaks[-1])
+        self._max_drawdown = 0.0
+        if positive.any():
+            self._max_drawdown = min(float((value_array[positive] / peaks[positive] - 1).min()), 0.0)
+
+    def append(self, epoch: float, value: float, timestamp: str = None):
+        """Add the next point; epochs must not decrease"""
+        self._push(epoch, value, timestamp)
+        self._summary = self._build_summary()
+
+    def _push(self, epoch: float, value: float, timestamp: str):
+        r2 = dt = 0.0
+        if self._last is not None:
+            previous_epoch, previous_value, _ = self._last
+            dt = max(epoch - previous_epoch, 0.0)
+            if previous_value > 0 and value > 0:
+                r2 = math.log(value / previous_value) ** 2
+        for window in self.windows.values():
+            window.append(epoch, value, r2, dt)
+
+        self._peak = value if self._peak is None else max(self._peak, value)
+        if self._peak > 0:
+            self._max_drawdown = min(self._max_drawdown, value / self._peak - 1)
+        self._last = (epoch, value, timestamp)
+
+    def _build_summary(self) -> Dict:
+        summary = {}
+        for name, window in self.windows.items():
+            summary[f'change_{name}'] = window.change_pct()
+            summary[f'volatility_{name}'] = window.volatility_pct()
+        last_value = self._last[1] if self._last else None
+        summary['drawdown'] = (last_value / self._peak - 1) * 100 if self._peak else None
+        summary['max_drawdown'] = self._max_drawdown * 100 if self._last else None
+        summary['as_of'] = self._last[2] if self._last else None
+        return summary
+
+    def summary(self) -> Dict:
+        """Latest figures in percent: change_<window>, volatility_<window>, drawdown, max_drawdown, as_of"""
+        return self._summary
@@ -15,6 +15,9 @@ const API_URL = process.env.NODE_ENV === 'production'
 
 console.log('Using API URL:', API_URL);
 
+const ANALYSIS_POLL_INTERVAL_MS = 2000;
+const ANALYSIS_POLL_MAX_ATTEMPTS = 60;
+
 function App() {
   const [portfolioData, setPortfolioData] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -29,12 +32,39 @@ function App() {
     document.body.classList.toggle('dark-mode', darkMode);
   }, [darkMode]);
 
+  // Poll a background analysis job until the narrative is ready
+  const pollAnalysisJob = async (jobId) => {
+    for (let attempt = 0; attempt < ANALYSIS_POLL_MAX_ATTEMPTS; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, ANALYSIS_POLL_INTERVAL_MS));
+      try {
+        const response = await axios.get(`${API_URL}/portfolio/analysis/jobs/${jobId}`);
+        const job = response.data;
+        if (job.status === 'done') {
+          setPortfolioData(current => ({ ...current, analysis: job.analysis, timestamp: job.timestamp }));
+          return;
+        }
+        if (job.status === 'failed') {
+          console.error('Analysis job failed:', job.error);
+          return;
+        }
+      } catch (err) {
+        // Every worker can report a job once it is created, so a 404 is final as well
+        console.error('Error polling analysis job:', err);
+        return;
+      }
+    }
+  };
+
   const fetchData = async () => {
     try {
       console.log('Fetching data from:', API_URL);
-      const response = await axios.get(`${API_URL}/portfolio/analysis`);
-      setPortfolioData(response.data);
+      const response = await axios.post(`${API_URL}/portfolio/analysis/jobs`);
+      const { status, job_id: jobId, ...data } = response.data;
+      setPortfolioData(data);
       setLoading(false);
+      if (status !== 'done') {
+        pollAnalysisJob(jobId);
+      }
     } catch (err) {
       console.error('Error fetching data:', err);
       setError(err.response?.data?.error || 'Failed to fetch portfolio data');
@@ -26,7 +26,7 @@ function PortfolioHistory() {
   useEffect(() => {
     const fetchHistory = async () => {
       try {
-        const response = await axios.get(`${API_URL}/portfolio/history`);
+        const response = await axios.get(`${API_URL}/portfolio/history`, { params: { max_points: 500 } });
         console.log('History response:', response.data);
         
         if (response.data && Array.isArray(response.data.history)) {
@@ -15,7 +15,7 @@ const PortfolioSummary = ({ data }) => {
 
   if (!data || !data.total_brl) return null;
 
-  const { total_brl, assets, changes } = data;
+  const { total_brl, assets, changes, prices_stale, prices_age_seconds } = data;
   
   const COLORS = ['#3b82f6', '#10b981', '#f59e0b', '#6366f1', '#ec4899', '#8b5cf6'];
 
@@ -71,7 +71,20 @@ const PortfolioSummary = ({ data }) => {
                 {formatPercentage(changes?.change_7d)}
               </span>
             </div>
+            {changes?.change_30d != null && (
+              <div className="variation">
+                <span className="variation-label">30d:</span>
+                <span className={getVariationClass(changes.change_30d)}>
+                  {formatPercentage(changes.change_30d)}
+                </span>
+              </div>
+            )}
           </div>
+          {prices_stale && (
+            <div className="variation-label">
+              Preços de {Math.max(1, Math.round(prices_age_seconds / 60))} min atrás, atualizando...
+            </div>
+          )}
         </div>
       </div>
 